@@ -0,0 +1,85 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-10-01 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # databases created before the migration history only need `alembic stamp 0001`
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('hashed_password', sa.String(), nullable=True),
+        sa.Column('referral_code', sa.String(), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('is_superuser', sa.Boolean(), nullable=True),
+        sa.Column('role', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username', name='users_username_key'),
+        sa.UniqueConstraint('referral_code', name='users_referral_code_key')
+    )
+    op.create_table(
+        'transactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('transaction_type', sa.String(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('transaction_date', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_transactions_id', 'transactions', ['id'])
+    op.create_table(
+        'referrals',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('referrer_id', sa.Integer(), nullable=False),
+        sa.Column('referred_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['referred_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['referrer_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_referrals_id', 'referrals', ['id'])
+    op.create_table(
+        'wallet',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('balance', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('first_line', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('second_line', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('purchases', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_wallet_id', 'wallet', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_wallet_id', table_name='wallet')
+    op.drop_table('wallet')
+    op.drop_index('ix_referrals_id', table_name='referrals')
+    op.drop_table('referrals')
+    op.drop_index('ix_transactions_id', table_name='transactions')
+    op.drop_table('transactions')
+    op.drop_table('users')
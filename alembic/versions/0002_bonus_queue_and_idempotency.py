@@ -0,0 +1,57 @@
+"""bonus queue marker, one wallet per user and idempotency keys
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-10-08 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('transactions', sa.Column('bonus_pending', sa.Boolean(), nullable=False,
+                                            server_default=sa.false()))
+    # the wallet upsert relies on ON CONFLICT (user_id). The old check-then-create path could
+    # create a second wallet for a user, those are merged into the oldest one first
+    op.execute(
+        "UPDATE wallet AS kept SET balance = merged.balance, first_line = merged.first_line, "
+        "second_line = merged.second_line, purchases = merged.purchases, updated_at = now() "
+        "FROM (SELECT min(id) AS id, sum(coalesce(balance, 0)) AS balance, "
+        "sum(coalesce(first_line, 0)) AS first_line, "
+        "sum(coalesce(second_line, 0)) AS second_line, "
+        "sum(coalesce(purchases, 0)) AS purchases "
+        "FROM wallet GROUP BY user_id HAVING count(*) > 1) AS merged "
+        "WHERE kept.id = merged.id"
+    )
+    op.execute(
+        "DELETE FROM wallet AS extra USING wallet AS kept "
+        "WHERE extra.user_id = kept.user_id AND extra.id > kept.id"
+    )
+    op.create_unique_constraint('wallet_user_id_key', 'wallet', ['user_id'])
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('scope', sa.String(length=50), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('response', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('scope', 'key', name='uq_idempotency_keys_scope_key')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('idempotency_keys')
+    op.drop_constraint('wallet_user_id_key', 'wallet', type_='unique')
+    op.drop_column('transactions', 'bonus_pending')
@@ -0,0 +1,54 @@
+"""referral closure table
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-10-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'referral_paths',
+        sa.Column('ancestor_id', sa.Integer(), nullable=False),
+        sa.Column('descendant_id', sa.Integer(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['ancestor_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['descendant_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_referral_paths_descendant_id_depth', 'referral_paths',
+                    ['descendant_id', 'depth'])
+    # the same backfill as `python -m app.commands rebuild-referral-paths`, a walk stops at
+    # a user already on its path, so a referral cycle in old data cannot loop forever
+    op.execute("""
+        INSERT INTO referral_paths (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE paths(ancestor_id, descendant_id, depth, path) AS (
+            SELECT referrer_id, referred_id, 1, ARRAY[referrer_id, referred_id]
+            FROM referrals WHERE referrer_id <> referred_id
+            UNION ALL
+            SELECT paths.ancestor_id, referrals.referred_id, paths.depth + 1,
+                   paths.path || referrals.referred_id
+            FROM paths JOIN referrals ON referrals.referrer_id = paths.descendant_id
+            WHERE referrals.referred_id <> ALL(paths.path)
+        )
+        SELECT ancestor_id, descendant_id, min(depth) FROM paths
+        WHERE ancestor_id <> descendant_id
+        GROUP BY ancestor_id, descendant_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_referral_paths_descendant_id_depth', table_name='referral_paths')
+    op.drop_table('referral_paths')
@@ -0,0 +1,31 @@
+"""referral code sequence and unique user emails
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-10-22 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the referral code generator reads this sequence, a database built with create_all
+    # since then already has it
+    op.execute(sa.schema.CreateSequence(sa.Sequence('referral_code_seq'), if_not_exists=True))
+    # fails while two users share an email, those accounts have to be resolved first
+    op.create_unique_constraint('users_email_key', 'users', ['email'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('users_email_key', 'users', type_='unique')
+    op.execute(sa.schema.DropSequence(sa.Sequence('referral_code_seq'), if_exists=True))
@@ -0,0 +1,53 @@
+"""indexes for the hot query shapes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-10-29 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# name, table, columns, partial index predicate
+INDEXES = [
+    ('ix_transactions_duplicate_check', 'transactions',
+     ['user_id', 'transaction_type', 'amount', 'transaction_date'], None),
+    ('ix_transactions_user_id_transaction_date', 'transactions',
+     ['user_id', 'transaction_date', 'id'], None),
+    ('ix_transactions_payouts', 'transactions',
+     ['user_id', 'transaction_date'], "transaction_type = 'request_payout'"),
+    ('ix_transactions_bonus_pending', 'transactions', ['id'], 'bonus_pending'),
+    ('ix_referrals_referred_id', 'referrals', ['referred_id'], None),
+    ('ix_referrals_referrer_id', 'referrals', ['referrer_id'], None),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY does not block writes but cannot run inside a transaction,
+    # an interrupted build leaves an invalid index that if_not_exists would keep,
+    # drop it by hand before running the migration again
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_concurrently=True,
+                postgresql_where=sa.text(where) if where else None,
+                if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True,
+                          if_exists=True)
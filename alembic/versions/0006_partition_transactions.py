@@ -0,0 +1,124 @@
+"""partition transactions by month of transaction_date
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-11-05 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+MONTHS_AHEAD = 3
+
+INDEXES = (
+    "CREATE INDEX ix_transactions_id ON transactions (id)",
+    "CREATE INDEX ix_transactions_duplicate_check "
+    "ON transactions (user_id, transaction_type, amount, transaction_date)",
+    "CREATE INDEX ix_transactions_user_id_transaction_date "
+    "ON transactions (user_id, transaction_date, id)",
+    "CREATE INDEX ix_transactions_payouts ON transactions (user_id, transaction_date) "
+    "WHERE transaction_type = 'request_payout'",
+    "CREATE INDEX ix_transactions_bonus_pending ON transactions (id) WHERE bonus_pending",
+)
+
+
+def upgrade() -> None:
+    # the rows are copied inside one transaction that locks the table, plan a maintenance
+    # window for a large table. The id sequence is kept, so ids continue where they stopped
+    op.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    op.execute("ALTER TABLE transactions_unpartitioned "
+               "RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey")
+    for name in ('ix_transactions_id', 'ix_transactions_duplicate_check',
+                 'ix_transactions_user_id_transaction_date', 'ix_transactions_payouts',
+                 'ix_transactions_bonus_pending'):
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            transaction_type VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            transaction_date TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            bonus_pending BOOLEAN NOT NULL DEFAULT false,
+            CONSTRAINT transactions_pkey PRIMARY KEY (id, transaction_date)
+        ) PARTITION BY RANGE (transaction_date)
+    """)
+    # one partition per month from the oldest transaction to a few months ahead,
+    # the same names and UTC bounds as app.db.partitions
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN SELECT generate_series(
+                date_trunc('month', coalesce(
+                    (SELECT min(transaction_date) FROM transactions_unpartitioned), now())
+                    AT TIME ZONE 'UTC'),
+                date_trunc('month', now() AT TIME ZONE 'UTC')
+                    + interval '{MONTHS_AHEAD} months',
+                interval '1 month')::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                    'transactions_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                    month::text || ' 00:00:00+00',
+                    (month + interval '1 month')::date::text || ' 00:00:00+00');
+            END LOOP;
+        END $$
+    """)
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+    op.execute("""
+        INSERT INTO transactions (id, user_id, transaction_type, amount,
+                                  transaction_date, bonus_pending)
+        SELECT id, user_id, transaction_type, amount,
+               coalesce(transaction_date, now()), bonus_pending
+        FROM transactions_unpartitioned
+    """)
+    op.execute("DROP TABLE transactions_unpartitioned")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    # indexes of the parent table are created on every partition, now and later
+    for statement in INDEXES:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE transactions RENAME TO transactions_partitioned")
+    op.execute("ALTER TABLE transactions_partitioned "
+               "RENAME CONSTRAINT transactions_pkey TO transactions_partitioned_pkey")
+    for name in ('ix_transactions_id', 'ix_transactions_duplicate_check',
+                 'ix_transactions_user_id_transaction_date', 'ix_transactions_payouts',
+                 'ix_transactions_bonus_pending'):
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            transaction_type VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            transaction_date TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            bonus_pending BOOLEAN NOT NULL DEFAULT false,
+            CONSTRAINT transactions_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("""
+        INSERT INTO transactions (id, user_id, transaction_type, amount,
+                                  transaction_date, bonus_pending)
+        SELECT id, user_id, transaction_type, amount, transaction_date, bonus_pending
+        FROM transactions_partitioned
+    """)
+    # drops the partitions as well, detached ones are left alone
+    op.execute("DROP TABLE transactions_partitioned")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    for statement in INDEXES:
+        op.execute(statement)
@@ -0,0 +1,30 @@
+"""bind idempotency keys to a request fingerprint and index them for the purge
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-11-20 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the keys stored so far have no fingerprint, they keep replaying to any request
+    op.add_column('idempotency_keys', sa.Column('request_hash', sa.String(length=64),
+                                                nullable=True))
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_column('idempotency_keys', 'request_hash')
@@ -0,0 +1,50 @@
+"""one referrer per user
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-11-27 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the old check-then-insert path could give a user a second referrer, the oldest
+    # referral is kept and the closure table is built again without the others
+    op.execute(
+        "DELETE FROM referrals AS extra USING referrals AS kept "
+        "WHERE extra.referred_id = kept.referred_id AND extra.id > kept.id"
+    )
+    op.execute("DELETE FROM referral_paths")
+    op.execute("""
+        INSERT INTO referral_paths (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE paths(ancestor_id, descendant_id, depth, path) AS (
+            SELECT referrer_id, referred_id, 1, ARRAY[referrer_id, referred_id]
+            FROM referrals WHERE referrer_id <> referred_id
+            UNION ALL
+            SELECT paths.ancestor_id, referrals.referred_id, paths.depth + 1,
+                   paths.path || referrals.referred_id
+            FROM paths JOIN referrals ON referrals.referrer_id = paths.descendant_id
+            WHERE referrals.referred_id <> ALL(paths.path)
+        )
+        SELECT ancestor_id, descendant_id, min(depth) FROM paths
+        WHERE ancestor_id <> descendant_id
+        GROUP BY ancestor_id, descendant_id
+    """)
+    # the index of the constraint replaces the plain one
+    op.drop_index('ix_referrals_referred_id', table_name='referrals')
+    op.create_unique_constraint('referrals_referred_id_key', 'referrals', ['referred_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('referrals_referred_id_key', 'referrals', type_='unique')
+    op.create_index('ix_referrals_referred_id', 'referrals', ['referred_id'])
@@ -16,15 +16,21 @@ def create_access_token(data: dict):
 async def verify_token(token: str):
     """this functions verifies the provided JWT token, checking for
        expiration and validity"""
+    payload = decode_token(token)
+    return payload["sub"]
+
+
+def decode_token(token: str) -> dict:
+    """this function checks the signature and expiration of the token
+       and returns its claims"""
     try:
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM])
         exp = payload.get('exp')
         if exp is not None and datetime.utcfromtimestamp(exp) < datetime.utcnow():
             raise TokenExpiredException("Token has expired")
-        email = payload.get("sub")
-        if email is None:
+        if payload.get("sub") is None:
             raise CredentialsException("Could not validate credentials")
-        return email
+        return payload
     except jwt.ExpiredSignatureError as exc:
         raise TokenExpiredException("Token has expired") from exc
     except jwt.InvalidTokenError as exc:
@@ -0,0 +1,77 @@
+import hashlib
+import time
+from typing import Callable, Optional, Tuple
+from app.core.config import settings
+from app.schemas.schema import AuthenticatedUser
+from app.utils.cache import TTLCache
+
+
+class TokenCache:
+    """caches the verified claims of a token with a snapshot of its user, keyed by the
+    sha256 of the token so raw tokens are never kept in memory. An entry never outlives
+    the token's exp, and the cache is per process, so a deactivation in another worker
+    becomes visible after the TTL"""
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.time):
+        self.cache = TTLCache(max_size, ttl)
+        self.clock = clock
+        # user_id -> token keys of the user, used to drop them all at once
+        self._user_keys = {}
+
+
+    @staticmethod
+    def key(token: str) -> str:
+        """returns the cache key of the token"""
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
+    def get(self, token: str) -> Optional[Tuple[dict, AuthenticatedUser]]:
+        """returns the cached claims and user snapshot of the token or None"""
+        return self.cache.get(self.key(token))
+
+
+    def put(self, token: str, claims: dict, user: AuthenticatedUser) -> None:
+        """stores the verified token until the TTL or the token's exp, whichever is sooner"""
+        ttl = self.cache.ttl
+        exp = claims.get("exp")
+        if exp is not None:
+            ttl = min(ttl, exp - self.clock())
+        if ttl <= 0:
+            return
+        key = self.key(token)
+        self.cache.set(key, (claims, user), ttl=ttl)
+        live_keys = {k for k in self._user_keys.get(user.id, ()) if k in self.cache}
+        live_keys.add(key)
+        self._user_keys[user.id] = live_keys
+        if len(self._user_keys) > self.cache.max_size:
+            # forget the users whose tokens all expired or were evicted
+            self._user_keys = {user_id: keys for user_id, keys in self._user_keys.items()
+                               if any(k in self.cache for k in keys)}
+
+
+    def invalidate_token(self, token: str) -> None:
+        """drops the token, e.g. on logout"""
+        self.cache.pop(self.key(token))
+
+
+    def invalidate_user(self, user_id: int) -> None:
+        """drops every token of the user, call it when a user is deactivated,
+           deleted or changes credentials"""
+        for key in self._user_keys.pop(user_id, ()):
+            self.cache.pop(key)
+
+
+    def clear(self) -> None:
+        """drops all tokens"""
+        self.cache.clear()
+        self._user_keys.clear()
+
+
+    def stats(self) -> dict:
+        """returns the hit and miss counters used to size the cache"""
+        return self.cache.stats()
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_CACHE_MAX_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL_SECONDS
+)
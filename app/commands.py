@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import logging
+from app.core.config import settings
+from app.db.database import async_session_maker, engine
+from app.db.partitions import detach_partitions
+from app.services.maintenance_worker import purge_idempotency_keys, create_transaction_partitions
+from app.services.referral_tree import ReferralTree
+from app.services.transaction_service import TransactionService
+
+
+async def rebuild_referral_paths() -> None:
+    """recomputes the referral closure table from the referrals table"""
+    async with async_session_maker() as session:
+        await ReferralTree(session).rebuild()
+
+
+async def rebuild_rollups() -> None:
+    """recomputes the daily bonus and payout rollups from the transactions"""
+    async with async_session_maker() as session:
+        await TransactionService(session).rebuild_rollups()
+
+
+async def detach_old_transaction_partitions() -> None:
+    """detaches, or drops, the transaction partitions that are past the retention period"""
+    if settings.TRANSACTION_RETENTION_MONTHS is None:
+        logging.getLogger(__name__).info("TRANSACTION_RETENTION_MONTHS is not set")
+        return
+    async with engine.begin() as conn:
+        await detach_partitions(conn, settings.TRANSACTION_RETENTION_MONTHS,
+                                drop=settings.TRANSACTION_RETENTION_DROP)
+
+
+COMMANDS = {
+    "rebuild-referral-paths": rebuild_referral_paths,
+    "rebuild-rollups": rebuild_rollups,
+    "create-transaction-partitions": create_transaction_partitions,
+    "detach-old-transaction-partitions": detach_old_transaction_partitions,
+    "purge-idempotency-keys": purge_idempotency_keys,
+}
+
+
+def main() -> None:
+    """runs a maintenance command: python -m app.commands <command>"""
+    parser = argparse.ArgumentParser(prog="python -m app.commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(COMMANDS[args.command]())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -21,6 +22,84 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     TOKEN_KEY: str
 
+    # "memory" for a single process, "database" when several workers share the database
+    DUPLICATE_GUARD_BACKEND: str = "memory"
+    DUPLICATE_GUARD_TTL_SECONDS: int = 60
+    DUPLICATE_GUARD_MAX_SIZE: int = 100_000
+
+    IDEMPOTENCY_CACHE_TTL_SECONDS: int = 600
+    IDEMPOTENCY_CACHE_MAX_SIZE: int = 10_000
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = 3600.0
+
+    # the periodic housekeeping jobs of the process
+    MAINTENANCE_WORKER_ENABLED: bool = True
+    MAINTENANCE_TICK_SECONDS: float = 60.0
+
+    BONUS_WORKER_ENABLED: bool = True
+    BONUS_WORKER_BATCH_SIZE: int = 500
+    BONUS_WORKER_POLL_SECONDS: float = 0.5
+    BONUS_WORKER_SWEEP_SECONDS: float = 30.0
+
+    BALANCE_CACHE_MAX_SIZE: int = 50_000
+    BALANCE_CACHE_TTL_SECONDS: int = 30
+
+    ANCESTOR_CACHE_MAX_SIZE: int = 100_000
+    # the cache is per process, a referral removed by another worker is seen after the ttl
+    ANCESTOR_CACHE_TTL_SECONDS: int = 5
+
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+
+    TOKEN_CACHE_MAX_SIZE: int = 10_000
+    TOKEN_CACHE_TTL_SECONDS: int = 60
+
+    # size workers so that workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) < max_connections
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # set to 0 behind pgbouncer in transaction mode
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_COMMAND_TIMEOUT: Optional[float] = None
+
+    # replicas share the primary's credentials, entries are "host" or "host:port"
+    POSTGRES_REPLICA_HOSTS: List[str] = []
+    REPLICA_FAILURE_COOLDOWN_SECONDS: float = 30.0
+    # reads go to the primary for this long after a write of the same client
+    READ_YOUR_WRITES_SECONDS: int = 5
+    READ_PRIMARY_COOKIE: str = "read_primary"
+
+    # the key of the referral code permutation, changing it may repeat already issued codes
+    REFERRAL_CODE_KEY: str = "referral-code"
+    REFERRAL_CODE_POOL_SIZE: int = 100
+    REFERRAL_CODE_POOL_REFILL_AT: int = 20
+
+    # monthly partitions of the transactions table are created this many months ahead
+    TRANSACTION_PARTITION_MONTHS_AHEAD: int = 3
+    TRANSACTION_PARTITIONS_ON_STARTUP: bool = True
+    # the maintenance worker checks the partitions ahead this often
+    TRANSACTION_PARTITION_INTERVAL_SECONDS: float = 86400.0
+    # older partitions are detached by the retention command, None keeps every month
+    TRANSACTION_RETENTION_MONTHS: Optional[int] = None
+    TRANSACTION_RETENTION_DROP: bool = False
+
+    # the timezone that decides the day of a transaction in the bonus and payout rollups
+    ROLLUP_TIMEZONE: str = "Europe/Kyiv"
+
+    # request and query metrics served on /metrics, DEBUG adds the query count to the responses
+    METRICS_ENABLED: bool = True
+
+    # statements slower than the threshold are logged with their caller, None turns the log off
+    SLOW_QUERY_THRESHOLD_MS: Optional[float] = None
+    SLOW_QUERY_LOG_PER_MINUTE: int = 10
+    # the plan of a slow statement is captured, a plain read with EXPLAIN ANALYZE, which runs
+    # it once more, anything that writes, locks or calls a volatile function with EXPLAIN
+    SLOW_QUERY_EXPLAIN: bool = True
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS: int = 5000
+
 
     @property
     def DATABASE_URL(self) -> str:
@@ -31,6 +110,19 @@ class Settings(BaseSettings):
                f"{self.POSTGRES_DB}"
 
 
+    @property
+    def REPLICA_DATABASE_URLS(self) -> List[str]:
+        """returns the connection URLs of the read replicas"""
+        urls = []
+        for replica in self.POSTGRES_REPLICA_HOSTS:
+            host, _, port = replica.partition(":")
+            urls.append("postgresql+asyncpg://"
+                        f"{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@"
+                        f"{host}:{port or self.POSTGRES_PORT}/"
+                        f"{self.POSTGRES_DB}")
+        return urls
+
+
     class Config:
         """this class defines environment file settings"""
         # pylint: disable=R0903
@@ -1,14 +1,149 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List
+from fastapi import Request
+from sqlalchemy import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.db.pool import InstrumentedAsyncQueuePool
+from app.utils.crud_repository import queries_saved
+from app.utils.metrics import instrument_engine
+from app.utils.slow_query_log import SlowQueryLog
 
 
-engine = create_async_engine(settings.DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+
+def create_engine_from_settings(url: str) -> AsyncEngine:
+    """creates an asyncpg engine with the pool and statement cache configured in the settings"""
+    connect_args = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    if settings.DB_COMMAND_TIMEOUT is not None:
+        connect_args["command_timeout"] = settings.DB_COMMAND_TIMEOUT
+    # SQLAlchemy keeps its own prepared statement cache on top of the asyncpg one
+    url = make_url(url).update_query_dict(
+        {"prepared_statement_cache_size": str(settings.DB_STATEMENT_CACHE_SIZE)})
+    engine = create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args
+    )
+    if settings.METRICS_ENABLED:
+        instrument_engine(engine)
+    if settings.SLOW_QUERY_THRESHOLD_MS is not None:
+        SlowQueryLog(settings.SLOW_QUERY_THRESHOLD_MS,
+                     per_minute=settings.SLOW_QUERY_LOG_PER_MINUTE,
+                     explain=settings.SLOW_QUERY_EXPLAIN,
+                     explain_timeout_ms=settings.SLOW_QUERY_EXPLAIN_TIMEOUT_MS).install(engine)
+    return engine
+
+
+class ReplicaRouter:
+    """hands out the replica engines round-robin. A replica that failed to connect
+    is skipped until its cooldown has passed"""
+    def __init__(self, engines: List[AsyncEngine], cooldown: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.engines = engines
+        self.session_makers = [sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                               for engine in engines]
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = [0] * len(engines)
+        self._down_until = [0.0] * len(engines)
+        self._next = 0
+
+
+    def candidates(self) -> List[int]:
+        """returns the indexes of the healthy replicas, starting with the next one in turn"""
+        if not self.engines:
+            return []
+        start = self._next
+        self._next = (self._next + 1) % len(self.engines)
+        now = self.clock()
+        order = [(start + offset) % len(self.engines) for offset in range(len(self.engines))]
+        return [index for index in order if self._down_until[index] <= now]
+
+
+    def mark_failed(self, index: int) -> None:
+        """takes the replica out of the rotation for the cooldown"""
+        self.failures[index] += 1
+        self._down_until[index] = self.clock() + self.cooldown
+
+
+    def stats(self) -> List[dict]:
+        """returns the health and pool statistics of every replica"""
+        now = self.clock()
+        return [{
+            "host": engine.url.host,
+            "healthy": self._down_until[index] <= now,
+            "failures": self.failures[index],
+            **engine.pool.stats()
+        } for index, engine in enumerate(self.engines)]
+
+
+engine = create_engine_from_settings(settings.DATABASE_URL)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+replica_router = ReplicaRouter(
+    [create_engine_from_settings(url) for url in settings.REPLICA_DATABASE_URLS],
+    cooldown=settings.REPLICA_FAILURE_COOLDOWN_SECONDS
+)
+
 async def get_async_session() -> AsyncSession:
     """this function returns a new asynchronous database session"""
     async with async_session_maker() as session:
         yield session
+        log_queries_saved(session)
+
+
+def log_queries_saved(session: AsyncSession) -> None:
+    """logs how many repeated lookups the request-scoped read cache answered"""
+    saved = queries_saved(session)
+    if saved:
+        logger.debug("Read cache saved %d queries in this request", saved)
+
+
+@asynccontextmanager
+async def open_read_session(prefer_primary: bool = False) -> AsyncIterator[AsyncSession]:
+    """opens a session on a healthy replica, the primary is used when there is
+       no replica, none of them answers or the caller needs its own writes"""
+    if not prefer_primary:
+        for index in replica_router.candidates():
+            session = replica_router.session_makers[index]()
+            try:
+                # connect eagerly, so a dead replica fails over before the first query
+                await session.connection()
+            except (OSError, DBAPIError, asyncio.TimeoutError) as e:
+                await session.close()
+                replica_router.mark_failed(index)
+                logger.warning("Replica %s is unavailable: %s",
+                               replica_router.engines[index].url.host, str(e))
+                continue
+            async with session:
+                yield session
+                log_queries_saved(session)
+            return
+    async with async_session_maker() as session:
+        yield session
+        log_queries_saved(session)
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """this function returns a session for read-only endpoints, it reads from
+       the primary for a few seconds after the client wrote something"""
+    prefer_primary = request.cookies.get(settings.READ_PRIMARY_COOKIE) is not None
+    async with open_read_session(prefer_primary) as session:
+        yield session
 
 
+def pool_stats() -> dict:
+    """returns the live statistics of the connection pools"""
+    return {**engine.pool.stats(), "replicas": replica_router.stats()}
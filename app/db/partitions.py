@@ -0,0 +1,105 @@
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional
+from sqlalchemy import text, select, func
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLE = "transactions"
+DEFAULT_PARTITION = "transactions_default"
+PARTITION_NAME = re.compile(r"^transactions_y(\d{4})m(\d{2})$")
+# the advisory lock that keeps the partition jobs of several workers from racing
+PARTITION_LOCK_ID = 0x7472616E73
+
+
+def month_start(value: date) -> date:
+    """returns the first day of the month of the date"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    """returns the first day of the month that is the given number of months away"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """returns the name of the partition that holds the transactions of the month"""
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """returns the month of a monthly partition or None for any other table"""
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def create_partition_ddl(month: date) -> str:
+    """returns the statement that creates the partition of the month, the bounds are
+       in UTC so they do not depend on the timezone of the connection"""
+    return (f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+            f"PARTITION OF {PARTITIONED_TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+            f"TO ('{add_months(month, 1).isoformat()} 00:00:00+00')")
+
+
+def current_month() -> date:
+    """returns the first day of the current month in UTC"""
+    return month_start(datetime.now(timezone.utc).date())
+
+
+async def list_partitions(conn: AsyncConnection) -> List[str]:
+    """returns the names of the partitions attached to the transactions table"""
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table ORDER BY child.relname"
+    ), {"table": PARTITIONED_TABLE})
+    return list(result.scalars().all())
+
+
+async def lock_partitions(conn: AsyncConnection) -> None:
+    """waits for the partition jobs of the other workers, the lock is held until the
+       transaction of the connection ends"""
+    await conn.execute(select(func.pg_advisory_xact_lock(PARTITION_LOCK_ID)))
+
+
+async def ensure_partitions(conn: AsyncConnection, months_ahead: int,
+                            today: Optional[date] = None) -> List[str]:
+    """creates the partitions from the current month to months_ahead months ahead and
+       returns the names of the new ones. Creating a partition fails while the default
+       partition holds rows of its month, so the job has to run before a month starts"""
+    month = month_start(today) if today else current_month()
+    existing = set(await list_partitions(conn))
+    created = []
+    for offset in range(months_ahead + 1):
+        target = add_months(month, offset)
+        if partition_name(target) in existing:
+            continue
+        await conn.execute(text(create_partition_ddl(target)))
+        created.append(partition_name(target))
+        logger.info("Created partition %s", partition_name(target))
+    return created
+
+
+async def detach_partitions(conn: AsyncConnection, keep_months: int, drop: bool = False,
+                            today: Optional[date] = None) -> List[str]:
+    """detaches the partitions older than keep_months months and returns their names,
+       a detached partition stays a regular table until it is dropped or archived,
+       which is much cheaper than deleting its rows"""
+    cutoff = add_months(month_start(today) if today else current_month(), -keep_months)
+    detached = []
+    for name in await list_partitions(conn):
+        month = partition_month(name)
+        if month is None or month >= cutoff:
+            continue
+        await conn.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}"))
+        if drop:
+            await conn.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+        logger.info("%s partition %s", "Dropped" if drop else "Detached", name)
+    return detached
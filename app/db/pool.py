@@ -0,0 +1,103 @@
+import bisect
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolMetrics:
+    """counts the checkouts of a pool and keeps a histogram of their latency"""
+    # upper bounds of the latency buckets in seconds, the last bucket is unbounded
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_checkout_seconds = 0.0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+
+    def observe(self, seconds: float, waited: bool, timed_out: bool = False) -> None:
+        """records one checkout, waited is True when the pool was exhausted"""
+        with self._lock:
+            self.histogram[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.total_checkout_seconds += seconds
+            if waited:
+                self.waits += 1
+                self.total_wait_seconds += seconds
+                self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+    def stats(self) -> dict:
+        """returns the counters and the cumulative latency histogram"""
+        with self._lock:
+            buckets, total = {}, 0
+            for bound, count in zip(self.BUCKETS + (float("inf"),), self.histogram):
+                total += count
+                buckets["+Inf" if bound == float("inf") else str(bound)] = total
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_checkout_seconds": round(
+                    self.total_checkout_seconds / (self.checkouts or 1), 6),
+                "avg_wait_seconds": round(self.total_wait_seconds / (self.waits or 1), 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+                "checkout_seconds_histogram": buckets
+            }
+
+
+class InstrumentedPoolMixin:
+    """times every checkout of a QueuePool, a checkout waits when all
+    pool_size + max_overflow connections are checked out"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+
+    def _do_get(self):
+        waited = -1 < self._max_overflow <= self._overflow and self.checkedin() == 0
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.observe(time.perf_counter() - started, waited, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - started, waited)
+        return connection
+
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+    def stats(self) -> dict:
+        """returns the live state of the pool with its checkout metrics"""
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "timeout": self.timeout(),
+            **self.metrics.stats()
+        }
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    """QueuePool with checkout metrics for sync engines"""
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool with checkout metrics for the asyncpg engine"""
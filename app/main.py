@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI, Request, HTTPException
 import logging
@@ -7,21 +8,48 @@ from starlette.responses import RedirectResponse, JSONResponse
 from starlette.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from app.core.config import settings
+from app.db.database import replica_router
 from app.routers.health_check import check_health
 from app.routers.user_route import router_user
 from app.routers.transaction_route import router_transaction
+from app.services.bonus_worker import bonus_worker
+from app.services.maintenance_worker import maintenance_worker, create_transaction_partitions
+from app.utils.metrics import MetricsMiddleware
+from app.utils.password_hasher import password_hasher
 from app.utils.exceptions import (
     TokenExpiredException,
     CredentialsException,
     TokenError,
-    TokenNotFoundException
+    TokenNotFoundException,
+    PasswordHasherBusyException
 )
 
 
 logger = logging.getLogger(__name__)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """starts the background workers and stops them on shutdown"""
+    if settings.TRANSACTION_PARTITIONS_ON_STARTUP:
+        try:
+            await create_transaction_partitions()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # the maintenance worker tries again on its first run
+            logger.exception("Could not create the transaction partitions: %s", str(e))
+        else:
+            maintenance_worker.postpone("create-transaction-partitions")
+    if settings.BONUS_WORKER_ENABLED:
+        bonus_worker.start()
+    if settings.MAINTENANCE_WORKER_ENABLED:
+        maintenance_worker.start()
+    yield
+    await maintenance_worker.stop()
+    await bonus_worker.stop()
+    password_hasher.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -34,6 +62,28 @@ app.add_middleware(
 app.add_middleware(SessionMiddleware, secret_key="add any string...")
 
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """sends the client's reads to the primary for a few seconds after a write,
+       so they do not hit a replica that has not replayed it yet"""
+    response = await call_next(request)
+    if replica_router.engines and request.method not in ("GET", "HEAD", "OPTIONS") \
+            and response.status_code < 400:
+        response.set_cookie(
+            key=settings.READ_PRIMARY_COOKIE,
+            value="1",
+            max_age=settings.READ_YOUR_WRITES_SECONDS,
+            httponly=True,
+            samesite="lax"
+        )
+    return response
+
+
+# added last, so it is the outermost middleware and times the others as well
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, debug_headers=settings.DEBUG)
+
+
 app.include_router(router_user)
 app.include_router(router_transaction)
 app.include_router(check_health)
@@ -70,6 +120,14 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     logger.error("HTTPException raised: %s, URL: %s", exc.detail, request.url)
     return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
+@app.exception_handler(PasswordHasherBusyException)
+async def password_hasher_busy_exception_handler(request: Request,
+                                                 exc: PasswordHasherBusyException):
+    """handles PasswordHasherBusyException by asking the client to retry later."""
+    logger.warning("Password hashing queue is full! URL: %s", request.url)
+    return JSONResponse(status_code=503, content={"detail": exc.message},
+                        headers={"Retry-After": "1"})
+
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host=settings.HOST, port=settings.PORT, reload=settings.RELOAD)
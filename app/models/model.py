@@ -1,4 +1,7 @@
-from sqlalchemy import Column, Boolean, Integer, String, func,  ForeignKey, MetaData, DateTime, Float, Numeric
+from sqlalchemy import (
+    Column, Boolean, Integer, String, func,  ForeignKey, MetaData, DateTime, Float, Numeric,
+    JSON, UniqueConstraint, Index, Sequence, false, text, event, DDL, Date
+)
 from sqlalchemy.orm import declarative_base
 import datetime
 from sqlalchemy.orm import validates
@@ -9,13 +12,17 @@ Base = declarative_base()
 metadata = MetaData()
 
 
+# feeds the referral code generator, every value becomes a different code
+referral_code_seq = Sequence("referral_code_seq", metadata=Base.metadata)
+
+
 class User(Base):
     """represents a user in the system with authentication details"""
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
     username = Column(String, unique=True)
-    email = Column(String)
+    email = Column(String, unique=True)
     hashed_password = Column(String)
     referral_code = Column(String, unique=True, nullable=False)
     is_active = Column(Boolean, default=True)
@@ -37,13 +44,31 @@ class User(Base):
 
 
 class Transaction(Base):
-    """represents a financial transaction performed by a user"""
+    """represents a financial transaction performed by a user, the table is partitioned
+       by month of transaction_date, see app.db.partitions"""
     __tablename__ = "transactions"
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        # the duplicate check of create_transaction
+        Index('ix_transactions_duplicate_check',
+              'user_id', 'transaction_type', 'amount', 'transaction_date'),
+        # the transaction history of a user and the bonus filter by date
+        Index('ix_transactions_user_id_transaction_date', 'user_id', 'transaction_date', 'id'),
+        Index('ix_transactions_payouts', 'user_id', 'transaction_date',
+              postgresql_where=text("transaction_type = 'request_payout'")),
+        # the sweep of the bonus worker
+        Index('ix_transactions_bonus_pending', 'id', postgresql_where=text('bonus_pending')),
+        {"postgresql_partition_by": "RANGE (transaction_date)"},
+    )
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     transaction_type = Column(String, nullable=False)
     amount = Column(Float, nullable=False, default=0.0)
-    transaction_date = Column(DateTime(timezone=True), server_default=func.now())
+    # the partition key has to be part of the table's primary key
+    transaction_date = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+    # set while the referral bonuses of the transaction are not allocated yet
+    bonus_pending = Column(Boolean, nullable=False, default=False, server_default=false())
+    # the ORM keeps identifying transactions by id alone
+    __mapper_args__ = {"primary_key": [id]}
 
 
     @validates('amount')
@@ -73,12 +98,18 @@ class Transaction(Base):
                f"transaction_date={self.transaction_date})"
 
 
+# catches the rows that no monthly partition covers yet, so inserts never fail
+event.listen(Transaction.__table__, "after_create", DDL(
+    "CREATE TABLE IF NOT EXISTS transactions_default PARTITION OF transactions DEFAULT"))
+
+
 class Referral(Base):
     """represents a referral relationship between two users"""
     __tablename__ = "referrals"
     id = Column(Integer, primary_key=True, index=True)
-    referrer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    referred_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    referrer_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # a user has one referrer, the constraint also serves the lookups by referred_id
+    referred_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
 
 
     def __str__(self):
@@ -91,12 +122,29 @@ class Referral(Base):
                f"referred_id={self.referred_id})"
 
 
+class ReferralPath(Base):
+    """closure table of the referral tree with one row per ancestor and descendant,
+       depth 1 is the first line, depth 2 the second line and so on"""
+    __tablename__ = "referral_paths"
+    __table_args__ = (
+        Index('ix_referral_paths_descendant_id_depth', 'descendant_id', 'depth'),
+    )
+    ancestor_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+
+    def __repr__(self):
+        return f"ReferralPath(ancestor_id={self.ancestor_id}, " \
+               f"descendant_id={self.descendant_id}, depth={self.depth})"
+
+
 class Wallet(Base):
     """represents a wallet with balance and purchase information for a user"""
     __tablename__ = 'wallet'
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'),  nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'),  nullable=False, unique=True)
     balance = Column(Numeric(precision=10, scale=2), default=0.00)
     first_line = Column(Numeric(precision=10, scale=2), default=0.00)
     second_line = Column(Numeric(precision=10, scale=2), default=0.00)
@@ -119,5 +167,55 @@ class Wallet(Base):
                f"purchases: {self.purchases}  "
 
 
+class BonusRollup(Base):
+    """bonus earned by a referrer per referral line and day, kept up to date
+       by the bonus allocation and rebuilt from the transactions by a command"""
+    __tablename__ = 'bonus_daily_rollups'
 
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    # the referral depth of the purchase, 1 is the first line
+    line = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    amount = Column(Numeric(precision=14, scale=2), nullable=False, default=0)
+    purchases = Column(Integer, nullable=False, default=0)
+
+
+    def __repr__(self):
+        return f"BonusRollup(user_id={self.user_id}, line={self.line}, day={self.day}, " \
+               f"amount={self.amount}, purchases={self.purchases})"
 
+
+class PayoutRollup(Base):
+    """payouts requested by a user per day, kept up to date by the payout request"""
+    __tablename__ = 'payout_daily_rollups'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    amount = Column(Numeric(precision=14, scale=2), nullable=False, default=0)
+    payouts = Column(Integer, nullable=False, default=0)
+
+
+    def __repr__(self):
+        return f"PayoutRollup(user_id={self.user_id}, day={self.day}, " \
+               f"amount={self.amount}, payouts={self.payouts})"
+
+
+class IdempotencyKey(Base):
+    """stores the first response of a request sent with an Idempotency-Key header,
+       a row without a response marks a request that is still in progress"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        UniqueConstraint('scope', 'key', name='uq_idempotency_keys_scope_key'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(50), nullable=False)
+    key = Column(String(255), nullable=False)
+    # sha256 of the request the key was first used with
+    request_hash = Column(String(64), nullable=True)
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+    def __repr__(self):
+        return f"IdempotencyKey(id={self.id}, scope={self.scope}, key={self.key})"
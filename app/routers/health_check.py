@@ -1,4 +1,12 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.auth.token_cache import token_cache
+from app.db.database import pool_stats
+from app.services.bonus_worker import bonus_worker
+from app.services.maintenance_worker import maintenance_worker
+from app.utils.balance_cache import balance_cache
+from app.utils.metrics import metrics
+from app.utils.password_hasher import password_hasher
 
 check_health = APIRouter()
 
@@ -10,3 +18,69 @@ def health_check():
         "detail": "ok",
         "result": "working..."
     }
+
+
+@check_health.get("/health/bonus-queue")
+def bonus_queue_health():
+    """returns the depth and lag of the bonus worker queue"""
+    return {
+        "status_code": 200,
+        "detail": "ok",
+        "result": bonus_worker.stats()
+    }
+
+
+@check_health.get("/health/maintenance")
+def maintenance_health():
+    """returns the run and failure counters of the periodic maintenance jobs"""
+    return {
+        "status_code": 200,
+        "detail": "ok",
+        "result": maintenance_worker.stats()
+    }
+
+
+@check_health.get("/health/balance-cache")
+def balance_cache_health():
+    """returns the hit and miss counters of the wallet balance cache"""
+    return {
+        "status_code": 200,
+        "detail": "ok",
+        "result": balance_cache.stats()
+    }
+
+
+@check_health.get("/health/password-hasher")
+def password_hasher_health():
+    """returns the queueing metrics of the password hashing pool"""
+    return {
+        "status_code": 200,
+        "detail": "ok",
+        "result": password_hasher.stats()
+    }
+
+
+@check_health.get("/health/token-cache")
+def token_cache_health():
+    """returns the hit and miss counters of the verified token cache"""
+    return {
+        "status_code": 200,
+        "detail": "ok",
+        "result": token_cache.stats()
+    }
+
+
+@check_health.get("/health/db-pool")
+def db_pool_health():
+    """returns the checked out connections, overflow and checkout latency of the pool"""
+    return {
+        "status_code": 200,
+        "detail": "ok",
+        "result": pool_stats()
+    }
+
+
+@check_health.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """returns the request and database metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,19 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional, Literal
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.database import get_async_session
-from app.schemas.schema import TransactionResponse, TransactionCreate, BalanceResponse
+from app.core.config import settings
+from app.db.database import get_async_session, get_read_session, open_read_session
+from app.schemas.schema import (
+    TransactionResponse, TransactionCreate, BalanceResponse,
+    TransactionBulkCreate, BulkTransactionResponse, BonusSummaryResponse, PayoutSummaryResponse
+)
+from app.services.idempotency_service import IdempotencyService
 from app.services.transaction_service import TransactionService
+from app.utils.exceptions import (
+    IdempotencyKeyInProgressException, IdempotencyKeyMismatchException
+)
+from app.utils.export import EXPORT_FORMATTERS, EXPORT_MEDIA_TYPES
 
 
 router_transaction = APIRouter()
@@ -11,10 +21,23 @@ router_transaction = APIRouter()
 
 @router_transaction.post("/create/transaction/", response_model=TransactionResponse)
 async def create_transactions(transaction: TransactionCreate,
-                              session: AsyncSession = Depends(get_async_session)):
-    """returns the created transaction data"""
+                              session: AsyncSession = Depends(get_async_session),
+                              idempotency_key: Optional[str] = Header(
+                                  default=None, alias="Idempotency-Key", max_length=255)):
+    """returns the created transaction data, a retry with the same
+       Idempotency-Key returns the first response again"""
     transaction_service = TransactionService(session)
-    new_transaction = await transaction_service.create_transaction(transaction)
+    idempotency_service = IdempotencyService(session)
+    try:
+        # the keys of a user never collide with the keys of another user
+        new_transaction = await idempotency_service.run(
+            f"create_transaction:{transaction.user_id}", idempotency_key,
+            lambda: transaction_service.create_transaction(transaction),
+            request_hash=IdempotencyService.fingerprint(transaction.model_dump(mode="json")))
+    except IdempotencyKeyInProgressException as e:
+        raise HTTPException(status_code=409, detail=e.message) from e
+    except IdempotencyKeyMismatchException as e:
+        raise HTTPException(status_code=422, detail=e.message) from e
     if not new_transaction:
         raise HTTPException(
             status_code=400,
@@ -23,12 +46,38 @@ async def create_transactions(transaction: TransactionCreate,
     return new_transaction
 
 
+@router_transaction.post("/create/transactions/bulk/", response_model=BulkTransactionResponse)
+async def create_transactions_bulk(bulk: TransactionBulkCreate,
+                                   session: AsyncSession = Depends(get_async_session)):
+    """returns the per-item results of a batch of created transactions"""
+    if len(bulk.transactions) > TransactionService.MAX_BULK_TRANSACTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can contain at most {TransactionService.MAX_BULK_TRANSACTIONS} "
+                   "transactions"
+        )
+    transaction_service = TransactionService(session)
+    return await transaction_service.create_transactions_bulk(bulk.transactions)
+
+
 @router_transaction.post("/request/{user_id}/{payout}/", response_model=TransactionResponse)
 async def request_payout(user_id: int, payout: float,
-                         session: AsyncSession = Depends(get_async_session)):
-    """returns a payout transaction for the specified user and amount"""
+                         session: AsyncSession = Depends(get_async_session),
+                         idempotency_key: Optional[str] = Header(
+                             default=None, alias="Idempotency-Key", max_length=255)):
+    """returns a payout transaction for the specified user and amount, a retry
+       with the same Idempotency-Key does not debit the wallet again"""
     transaction_service = TransactionService(session)
-    payout_transaction = await transaction_service.request_payout(user_id, payout)
+    idempotency_service = IdempotencyService(session)
+    try:
+        payout_transaction = await idempotency_service.run(
+            f"request_payout:{user_id}", idempotency_key,
+            lambda: transaction_service.request_payout(user_id, payout),
+            request_hash=IdempotencyService.fingerprint({"payout": payout}))
+    except IdempotencyKeyInProgressException as e:
+        raise HTTPException(status_code=409, detail=e.message) from e
+    except IdempotencyKeyMismatchException as e:
+        raise HTTPException(status_code=422, detail=e.message) from e
     if not payout_transaction:
         raise HTTPException(
             status_code=400,
@@ -41,7 +90,7 @@ async def request_payout(user_id: int, payout: float,
                         response_model= List[TransactionResponse])
 async def filter_bonus_transactions(user_id: int, start_date: str,
                                     end_date: str,
-                                    session: AsyncSession = Depends(get_async_session)):
+                                    session: AsyncSession = Depends(get_read_session)):
     """returns a list of transactions from referrals filtered by date"""
     transaction_service = TransactionService(session)
     transactions = await transaction_service.filter_bonus_transactions_by_date(user_id, start_date, end_date)
@@ -70,7 +119,7 @@ async def get_user(user_id: int,
 @router_transaction.get("/filter/payout/{user_id}/{start_date}/{end_date}/")
 async def filter_payout_transaction_by_date(user_id: int, start_date: str,
                                            end_date: str,
-                                           session: AsyncSession = Depends(get_async_session)):
+                                           session: AsyncSession = Depends(get_read_session)):
     """returns a list of payout transactions filtered by date"""
     transaction_service = TransactionService(session)
     transactions = await transaction_service.filter_payout_transaction_by_date(user_id, start_date, end_date)
@@ -82,3 +131,94 @@ async def filter_payout_transaction_by_date(user_id: int, start_date: str,
     return transactions
 
 
+@router_transaction.get("/summary/bonus/{user_id}/", response_model=BonusSummaryResponse)
+async def bonus_summary(user_id: int,
+                        start_date: Optional[str] = None,
+                        end_date: Optional[str] = None,
+                        group_by: Literal["day", "week", "month", "year"] = "day",
+                        session: AsyncSession = Depends(get_read_session)):
+    """returns the first and second-line bonuses per period, dates are dd-mm-YYYY"""
+    transaction_service = TransactionService(session)
+    try:
+        return await transaction_service.get_bonus_summary(user_id, start_date, end_date, group_by)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail="Dates must have the format dd-mm-YYYY"
+        ) from e
+
+
+@router_transaction.get("/summary/payout/{user_id}/", response_model=PayoutSummaryResponse)
+async def payout_summary(user_id: int,
+                         start_date: Optional[str] = None,
+                         end_date: Optional[str] = None,
+                         group_by: Literal["day", "week", "month", "year"] = "day",
+                         session: AsyncSession = Depends(get_read_session)):
+    """returns the paid out amount per period, dates are dd-mm-YYYY"""
+    transaction_service = TransactionService(session)
+    try:
+        return await transaction_service.get_payout_summary(user_id, start_date, end_date, group_by)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail="Dates must have the format dd-mm-YYYY"
+        ) from e
+
+
+@router_transaction.get("/filter/bonus/{user_id}/{start_date}/{end_date}/export/")
+async def export_bonus_transactions(request: Request, user_id: int,
+                                    start_date: str, end_date: str,
+                                    export_format: Literal["ndjson", "csv"] = Query(
+                                        default="ndjson", alias="format")):
+    """streams the referral transactions filtered by date as NDJSON or CSV"""
+    start, end = parse_export_dates(start_date, end_date)
+    prefer_primary = request.cookies.get(settings.READ_PRIMARY_COOKIE) is not None
+
+    async def rows():
+        # the response outlives the request dependencies, so the stream owns its session
+        async with open_read_session(prefer_primary) as session:
+            transaction_service = TransactionService(session)
+            async for row in transaction_service.stream_bonus_transactions_by_date(
+                    user_id, start, end):
+                yield row
+
+    return export_response(rows(), export_format, f"bonus_{user_id}_{start_date}_{end_date}")
+
+
+@router_transaction.get("/filter/payout/{user_id}/{start_date}/{end_date}/export/")
+async def export_payout_transactions(request: Request, user_id: int,
+                                     start_date: str, end_date: str,
+                                     export_format: Literal["ndjson", "csv"] = Query(
+                                         default="ndjson", alias="format")):
+    """streams the payout transactions filtered by date as NDJSON or CSV"""
+    start, end = parse_export_dates(start_date, end_date)
+    prefer_primary = request.cookies.get(settings.READ_PRIMARY_COOKIE) is not None
+
+    async def rows():
+        async with open_read_session(prefer_primary) as session:
+            transaction_service = TransactionService(session)
+            async for row in transaction_service.stream_payout_transactions_by_date(
+                    user_id, start, end):
+                yield row
+
+    return export_response(rows(), export_format, f"payout_{user_id}_{start_date}_{end_date}")
+
+
+def parse_export_dates(start_date: str, end_date: str):
+    """returns the parsed dates or raises a 400 before the stream starts"""
+    try:
+        return TransactionService.parse_date(start_date), TransactionService.parse_date(end_date)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail="Dates must have the format dd-mm-YYYY"
+        ) from e
+
+
+def export_response(rows, export_format: str, filename: str) -> StreamingResponse:
+    """returns a chunked response that encodes the rows while they are read"""
+    return StreamingResponse(
+        EXPORT_FORMATTERS[export_format](rows),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
 from fastapi.security import HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.db.database import get_async_session
-from app.models.model import User, Wallet
+from app.db.database import get_async_session, get_read_session
+from app.models.model import User
 from app.schemas.pagination import PageParams, PaginationResponse, PaginationListResponse
 from app.schemas.schema import (
     UserResponse, UserCreate, TransactionResponse, ReferralResponse,
@@ -12,9 +13,12 @@ from app.schemas.schema import (
     UserSignInRequest, DeleteResponse, GetAllNonReferralsResponse
 )
 from app.services.authentication import AuthService
+from app.services.transaction_service import TransactionService
 from app.services.user_service import UserService
 from app.utils.crud_repository import CrudRepository
-from app.utils.exceptions import TokenNotFoundException
+from app.utils.exceptions import (
+    TokenNotFoundException, InvalidCursorException, UserAlreadyExistsException
+)
 
 router_user = APIRouter()
 token_auth_scheme = HTTPBearer()
@@ -24,25 +28,17 @@ token_auth_scheme = HTTPBearer()
 async def add_user(user: RegisterUserSchema,
                   session: AsyncSession = Depends(get_async_session)):
     """Registers a new user, ensuring that the
-       email and username are unique and the passwords match"""
-    user_service = UserService(session)
-    email = await user_service.is_user_exists('email', user.email)
-    if email:
-        raise HTTPException(
-             status_code=400,
-             detail="User with this email already exists"
-         )
-    username = await user_service.is_user_exists('username', user.username)
-    if username:
-        raise HTTPException(
-            status_code=400,
-            detail="User with this username already registered"
-        )
+       email and username are unique and the passwords match,
+       uniqueness is enforced by the unique indexes of users"""
     if user.password != user.password_check:
         raise HTTPException(
             status_code=400,
             detail="The passwords do not match")
-    user = await user_service.add_user(user)
+    user_service = UserService(session)
+    try:
+        user = await user_service.add_user(user)
+    except UserAlreadyExistsException as e:
+        raise HTTPException(status_code=400, detail=e.message) from e
     return user
 
 
@@ -77,19 +73,27 @@ async def login(response: Response, user: UserSignInRequest,
 
 
 @router_user.post("/logout/")
-async def logout_user(response: Response):
+async def logout_user(request: Request, response: Response,
+                      session: AsyncSession = Depends(get_async_session)):
     """logs out the user by deleting the authentication cookie"""
+    token = request.cookies.get(settings.TOKEN_KEY)
+    if token:
+        AuthService(session).invalidate_token(token.replace("Bearer ", ""))
     response.delete_cookie(key=settings.TOKEN_KEY)
     return {"message": "Successfully logged out"}
 
 
 @router_user.get("/get/user/{user_id}/", response_model=PaginationResponse[TransactionResponse])
 async def get_user(user_id: int,
-                   session: AsyncSession = Depends(get_async_session),
+                   session: AsyncSession = Depends(get_read_session),
                    page_params: PageParams = Depends(PageParams)):
-    """returns user transactions, filtered by pagination parameters"""
+    """returns user transactions, filtered by pagination parameters,
+       pass the next_cursor of a page as cursor to read the next one"""
     user_service = UserService(session)
-    transactions = await user_service.get_user(user_id, page_params)
+    try:
+        transactions = await user_service.get_user(user_id, page_params)
+    except InvalidCursorException as e:
+        raise HTTPException(status_code=400, detail=e.message) from e
     if transactions is None:
         raise HTTPException(
             status_code=404,
@@ -112,19 +116,24 @@ async def home(request: Request, session: AsyncSession = Depends(get_async_sessi
             status_code=403,
             detail="Account is not active"
         )
-    wallet_crud_repository = CrudRepository(session, Wallet)
-    wallet = await wallet_crud_repository.get_one_by(user_id=user.id)
+    transaction_service = TransactionService(session)
+    wallet = await transaction_service.get_wallet(user.id)
     context = {"request": request, "name": user, "wallet": wallet}
     from app.main import templates
     return templates.TemplateResponse("index.html", context)
 
 
 @router_user.get("/get/all/users/", response_model=PaginationListResponse)
-async def get_all_users(session: AsyncSession = Depends(get_async_session),
-                   page_params: PageParams = Depends(PageParams)):
-    """returns all users with pagination"""
+async def get_all_users(session: AsyncSession = Depends(get_read_session),
+                   page_params: PageParams = Depends(PageParams),
+                   transactions_limit: Optional[int] = Query(default=None, ge=1)):
+    """returns all users with pagination, optionally with only
+       the most recent transactions_limit transactions per user"""
     user_service = UserService(session)
-    users = await user_service.get_all_users(page_params)
+    try:
+        users = await user_service.get_all_users(page_params, transactions_limit)
+    except InvalidCursorException as e:
+        raise HTTPException(status_code=400, detail=e.message) from e
     return users
 
 
@@ -145,11 +154,16 @@ async def create_referral(code: str, referral_id: int,
             status_code=400,
             detail="User already has referer"
         )
+    if user == 'referral_cycle':
+        raise HTTPException(
+            status_code=400,
+            detail="User can not be referred by themselves or by their own referral"
+        )
     return user
 
 
 @router_user.get("/get/all/referrals/{user_id}/", response_model=GetAllReferralsResponse)
-async def get_referrals(user_id: int, session: AsyncSession = Depends(get_async_session)):
+async def get_referrals(user_id: int, session: AsyncSession = Depends(get_read_session)):
     """returns a list of users associated with one referrer"""
     user_service = UserService(session)
     referrals = await user_service.get_my_referrals(user_id)
@@ -159,7 +173,7 @@ async def get_referrals(user_id: int, session: AsyncSession = Depends(get_async_
 
 
 @router_user.get("/get/all/not/refferals/{user_id}/", response_model=GetAllNonReferralsResponse)
-async def get_not_referral_users(user_id: int, session: AsyncSession = Depends(get_async_session)):
+async def get_not_referral_users(user_id: int, session: AsyncSession = Depends(get_read_session)):
     """all users who are not referrals"""
     user_service = UserService(session)
     user = await user_service.get_non_referrals(user_id)
@@ -169,7 +183,7 @@ async def get_not_referral_users(user_id: int, session: AsyncSession = Depends(g
 
 
 @router_user.get("/get/user/profile/{user_id}/", response_model=UserProfileResponse)
-async def get_profile(user_id: int, session: AsyncSession = Depends(get_async_session)):
+async def get_profile(user_id: int, session: AsyncSession = Depends(get_read_session)):
     """returns the all info about the specified user"""
     user_service = UserService(session)
     user = await user_service.get_user_profile(user_id)
@@ -1,12 +1,15 @@
-from typing import Generic, List, TypeVar, Optional
+from typing import Generic, List, TypeVar, Optional, Literal
 from pydantic import BaseModel, conint, ConfigDict
 
 T = TypeVar("T")
 
 class PageParams(BaseModel):
-    """schema for pagination parameters, including page number and page size"""
+    """schema for pagination parameters, including page number and page size,
+       an optional keyset cursor and how the total is counted"""
     page: conint(ge=1) = 1
     size: conint(ge=1, le=100) = 5
+    cursor: Optional[str] = None
+    count: Literal["exact", "estimated"] = "exact"
 
 
 class PaginationResponse(BaseModel, Generic[T]):
@@ -18,6 +21,7 @@ class PaginationResponse(BaseModel, Generic[T]):
     current_page: int
     size: int
     total_pages: int
+    next_cursor: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -30,6 +34,7 @@ class PaginationListResponse(BaseModel, Generic[T]):
     current_page: int
     size: int
     total_pages: int
+    next_cursor: Optional[str] = None
 
 
     model_config = ConfigDict(from_attributes=True)
@@ -1,7 +1,7 @@
 from typing import List
 from pydantic import BaseModel, ConfigDict, field_validator
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, date
 from pydantic_core.core_schema import ValidationInfo
 from typing import Optional
 
@@ -22,6 +22,16 @@ class UserResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class AuthenticatedUser(BaseModel):
+    id: int
+    email: Optional[str] = None
+    username: Optional[str] = None
+    referral_code: str
+    is_active: Optional[bool] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class UsernameResponse(BaseModel):
     user_id: int
     username: str
@@ -49,6 +59,29 @@ class TransactionResponse(BaseModel):
                               arbitrary_types_allowed=True)
 
 
+class TransactionBulkCreate(BaseModel):
+    transactions: List[TransactionCreate]
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BulkTransactionResult(BaseModel):
+    index: int
+    status: str
+    detail: Optional[str] = None
+    transaction: Optional[TransactionResponse] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BulkTransactionResponse(BaseModel):
+    created: int
+    rejected: int
+    results: List[BulkTransactionResult]
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class UserTransactionsResponse(BaseModel):
     user_id: int
     username: str
@@ -116,7 +149,55 @@ class DeleteResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class WalletResponse(BaseModel):
+    user_id: int
+    balance: Optional[Decimal] = None
+    first_line: Optional[Decimal] = None
+    second_line: Optional[Decimal] = None
+    purchases: Optional[int] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class BalanceResponse(BaseModel):
     balance: Decimal
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BonusSummaryItem(BaseModel):
+    period: date
+    first_line: Decimal
+    second_line: Decimal
+    total: Decimal
+    purchases: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BonusSummaryResponse(BaseModel):
+    user_id: int
+    group_by: str
+    first_line: Decimal
+    second_line: Decimal
+    total: Decimal
+    items: List[BonusSummaryItem]
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class PayoutSummaryItem(BaseModel):
+    period: date
+    amount: Decimal
+    payouts: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class PayoutSummaryResponse(BaseModel):
+    user_id: int
+    group_by: str
+    total: Decimal
+    items: List[PayoutSummaryItem]
+
+    model_config = ConfigDict(from_attributes=True)
@@ -1,37 +1,64 @@
 import logging
-from app.auth.token import create_access_token, verify_token
+from app.auth.token import create_access_token, decode_token
+from app.auth.token_cache import TokenCache, token_cache
 from app.models.model import User
+from app.schemas.schema import AuthenticatedUser
 from app.utils.crud_repository import CrudRepository
 from app.utils.exceptions import TokenError, CredentialsException
-from app.utils.utils import verify_password
+from app.utils.utils import verify_and_update_password
 
 
 class AuthService:
     """provides methods for authenticating
     users and verifying tokens"""
-    def __init__(self, session):
+    def __init__(self, session, cache: TokenCache = token_cache):
         self.logger = logging.getLogger(__name__)
         self.session = session
+        self.token_cache = cache
 
 
     async def authenticate_user(self, user, current_user):
-        """authenticates a user by verifying the password"""
-        if not verify_password(user.password, current_user.hashed_password):
+        """authenticates a user by verifying the password, a hash made with
+           another work factor is replaced by one with the configured factor"""
+        valid, new_hash = await verify_and_update_password(user.password,
+                                                           current_user.hashed_password)
+        if not valid:
             return False
+        if new_hash is not None:
+            current_user.hashed_password = new_hash
+            await self.session.commit()
+            self.logger.info("Rehashed the password of user %s", current_user.id)
         access_token = create_access_token(data={"sub": current_user.email})
         return access_token
 
 
-    async def get_user_by_token(self, token: str):
-        """returns a user based on a valid JWT token"""
+    async def get_user_by_token(self, token: str) -> AuthenticatedUser:
+        """returns a snapshot of the user of a valid JWT token, repeated tokens
+           skip the signature check and the user lookup"""
+        cached = self.token_cache.get(token)
+        if cached is not None:
+            return cached[1]
         try:
-            email = await verify_token(token)
+            claims = decode_token(token)
         except Exception as e:
             self.logger.error(" %s", str(e))
             raise TokenError("Failed to decode the token") from e
         crud_repository = CrudRepository(self.session, User)
-        user = await crud_repository.get_one_by(email=email)
+        user = await crud_repository.get_one_by(email=claims["sub"])
         if not user:
             raise CredentialsException('User not found by token')
-        return user
+        snapshot = AuthenticatedUser.model_validate(user)
+        self.token_cache.put(token, claims, snapshot)
+        return snapshot
+
+
+    def invalidate_user(self, user_id: int) -> None:
+        """forgets the cached tokens of the user, call it after
+           deactivating or deleting the user"""
+        self.token_cache.invalidate_user(user_id)
+
+
+    def invalidate_token(self, token: str) -> None:
+        """forgets the cached token, e.g. on logout"""
+        self.token_cache.invalidate_token(token)
 
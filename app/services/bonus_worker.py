@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import List, Optional
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.database import async_session_maker
+from app.models.model import Transaction
+
+
+class BonusWorker:
+    """allocates referral bonuses on an in-process queue outside of the request path.
+    Transactions keep their bonus_pending marker until they are processed, so
+    a periodic sweep picks up the work that was queued before a restart"""
+    def __init__(self, session_maker, batch_size: int, poll_interval: float,
+                 sweep_interval: float):
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.logger = logging.getLogger(__name__)
+        self.processed = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_batch_seconds = 0.0
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+
+    @property
+    def is_running(self) -> bool:
+        """returns True while the worker task is alive"""
+        return self._task is not None and not self._task.done()
+
+
+    def start(self) -> None:
+        """starts the worker task on the running event loop"""
+        if not self.is_running:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="bonus-worker")
+
+
+    async def stop(self) -> None:
+        """stops the worker, queued transactions stay pending in the database"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+    def enqueue(self, transaction_id: int) -> bool:
+        """queues a transaction and returns False when the worker is not running"""
+        if not self.is_running:
+            return False
+        self._pending.append((transaction_id, time.monotonic()))
+        self._wakeup.set()
+        return True
+
+
+    def stats(self) -> dict:
+        """returns the queue depth, the age of the oldest queued transaction and counters"""
+        lag = time.monotonic() - self._pending[0][1] if self._pending else 0.0
+        return {
+            "running": self.is_running,
+            "queue_depth": len(self._pending),
+            "lag_seconds": round(lag, 3),
+            "processed": self.processed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_batch_seconds": round(self.last_batch_seconds, 3)
+        }
+
+
+    async def _run(self) -> None:
+        while True:
+            if not self._pending:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            try:
+                if self._pending:
+                    batch = [self._pending.popleft()[0]
+                             for _ in range(min(self.batch_size, len(self._pending)))]
+                    await self.process_batch(batch)
+                elif time.monotonic() - self._last_sweep >= self.sweep_interval:
+                    await self.sweep()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # the transactions stay pending and the next sweep retries them
+                self.failures += 1
+                self.logger.exception("Bonus batch failed: %s", str(e))
+
+
+    async def process_batch(self, transaction_ids: List[int]) -> int:
+        """allocates the bonuses of one micro-batch in a single commit"""
+        # imported here because the transaction service enqueues into this worker
+        from app.services.transaction_service import TransactionService
+        started = time.monotonic()
+        async with self.session_maker() as session:
+            processed = await TransactionService(session).process_pending_bonuses(transaction_ids)
+        self.last_batch_seconds = time.monotonic() - started
+        self.processed += processed
+        self.batches += 1
+        return processed
+
+
+    async def sweep(self) -> int:
+        """processes the transactions left pending by a restart or a failed batch"""
+        self._last_sweep = time.monotonic()
+        async with self.session_maker() as session:
+            result = await session.execute(
+                select(Transaction.id)
+                .where(Transaction.bonus_pending.is_(True))
+                .order_by(Transaction.id)
+                .limit(self.batch_size))
+            transaction_ids = result.scalars().all()
+        if not transaction_ids:
+            return 0
+        if len(transaction_ids) == self.batch_size:
+            # there is probably more backlog, sweep again on the next idle tick
+            self._last_sweep = 0.0
+        self.logger.info("Sweeping %d pending bonus transactions", len(transaction_ids))
+        return await self.process_batch(transaction_ids)
+
+
+bonus_worker = BonusWorker(
+    async_session_maker,
+    batch_size=settings.BONUS_WORKER_BATCH_SIZE,
+    poll_interval=settings.BONUS_WORKER_POLL_SECONDS,
+    sweep_interval=settings.BONUS_WORKER_SWEEP_SECONDS
+)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import update, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.model import IdempotencyKey
+from app.schemas.schema import TransactionResponse
+from app.utils.cache import TTLCache
+from app.utils.crud_repository import CrudRepository, unit_of_work, after_commit
+from app.utils.exceptions import (
+    IdempotencyKeyInProgressException, IdempotencyKeyMismatchException
+)
+
+
+idempotency_cache = TTLCache(
+    max_size=settings.IDEMPOTENCY_CACHE_MAX_SIZE,
+    ttl=settings.IDEMPOTENCY_CACHE_TTL_SECONDS
+)
+
+
+class IdempotencyService:
+    """service class that replays the stored response of a request
+    that was already processed with the same Idempotency-Key. The key is
+    reserved, the operation runs and its response is stored in one transaction,
+    so a request that dies before its commit leaves no trace and a committed
+    operation always has its response. A key is bound to the fingerprint of the
+    request it was first used with and deleted once it is older than
+    IDEMPOTENCY_KEY_TTL_HOURS"""
+    def __init__(self, session: AsyncSession, cache: TTLCache = idempotency_cache):
+        self.session = session
+        self.cache = cache
+        self.logger = logging.getLogger(__name__)
+
+
+    @staticmethod
+    def fingerprint(payload) -> str:
+        """returns the hash of the request data a key is bound to"""
+        data = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+
+    async def run(self, scope: str, key: Optional[str], operation: Callable[[], Awaitable],
+                  request_hash: Optional[str] = None) -> TransactionResponse | dict | bool:
+        """runs the operation once per key and returns the stored response on retries,
+           only TransactionResponse results are stored, errors can be retried.
+           A concurrent request with the same key waits for the first one to commit"""
+        if key is None:
+            return await operation()
+        cached = self.cache.get((scope, key))
+        if cached is not None:
+            self._check_request(cached["request_hash"], request_hash)
+            return TransactionResponse.model_validate(cached["response"])
+
+        # the writes of the operation join this unit of work and commit with the key
+        async with unit_of_work(self.session):
+            stored = await self.begin(scope, key, request_hash)
+            if stored is not None:
+                self.logger.info('Replayed the %s response for Idempotency-Key %s', scope, key)
+                return stored
+            response = await operation()
+            if isinstance(response, TransactionResponse):
+                await self.complete(scope, key, response, request_hash)
+            else:
+                await self.abort(scope, key)
+        return response
+
+
+    @staticmethod
+    def _check_request(stored_hash: Optional[str], request_hash: Optional[str]) -> None:
+        """raises when the key was first used with a different request,
+           the keys stored before fingerprints existed have none"""
+        if stored_hash is not None and stored_hash != request_hash:
+            raise IdempotencyKeyMismatchException()
+
+
+    async def begin(self, scope: str, key: str,
+                    request_hash: Optional[str] = None) -> TransactionResponse | None:
+        """reserves the key in the current transaction and returns None, or returns the
+           stored response when the key was already used. The reservation is not
+           committed, it only becomes visible together with the response"""
+        stmt = pg_insert(IdempotencyKey).values(scope=scope, key=key, request_hash=request_hash)
+        now = func.now()
+        # a key past its lifetime is used again like a new one
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+            set_={'request_hash': stmt.excluded.request_hash, 'response': None,
+                  'created_at': now},
+            where=IdempotencyKey.created_at < now - timedelta(
+                hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+        ).returning(IdempotencyKey.id)
+        result = await self.session.execute(stmt)
+        if result.scalar() is not None:
+            return None
+
+        crud_repository = CrudRepository(self.session, IdempotencyKey)
+        stored = await crud_repository.get_one_by(scope=scope, key=key)
+        if stored is None:
+            raise IdempotencyKeyInProgressException()
+        self._check_request(stored.request_hash, request_hash)
+        if stored.response is None:
+            # left by the reserve, run and complete commits of older releases, whether
+            # its operation committed is unknown, so the key waits for its expiry
+            raise IdempotencyKeyInProgressException()
+        self.cache.set((scope, key), {"request_hash": stored.request_hash,
+                                      "response": stored.response})
+        return TransactionResponse.model_validate(stored.response)
+
+
+    async def complete(self, scope: str, key: str, response: TransactionResponse,
+                       request_hash: Optional[str] = None) -> None:
+        """stores the response of the reserved key in the transaction of the operation"""
+        data = response.model_dump(mode="json")
+        await self.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+            .values(response=data))
+        after_commit(self.session, lambda: self.cache.set(
+            (scope, key), {"request_hash": request_hash, "response": data}))
+
+
+    async def abort(self, scope: str, key: str) -> None:
+        """releases the reserved key of a failed operation, so the client can retry"""
+        await self.session.execute(
+            delete(IdempotencyKey)
+            .where(IdempotencyKey.scope == scope,
+                   IdempotencyKey.key == key,
+                   IdempotencyKey.response.is_(None)))
+
+
+    async def purge_expired(self) -> int:
+        """deletes the keys older than IDEMPOTENCY_KEY_TTL_HOURS and returns how many"""
+        result = await self.session.execute(
+            delete(IdempotencyKey)
+            .where(IdempotencyKey.created_at < func.now() - timedelta(
+                hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)))
+        await self.session.commit()
+        if result.rowcount:
+            self.logger.info('Deleted %d expired idempotency keys', result.rowcount)
+        return result.rowcount
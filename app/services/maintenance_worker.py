@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+from app.core.config import settings
+from app.db.database import async_session_maker, engine
+from app.db.partitions import ensure_partitions, lock_partitions
+from app.services.idempotency_service import IdempotencyService
+
+
+@dataclass
+class MaintenanceJob:
+    """a housekeeping job and when it runs next, it runs right after the start"""
+    name: str
+    interval: float
+    run: Callable[[], Awaitable]
+    next_run: float = 0.0
+    runs: int = 0
+    failures: int = 0
+
+
+class MaintenanceWorker:
+    """runs the periodic housekeeping jobs of the process on the event loop, so a
+    deployment without cron keeps its tables in shape. Every worker process runs
+    them, the jobs have to be safe to run concurrently"""
+    def __init__(self, tick: float, clock: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.jobs: List[MaintenanceJob] = []
+        self.logger = logging.getLogger(__name__)
+        self._task: Optional[asyncio.Task] = None
+
+
+    def add(self, name: str, interval: float, run: Callable[[], Awaitable]) -> None:
+        """registers a job that runs every interval seconds"""
+        self.jobs.append(MaintenanceJob(name, interval, run))
+
+
+    def postpone(self, name: str) -> None:
+        """moves the next run of the job one interval away, for a job that just ran
+           outside of the worker"""
+        for job in self.jobs:
+            if job.name == name:
+                job.next_run = self.clock() + job.interval
+
+
+    @property
+    def is_running(self) -> bool:
+        """returns True while the worker task is alive"""
+        return self._task is not None and not self._task.done()
+
+
+    def start(self) -> None:
+        """starts the worker task on the running event loop"""
+        if not self.is_running:
+            self._task = asyncio.create_task(self._run(), name="maintenance-worker")
+
+
+    async def stop(self) -> None:
+        """stops the worker between two jobs"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+    async def run_due(self) -> List[str]:
+        """runs the jobs whose interval has passed and returns their names,
+           a failed job is logged and retried on its next interval"""
+        ran = []
+        for job in self.jobs:
+            now = self.clock()
+            if now < job.next_run:
+                continue
+            job.next_run = now + job.interval
+            try:
+                await job.run()
+                job.runs += 1
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                job.failures += 1
+                self.logger.exception("Maintenance job %s failed: %s", job.name, str(e))
+            ran.append(job.name)
+        return ran
+
+
+    async def _run(self) -> None:
+        while True:
+            await self.run_due()
+            await asyncio.sleep(self.tick)
+
+
+    def stats(self) -> dict:
+        """returns the run and failure counters of every job"""
+        return {
+            "running": self.is_running,
+            "jobs": [{"name": job.name, "interval_seconds": job.interval, "runs": job.runs,
+                      "failures": job.failures} for job in self.jobs]
+        }
+
+
+async def purge_idempotency_keys() -> int:
+    """deletes the idempotency keys that are past their lifetime"""
+    async with async_session_maker() as session:
+        return await IdempotencyService(session).purge_expired()
+
+
+async def create_transaction_partitions() -> List[str]:
+    """creates the monthly transaction partitions that are missing ahead of time, the
+       month has to exist before its first transaction lands in the default partition"""
+    async with engine.begin() as conn:
+        await lock_partitions(conn)
+        return await ensure_partitions(conn, settings.TRANSACTION_PARTITION_MONTHS_AHEAD)
+
+
+maintenance_worker = MaintenanceWorker(tick=settings.MAINTENANCE_TICK_SECONDS)
+maintenance_worker.add("purge-idempotency-keys", settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+                       purge_idempotency_keys)
+maintenance_worker.add("create-transaction-partitions",
+                       settings.TRANSACTION_PARTITION_INTERVAL_SECONDS,
+                       create_transaction_partitions)
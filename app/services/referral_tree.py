@@ -0,0 +1,171 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import select, insert, delete, literal, union_all, true, exists, func, all_, Integer
+from sqlalchemy.dialects.postgresql import ARRAY, array
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.model import Referral, ReferralPath
+from app.utils.cache import TTLCache
+
+
+# the advisory lock that serializes the changes of the referral tree
+REFERRAL_TREE_LOCK_ID = 0x726566657272
+
+
+class AncestorCache:
+    """caches the upline of users. Every change of the tree bumps a generation,
+    and an upline read before that change is never stored. The generation only
+    covers this process, the changes made by other workers are seen once the
+    short ttl runs out"""
+    def __init__(self, max_size: int, ttl: float):
+        self.cache = TTLCache(max_size, ttl)
+        self.generation = 0
+
+
+    def get(self, user_id: int, max_depth: int):
+        """returns the cached list of (ancestor_id, depth) or None"""
+        return self.cache.get((user_id, max_depth))
+
+
+    def fill(self, uplines: Dict[int, list], max_depth: int, generation: int) -> None:
+        """stores uplines read from the database unless the tree changed meanwhile"""
+        if generation != self.generation:
+            return
+        for user_id, upline in uplines.items():
+            self.cache.set((user_id, max_depth), upline)
+
+
+    def invalidate(self) -> None:
+        """drops all uplines, referral changes are rare compared to purchases"""
+        self.generation += 1
+        self.cache.clear()
+
+
+ancestor_cache = AncestorCache(
+    max_size=settings.ANCESTOR_CACHE_MAX_SIZE,
+    ttl=settings.ANCESTOR_CACHE_TTL_SECONDS
+)
+
+
+class ReferralTree:
+    """maintains the referral_paths closure table, so a whole upline or downline
+    is one indexed lookup no matter how deep the tree is"""
+    def __init__(self, session: AsyncSession, cache: AncestorCache = ancestor_cache):
+        self.session = session
+        self.cache = cache
+        self.logger = logging.getLogger(__name__)
+
+
+    async def lock(self) -> None:
+        """waits for the tree changes of other requests, the lock is held until the
+           transaction ends, so checks made after it see every committed referral"""
+        await self.session.execute(select(func.pg_advisory_xact_lock(REFERRAL_TREE_LOCK_ID)))
+
+
+    async def link(self, referrer_id: int, referred_id: int) -> None:
+        """adds the paths from the referrer and its upline to the referred user and its
+           downline in one statement, the caller is responsible for the commit"""
+        uplines = union_all(
+            select(ReferralPath.ancestor_id.label("user_id"), ReferralPath.depth)
+            .where(ReferralPath.descendant_id == referrer_id),
+            select(literal(referrer_id).label("user_id"), literal(0).label("depth"))
+        ).subquery()
+        downlines = union_all(
+            select(ReferralPath.descendant_id.label("user_id"), ReferralPath.depth)
+            .where(ReferralPath.ancestor_id == referred_id),
+            select(literal(referred_id).label("user_id"), literal(0).label("depth"))
+        ).subquery()
+        paths = (select(uplines.c.user_id, downlines.c.user_id,
+                        uplines.c.depth + downlines.c.depth + 1)
+                 .select_from(uplines)
+                 .join(downlines, true()))
+        await self.session.execute(
+            insert(ReferralPath).from_select(["ancestor_id", "descendant_id", "depth"], paths))
+        self.cache.invalidate()
+
+
+    async def unlink(self, referrer_id: int, referred_id: int) -> None:
+        """removes the paths that run through the referral of referrer_id to referred_id,
+           the caller is responsible for the commit"""
+        subtree = union_all(
+            select(ReferralPath.descendant_id).where(ReferralPath.ancestor_id == referred_id),
+            select(literal(referred_id))
+        )
+        uplines = union_all(
+            select(ReferralPath.ancestor_id).where(ReferralPath.descendant_id == referrer_id),
+            select(literal(referrer_id))
+        )
+        await self.session.execute(
+            delete(ReferralPath).where(ReferralPath.descendant_id.in_(subtree),
+                                       ReferralPath.ancestor_id.in_(uplines)))
+        self.cache.invalidate()
+
+
+    async def get_uplines(self, user_ids: Iterable[int],
+                          max_depth: int) -> Dict[int, List[Tuple[int, int]]]:
+        """returns the (ancestor_id, depth) pairs of every user up to max_depth, ordered by
+           depth, with one query for all users that are not cached"""
+        uplines, missing = {}, []
+        for user_id in set(user_ids):
+            upline = self.cache.get(user_id, max_depth)
+            if upline is None:
+                missing.append(user_id)
+            else:
+                uplines[user_id] = upline
+        if not missing:
+            return uplines
+
+        generation = self.cache.generation
+        loaded = {user_id: [] for user_id in missing}
+        result = await self.session.execute(
+            select(ReferralPath.descendant_id, ReferralPath.ancestor_id, ReferralPath.depth)
+            .where(ReferralPath.descendant_id.in_(missing), ReferralPath.depth <= max_depth)
+            .order_by(ReferralPath.descendant_id, ReferralPath.depth))
+        for descendant_id, ancestor_id, depth in result.all():
+            loaded[descendant_id].append((ancestor_id, depth))
+        self.cache.fill(loaded, max_depth, generation)
+        uplines.update(loaded)
+        return uplines
+
+
+    async def is_descendant(self, ancestor_id: int, descendant_id: int) -> bool:
+        """tells whether descendant_id is somewhere in the downline of ancestor_id"""
+        return bool(await self.session.scalar(select(exists().where(
+            ReferralPath.ancestor_id == ancestor_id,
+            ReferralPath.descendant_id == descendant_id))))
+
+
+    @staticmethod
+    def downline_stmt(user_id: int, max_depth: int):
+        """returns a select of the user's referrals down to max_depth"""
+        return (select(ReferralPath.descendant_id)
+                .where(ReferralPath.ancestor_id == user_id, ReferralPath.depth <= max_depth))
+
+
+    async def rebuild(self) -> int:
+        """recomputes the closure table from the referrals table and returns the path count,
+           the path of every walk stops it at a user it has already passed, so a cycle in
+           the referrals ends the walk instead of running forever"""
+        paths = (select(Referral.referrer_id.label("ancestor_id"),
+                        Referral.referred_id.label("descendant_id"),
+                        literal(1).label("depth"),
+                        array([Referral.referrer_id, Referral.referred_id]).label("path"))
+                 .where(Referral.referrer_id != Referral.referred_id)
+                 .cte("paths", recursive=True))
+        paths = paths.union_all(
+            select(paths.c.ancestor_id, Referral.referred_id, paths.c.depth + 1,
+                   paths.c.path.op("||", return_type=ARRAY(Integer))(Referral.referred_id))
+            .join(Referral, Referral.referrer_id == paths.c.descendant_id)
+            .where(Referral.referred_id != all_(paths.c.path)))
+        # a user with two referrers reaches its downline twice, the shortest path wins
+        shortest = (select(paths.c.ancestor_id, paths.c.descendant_id, func.min(paths.c.depth))
+                    .where(paths.c.ancestor_id != paths.c.descendant_id)
+                    .group_by(paths.c.ancestor_id, paths.c.descendant_id))
+        await self.session.execute(delete(ReferralPath))
+        result = await self.session.execute(
+            insert(ReferralPath).from_select(
+                ["ancestor_id", "descendant_id", "depth"], shortest))
+        await self.session.commit()
+        self.cache.invalidate()
+        self.logger.info("Rebuilt %d referral paths", result.rowcount)
+        return result.rowcount
@@ -0,0 +1,127 @@
+import decimal
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from pytz import timezone
+from sqlalchemy import select, delete, insert, func, cast, case, literal, Date, DateTime, Numeric
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.model import BonusRollup, PayoutRollup, ReferralPath, Transaction
+from app.utils.crud_repository import unit_of_work
+
+
+class RollupService:
+    """keeps the daily bonus and payout rollups, the writes join the caller's
+       transaction so a rollup never counts an allocation that was rolled back"""
+    GROUP_BY = ("day", "week", "month", "year")
+
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+
+    @staticmethod
+    def rollup_day(value: Optional[datetime]) -> date:
+        """returns the day of a transaction date in the rollup timezone"""
+        tz = timezone(settings.ROLLUP_TIMEZONE)
+        return (value or datetime.now(tz)).astimezone(tz).date()
+
+
+    async def add_bonuses(self, rows: Dict[Tuple[int, int, date], dict]) -> None:
+        """adds the bonuses keyed by (user_id, line, day) to the rollup with one upsert"""
+        if not rows:
+            return
+        # a stable order keeps concurrent batches from locking rows in opposite order
+        values = [{'user_id': user_id, 'line': line, 'day': day, **rows[user_id, line, day]}
+                  for user_id, line, day in sorted(rows)]
+        stmt = pg_insert(BonusRollup).values(values)
+        await self.session.execute(stmt.on_conflict_do_update(
+            index_elements=[BonusRollup.user_id, BonusRollup.line, BonusRollup.day],
+            set_={
+                'amount': BonusRollup.amount + stmt.excluded.amount,
+                'purchases': BonusRollup.purchases + stmt.excluded.purchases
+            }
+        ))
+
+
+    async def add_payout(self, user_id: int, amount: decimal.Decimal, day: date) -> None:
+        """adds a payout to the user's rollup of the day"""
+        stmt = pg_insert(PayoutRollup).values(user_id=user_id, day=day, amount=amount, payouts=1)
+        await self.session.execute(stmt.on_conflict_do_update(
+            index_elements=[PayoutRollup.user_id, PayoutRollup.day],
+            set_={
+                'amount': PayoutRollup.amount + stmt.excluded.amount,
+                'payouts': PayoutRollup.payouts + 1
+            }
+        ))
+
+
+    async def rebuild(self, bonus_rates: Dict[int, float], minimum_amount: float) -> None:
+        """recomputes both rollups from the transactions and commits. The bonuses follow
+           the current referral tree, so referrals removed since an allocation are not
+           counted again"""
+        # inlined, so the day expression of the select list and the GROUP BY match
+        tz = literal(settings.ROLLUP_TIMEZONE, literal_execute=True)
+        day = cast(func.timezone(tz, Transaction.transaction_date), Date)
+        rate = case(*((ReferralPath.depth == depth, rate) for depth, rate in bonus_rates.items()))
+        bonuses = (
+            select(ReferralPath.ancestor_id, ReferralPath.depth, day,
+                   func.sum(func.round(cast(Transaction.amount * rate, Numeric), 2)),
+                   func.count())
+            .join_from(Transaction, ReferralPath, ReferralPath.descendant_id == Transaction.user_id)
+            .where(ReferralPath.depth <= max(bonus_rates),
+                   Transaction.bonus_pending.is_(False),
+                   Transaction.amount >= minimum_amount,
+                   Transaction.transaction_type != 'request_payout')
+            .group_by(ReferralPath.ancestor_id, ReferralPath.depth, day)
+        )
+        payouts = (
+            select(Transaction.user_id, day, func.sum(cast(Transaction.amount, Numeric)),
+                   func.count())
+            .where(Transaction.transaction_type == 'request_payout')
+            .group_by(Transaction.user_id, day)
+        )
+        async with unit_of_work(self.session):
+            await self.session.execute(delete(BonusRollup))
+            await self.session.execute(delete(PayoutRollup))
+            await self.session.execute(insert(BonusRollup).from_select(
+                ['user_id', 'line', 'day', 'amount', 'purchases'], bonuses))
+            await self.session.execute(insert(PayoutRollup).from_select(
+                ['user_id', 'day', 'amount', 'payouts'], payouts))
+
+
+    @staticmethod
+    def _period(column, group_by: str):
+        """returns the first day of the day, week, month or year of a rollup day"""
+        return cast(func.date_trunc(literal(group_by, literal_execute=True),
+                                    cast(column, DateTime)), Date).label('period')
+
+
+    async def bonus_totals(self, user_id: int, start_date: Optional[date],
+                           end_date: Optional[date], group_by: str) -> List[tuple]:
+        """returns the (period, line, amount, purchases) bonus totals of a referrer"""
+        period = self._period(BonusRollup.day, group_by)
+        stmt = (select(period, BonusRollup.line, func.sum(BonusRollup.amount),
+                       func.sum(BonusRollup.purchases))
+                .where(BonusRollup.user_id == user_id))
+        if start_date:
+            stmt = stmt.where(BonusRollup.day >= start_date)
+        if end_date:
+            stmt = stmt.where(BonusRollup.day <= end_date)
+        result = await self.session.execute(
+            stmt.group_by(period, BonusRollup.line).order_by(period, BonusRollup.line))
+        return result.all()
+
+
+    async def payout_totals(self, user_id: int, start_date: Optional[date],
+                            end_date: Optional[date], group_by: str) -> List[tuple]:
+        """returns the (period, amount, payouts) payout totals of a user"""
+        period = self._period(PayoutRollup.day, group_by)
+        stmt = (select(period, func.sum(PayoutRollup.amount), func.sum(PayoutRollup.payouts))
+                .where(PayoutRollup.user_id == user_id))
+        if start_date:
+            stmt = stmt.where(PayoutRollup.day >= start_date)
+        if end_date:
+            stmt = stmt.where(PayoutRollup.day <= end_date)
+        result = await self.session.execute(stmt.group_by(period).order_by(period))
+        return result.all()
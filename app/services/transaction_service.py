@@ -1,13 +1,27 @@
 import decimal
 import logging
-from datetime import datetime, timedelta
-from typing import List
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import List, AsyncIterator, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.models.model import Transaction, Referral, Wallet
-from app.schemas.schema import TransactionCreate, TransactionResponse, BalanceResponse
-from app.utils.crud_repository import CrudRepository
-from app.utils.utils import replace_date_format
+from sqlalchemy import select, update, case, tuple_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.core.config import settings
+from app.models.model import Transaction, Wallet, User
+from app.schemas.schema import (
+    TransactionCreate, TransactionResponse, BalanceResponse,
+    BulkTransactionResult, BulkTransactionResponse, WalletResponse,
+    BonusSummaryItem, BonusSummaryResponse, PayoutSummaryItem, PayoutSummaryResponse
+)
+from app.services.bonus_worker import bonus_worker
+from app.services.referral_tree import ReferralTree
+from app.services.rollup_service import RollupService
+from app.utils.balance_cache import balance_cache
+from app.utils.crud_repository import (
+    CrudRepository, unit_of_work, after_commit, after_rollback, save_changes, invalidate_read_cache
+)
+from app.utils.duplicate_guard import DuplicateGuard, duplicate_guard
+from app.utils.utils import replace_date_format, format_transaction_date
 
 
 class TransactionService:
@@ -15,11 +29,22 @@ class TransactionService:
     MINIMUM_TRANSACTION_AMOUNT = 10.00
     FIRST_LINE_BONUS_RATE = 0.10
     SECOND_LINE_BONUS_RATE = 0.05
+    # bonus rate per referral depth, deeper levels only need a new entry here
+    BONUS_RATES = {1: FIRST_LINE_BONUS_RATE, 2: SECOND_LINE_BONUS_RATE}
+    # wallet column that tracks the bonuses of a depth next to the balance
+    BONUS_LINES = {1: 'first_line', 2: 'second_line'}
+    MAX_BULK_TRANSACTIONS = 5000
+    STREAM_CHUNK_SIZE = 1000
+    EXPORT_COLUMNS = (Transaction.id, Transaction.user_id, Transaction.transaction_type,
+                      Transaction.amount, Transaction.transaction_date)
 
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, guard: DuplicateGuard = duplicate_guard):
         self.session = session
+        self.duplicate_guard = guard
         self.logger = logging.getLogger(__name__)
+        # wallet snapshots written in the current transaction, cached after the commit
+        self._wallet_writes = []
 
 
     async def create_transaction(self, transaction:
@@ -28,26 +53,148 @@ class TransactionService:
           identical transaction only after a minute."""
         crud_repository = CrudRepository(self.session, Transaction)
         transac_dict = transaction.model_dump(exclude_unset=True)
-
-        one_minute = datetime.now() - timedelta(minutes=1)
+        transac_dict['bonus_pending'] = transac_dict['amount'] >= self.MINIMUM_TRANSACTION_AMOUNT
+        key = self._duplicate_key(transac_dict)
+
+        is_duplicate = await self.duplicate_guard.check(self.session, key)
+        keep_key = False
+        try:
+            if is_duplicate is None:
+                is_duplicate = await self._has_recent_duplicate(transac_dict)
+            if is_duplicate:
+                keep_key = True
+                return False
+            # the transaction and its inline bonuses are committed together
+            async with unit_of_work(self.session):
+                # an outer unit of work commits after this method returned
+                after_rollback(self.session, lambda: self.duplicate_guard.forget(key))
+                new_transaction = await crud_repository.create_one(transac_dict)
+                response = await self.transaction_response(new_transaction)
+            keep_key = True
+        finally:
+            # the key stays marked only for a transaction that exists, a failed or
+            # cancelled request must not block its retry for the whole window
+            if not keep_key:
+                self.duplicate_guard.forget(key)
+        return response
+
+
+    async def _has_recent_duplicate(self, transac_dict: dict) -> bool:
+        """checks the database for an identical transaction within the expiry window"""
+        one_minute = datetime.now() - timedelta(seconds=settings.DUPLICATE_GUARD_TTL_SECONDS)
         # Find the identical transaction within 1 minute
-        stmt = select(Transaction).where(
+        stmt = select(Transaction.id).where(
             Transaction.user_id == transac_dict['user_id'],
             Transaction.transaction_type == transac_dict['transaction_type'],
             Transaction.amount == transac_dict['amount'],
             Transaction.transaction_date >= one_minute
-        )
+        ).limit(1)
         result = await self.session.execute(stmt)
-        existing_transaction = result.scalars().first()
-        if existing_transaction:
-            return False
+        return result.scalars().first() is not None
+
+
+    async def create_transactions_bulk(
+            self, transactions: List[TransactionCreate]) -> BulkTransactionResponse:
+        """this method creates a batch of transactions with the duplicate guard of every key,
+           one duplicate query, one multi-row insert and one commit for all referral bonuses.
+           Every item gets its own result, so partial rejects are visible"""
+        results = [None] * len(transactions)
+        candidates = {}
+        for index, transaction in enumerate(transactions):
+            if transaction.amount <= 0:
+                results[index] = BulkTransactionResult(
+                    index=index, status="rejected",
+                    detail="Transaction amount must be greater than zero")
+                continue
+            candidates[index] = transaction.model_dump(exclude_unset=True)
+
+        guarded_keys, created = set(), []
+        try:
+            if candidates:
+                user_ids = {item['user_id'] for item in candidates.values()}
+                result = await self.session.execute(select(User.id).where(User.id.in_(user_ids)))
+                existing_user_ids = set(result.scalars().all())
+
+                # every key goes through the same guard as a single transaction, in a stable
+                # order, so concurrent batches take the advisory locks in the same order
+                seen_keys, unchecked_keys = set(), []
+                for key in sorted({self._duplicate_key(item) for item in candidates.values()}):
+                    is_duplicate = await self.duplicate_guard.check(self.session, key)
+                    if is_duplicate:
+                        seen_keys.add(key)
+                        continue
+                    guarded_keys.add(key)
+                    if is_duplicate is None:
+                        unchecked_keys.append(key)
+
+                if unchecked_keys:
+                    one_minute = datetime.now() - timedelta(
+                        seconds=settings.DUPLICATE_GUARD_TTL_SECONDS)
+                    # Find all identical transactions of the batch within 1 minute in one query
+                    stmt = select(
+                        Transaction.user_id, Transaction.transaction_type, Transaction.amount
+                    ).where(
+                        tuple_(Transaction.user_id, Transaction.transaction_type,
+                               Transaction.amount).in_(unchecked_keys),
+                        Transaction.transaction_date >= one_minute
+                    )
+                    result = await self.session.execute(stmt)
+                    seen_keys.update((row.user_id, row.transaction_type, float(row.amount))
+                                     for row in result.all())
+
+                for index, item in list(candidates.items()):
+                    key = self._duplicate_key(item)
+                    if item['user_id'] not in existing_user_ids:
+                        results[index] = BulkTransactionResult(
+                            index=index, status="rejected", detail="User not found")
+                    elif key in seen_keys:
+                        results[index] = BulkTransactionResult(
+                            index=index, status="duplicate",
+                            detail="The similar transaction you can create from а minute")
+                    else:
+                        seen_keys.add(key)
+                        continue
+                    del candidates[index]
+
+            if candidates:
+                async with unit_of_work(self.session):
+                    new_transactions = await CrudRepository(
+                        self.session, Transaction).create_many(list(candidates.values()))
+                    created = list(zip(candidates.keys(), new_transactions))
+                    rollups = {}
+                    await self.apply_wallet_credits(await self.collect_bonus_credits(
+                        [transaction for _, transaction in created], rollups))
+                    await RollupService(self.session).add_bonuses(rollups)
+                    await self._commit()
+        finally:
+            # only the keys of created transactions stay marked, a rejected, failed
+            # or cancelled batch must not block its retry for the whole window
+            created_keys = {self._duplicate_key(candidates[index]) for index, _ in created}
+            for key in guarded_keys - created_keys:
+                self.duplicate_guard.forget(key)
+
+        for index, transaction in created:
+            self.duplicate_guard.mark(self._duplicate_key(candidates[index]))
+            results[index] = BulkTransactionResult(
+                index=index, status="created",
+                transaction=self.format_transaction(transaction))
+        return BulkTransactionResponse(
+            created=len(created),
+            rejected=len(transactions) - len(created),
+            results=results
+        )
 
-        new_transaction = await crud_repository.create_one(transac_dict)
-        return await self.transaction_response(new_transaction)
 
+    @staticmethod
+    def _duplicate_key(transaction: dict) -> tuple:
+        """returns the key two transactions are compared by in the duplicate check"""
+        return (transaction['user_id'], transaction['transaction_type'],
+                float(transaction['amount']))
 
-    async def transaction_response(self, transaction: Transaction) -> TransactionResponse:
-        """create a TransactionResponse object from a Transaction"""
+
+    @staticmethod
+    def format_transaction(transaction: Transaction) -> TransactionResponse:
+        """create a TransactionResponse object from a Transaction without side effects"""
         formatted_date = transaction.get_transaction_date_in_local().strftime('%Y-%m-%d, %H:%M')
         data = {
             "id": transaction.id,
@@ -56,72 +203,177 @@ class TransactionService:
             "amount": transaction.amount,
             "transaction_date": formatted_date
         }
-        await self.add_bonuses(transaction)
         return TransactionResponse.model_validate(data)
 
 
+    async def transaction_response(self, transaction: Transaction) -> TransactionResponse:
+        """create a TransactionResponse object from a Transaction and hands its bonuses
+           to the bonus worker, they are allocated inline when the worker is not running"""
+        response = self.format_transaction(transaction)
+        if transaction.bonus_pending:
+            if bonus_worker.is_running:
+                # the worker must not see the transaction before it is committed
+                after_commit(self.session, lambda: bonus_worker.enqueue(transaction.id))
+            else:
+                await self.add_bonuses(transaction)
+        return response
+
+
+    async def collect_bonus_credits(self, transactions: List[Transaction],
+                                    rollups: Optional[dict] = None) -> dict:
+        """this method resolves the whole referral upline of a batch of transactions
+           with one closure table lookup and returns the credits per wallet owner,
+           the bonuses per (referrer, line, day) are added to rollups when it is given"""
+        purchases = [transaction for transaction in transactions
+                     if transaction.amount >= self.MINIMUM_TRANSACTION_AMOUNT]
+        wallet_credits = defaultdict(lambda: {
+            'balance': decimal.Decimal(0),
+            'first_line': decimal.Decimal(0),
+            'second_line': decimal.Decimal(0),
+            'purchases': 0
+        })
+        if not purchases:
+            return wallet_credits
+
+        uplines = await ReferralTree(self.session).get_uplines(
+            {transaction.user_id for transaction in purchases}, max(self.BONUS_RATES))
+        for transaction in purchases:
+            for referrer_id, depth in uplines.get(transaction.user_id, ()):
+                bonus_amount = self._to_money(transaction.amount * self.BONUS_RATES[depth])
+                credit = wallet_credits[referrer_id]
+                credit['balance'] += bonus_amount
+                if depth in self.BONUS_LINES:
+                    credit[self.BONUS_LINES[depth]] += bonus_amount
+                credit['purchases'] += 1
+                if rollups is not None:
+                    day = RollupService.rollup_day(transaction.transaction_date)
+                    rollup = rollups.setdefault((referrer_id, depth, day),
+                                                {'amount': decimal.Decimal(0), 'purchases': 0})
+                    rollup['amount'] += bonus_amount
+                    rollup['purchases'] += 1
+        return wallet_credits
+
+
+    async def apply_wallet_credits(self, wallet_credits: dict) -> None:
+        """adds the collected credits to the wallets with one upsert statement,
+           the caller is responsible for the commit"""
+        if not wallet_credits:
+            return
+        # a stable order keeps concurrent batches from locking wallets in opposite order
+        rows = [{'user_id': user_id, **wallet_credits[user_id]}
+                for user_id in sorted(wallet_credits)]
+        balance_cache.invalidate(wallet_credits.keys())
+        invalidate_read_cache(self.session, Wallet)
+        result = await self.session.execute(self._wallet_credit_stmt(rows))
+        self._wallet_writes.extend(WalletResponse.model_validate(row) for row in result.all())
+        self.logger.info('Bonuses credited to %d wallets', len(wallet_credits))
+
+
+    async def _commit(self) -> None:
+        """commits the session and writes the changed wallets through to the balance cache,
+           inside a unit of work the cache is written after the outer commit"""
+        wallet_writes, self._wallet_writes = self._wallet_writes, []
+        await save_changes(self.session, on_commit=lambda: balance_cache.put(wallet_writes))
+
+
+    @staticmethod
+    def _to_money(amount: float) -> decimal.Decimal:
+        """returns the amount rounded to cents the same way the wallet columns store it"""
+        return decimal.Decimal(amount).quantize(decimal.Decimal('0.01'),
+                                                rounding=decimal.ROUND_HALF_UP)
+
+
     async def add_bonuses(self, transaction: Transaction) -> None:
         """this method allocates bonuses from referrals: 10% of
            the purchase amount from the first level and 5% from the second level"""
-        if transaction.amount < self.MINIMUM_TRANSACTION_AMOUNT:
-            return
-        referral_crud_repository = CrudRepository(self.session, Referral)
-        referral_first_line = await referral_crud_repository.get_one_by(
-            referred_id=transaction.user_id)
-        if referral_first_line:
-            referrer_id_first_line = referral_first_line.referrer_id
-            bonus_amount_first_line = transaction.amount * self.FIRST_LINE_BONUS_RATE  # 10%
-            await self.update_wallet_balance(
-                referrer_id_first_line,
-                bonus_amount_first_line,
-                line="first"
-            )
-            self.logger.info('Bonus %.2f first line (user_id: %d)',
-                             bonus_amount_first_line, referrer_id_first_line)
-
-            referral_second_line = await referral_crud_repository.get_one_by(
-             referred_id=referrer_id_first_line
-            )
-            if referral_second_line:
-                referrer_id_second_line = referral_second_line.referrer_id
-                bonus_amount_second_line = transaction.amount * self.SECOND_LINE_BONUS_RATE  # 5%
-                await self.update_wallet_balance(
-                    referrer_id_second_line,
-                    bonus_amount_second_line,
-                    line="second"
-                )
-                self.logger.info('Bonus %.2f second line (user_id: %d)', bonus_amount_second_line,
-                                 referrer_id_second_line)
+        async with unit_of_work(self.session):
+            await self._credit_bonuses([transaction])
+            await self._commit()
+
+
+    async def process_pending_bonuses(self, transaction_ids: List[int]) -> int:
+        """allocates the bonuses of the pending transactions in one commit and returns
+           how many were processed, rows locked by another worker are skipped"""
+        stmt = (select(Transaction)
+                .where(Transaction.id.in_(transaction_ids),
+                       Transaction.bonus_pending.is_(True))
+                .with_for_update(skip_locked=True))
+        async with unit_of_work(self.session):
+            result = await self.session.execute(stmt)
+            transactions = result.scalars().all()
+            if transactions:
+                await self._credit_bonuses(transactions)
+            await self._commit()
+        return len(transactions)
+
+
+    async def _credit_bonuses(self, transactions: List[Transaction]) -> None:
+        """credits the referrer wallets for the transactions and clears their pending marker,
+           the caller opens the unit of work"""
+        rollups = {}
+        await self.apply_wallet_credits(await self.collect_bonus_credits(transactions, rollups))
+        await RollupService(self.session).add_bonuses(rollups)
+        pending_ids = [transaction.id for transaction in transactions if transaction.bonus_pending]
+        if pending_ids:
+            await CrudRepository(self.session, Transaction).update_where(
+                {'bonus_pending': False}, Transaction.id.in_(pending_ids))
 
 
     async def update_wallet_balance(self, user_id: int, bonus_amount: float, line: str) -> None:
         """updates the user's wallet balance depending on the referral line (first or second)
-           and returns common amount bonus transactions"""
-        wallet_crud_repository = CrudRepository(self.session, Wallet)
-        wallet = await wallet_crud_repository.get_one_by(user_id=user_id)
-        if wallet:
-            wallet.balance += decimal.Decimal(bonus_amount)
-            if line == "first":
-                wallet.first_line += decimal.Decimal(bonus_amount)
-                wallet.purchases += 1
-                await self.session.commit()
-            elif line == "second":
-                wallet.second_line += decimal.Decimal(bonus_amount)
-                wallet.purchases += 1
-                await self.session.commit()
-        else:
-            wallet_data = {
-                'user_id': user_id,
-                'balance': decimal.Decimal(bonus_amount),
-                'first_line': decimal.Decimal(bonus_amount) if line == "first" else decimal.Decimal(0),
-                'second_line': decimal.Decimal(bonus_amount) if line == "second" else decimal.Decimal(0),
-                'purchases': 1
+           with one atomic upsert, so concurrent bonuses for the same wallet are never lost"""
+        bonus_amount = self._to_money(bonus_amount)
+        wallet_data = {
+            'balance': bonus_amount,
+            'first_line': bonus_amount if line == "first" else decimal.Decimal(0),
+            'second_line': bonus_amount if line == "second" else decimal.Decimal(0),
+            'purchases': 1
+        }
+        await self.apply_wallet_credits({user_id: wallet_data})
+        await self._commit()
+
+
+    @staticmethod
+    def _wallet_credit_stmt(rows: List[dict]):
+        """returns an INSERT ... ON CONFLICT (user_id) DO UPDATE statement that adds
+           the given amounts to the existing wallets or creates the missing ones"""
+        stmt = pg_insert(Wallet).values(rows)
+        excluded = stmt.excluded
+        return stmt.on_conflict_do_update(
+            index_elements=[Wallet.user_id],
+            set_={
+                'balance': func.coalesce(Wallet.balance, 0) + excluded.balance,
+                'first_line': func.coalesce(Wallet.first_line, 0) + excluded.first_line,
+                'second_line': func.coalesce(Wallet.second_line, 0) + excluded.second_line,
+                'purchases': func.coalesce(Wallet.purchases, 0) + excluded.purchases,
+                'updated_at': func.now()
             }
-            await wallet_crud_repository.create_one(wallet_data)
+        ).returning(Wallet.user_id, Wallet.balance, Wallet.first_line,
+                    Wallet.second_line, Wallet.purchases)
+
+
+    @staticmethod
+    def _wallet_debit_stmt(user_id: int, amount: decimal.Decimal):
+        """returns an UPDATE that takes the amount from the wallet only when the balance
+           covers it, the bonus counters of an emptied wallet are reset by the same statement"""
+        emptied = Wallet.balance == amount
+        return (update(Wallet)
+                .where(Wallet.user_id == user_id, Wallet.balance >= amount)
+                .values(
+                    balance=Wallet.balance - amount,
+                    first_line=case((emptied, 0), else_=Wallet.first_line),
+                    second_line=case((emptied, 0), else_=Wallet.second_line),
+                    purchases=case((emptied, 0), else_=Wallet.purchases),
+                    updated_at=func.now())
+                .returning(Wallet.user_id, Wallet.balance, Wallet.first_line,
+                           Wallet.second_line, Wallet.purchases)
+                .execution_options(synchronize_session=False))
 
 
     async def request_payout(self, user_id: int, payout: float) -> TransactionResponse | dict:
-        """This method returns a transaction - a request to withdraw funds earned from referrals"""
+        """This method returns a transaction - a request to withdraw funds earned from referrals.
+           The balance is checked and debited by one conditional update, so concurrent
+           payouts can not overdraw the wallet and concurrent credits are never overwritten"""
         wallet_crud_repository = CrudRepository(self.session, Wallet)
         transaction_crud_repository = CrudRepository(self.session, Transaction)
 
@@ -132,31 +384,35 @@ class TransactionService:
         if wallet.balance == decimal.Decimal(0):
             return {"status": "error", "message": "Cannot withdraw. Your balance is zero"}
 
-        if payout <= 0:
+        # a fraction of a cent rounds to a zero debit, so the rounded amount is checked
+        payout_amount = self._to_money(payout)
+        if payout_amount <= 0:
             return {"status": "error", "message": "Withdrawal amount must be greater than zero"}
 
-        if wallet.balance < decimal.Decimal(payout):
+        if wallet.balance < payout_amount:
             return {"status": "error", "message": "Insufficient balance for withdrawal"}
 
-        wallet.balance -= decimal.Decimal(payout)
-
-        if wallet.balance < 0:
-            return {"status": "error", "message": "The wallet balance cannot be less than zero"}
-
+        balance_cache.invalidate([user_id])
+        invalidate_read_cache(self.session, Wallet)
         data = {
             'user_id': user_id,
             'transaction_type': 'request_payout',
-            'amount': decimal.Decimal(payout),
+            'amount': payout_amount,
         }
-        transaction = await transaction_crud_repository.create_one(data)
-
-        if transaction and wallet.balance == decimal.Decimal(0):
-            wallet.balance = decimal.Decimal(0)
-            wallet.first_line = decimal.Decimal(0)
-            wallet.second_line = decimal.Decimal(0)
-            wallet.purchases = decimal.Decimal(0)
-            await self.session.commit()
-            return TransactionResponse.model_validate(transaction)
+        # the debit and the payout transaction share one commit
+        async with unit_of_work(self.session):
+            result = await self.session.execute(self._wallet_debit_stmt(user_id, payout_amount))
+            debited = result.first()
+            if debited is None:
+                # a concurrent payout took the balance after it was read
+                return {"status": "error", "message": "Insufficient balance for withdrawal"}
+            transaction = await transaction_crud_repository.create_one(data)
+            if transaction:
+                await RollupService(self.session).add_payout(
+                    user_id, payout_amount, RollupService.rollup_day(transaction.transaction_date))
+            # the cache gets the row the debit returned once the payout is committed
+            self._wallet_writes.append(WalletResponse.model_validate(debited))
+            await self._commit()
         return TransactionResponse.model_validate(transaction)
 
 
@@ -164,58 +420,166 @@ class TransactionService:
             self, user_id: int, start_date: str | None,
             end_date: str | None) ->  List[TransactionResponse]:
         """this method returns first and second-line referral transactions filtered by date"""
-        referral_crud_repository = CrudRepository(self.session, Referral)
-        first_line_referrals = await referral_crud_repository.get_all_by(
-            referrer_id=user_id)
-        first_line_user_ids = [referral.referred_id for referral in first_line_referrals]
-
-        second_line_stmt = (select(Referral.referred_id)
-                            .where(Referral.referrer_id.in_(first_line_user_ids)))
-        result = await self.session.execute(second_line_stmt)
-        second_line_user_ids = [row[0] for row in result.all()]
-
-        all_referred_ids = first_line_user_ids + second_line_user_ids
-
-        if not all_referred_ids:
-            return []
-        stmt = select(Transaction).where(Transaction.user_id.in_(all_referred_ids))
-        start_date = datetime.strptime(start_date, "%d-%m-%Y")
-        if start_date:
-            stmt = stmt.where(Transaction.transaction_date >= start_date)
-        end_date = datetime.strptime(end_date, "%d-%m-%Y")
-        if end_date:
-            stmt = stmt.where(Transaction.transaction_date <= end_date)
+        stmt = self._bonus_transactions_stmt(
+            user_id, self.parse_date(start_date), self.parse_date(end_date), Transaction)
         result = await self.session.execute(stmt)
         transactions = result.scalars().all()
         transactions = await replace_date_format(transactions)
         return transactions
 
 
-    async def get_user_balance(self, user_id: int) -> BalanceResponse | None:
-        """this method returns user balance"""
-        wallet_crud_repository = CrudRepository(self.session, Wallet)
-        wallet = await wallet_crud_repository.get_one_by(user_id=user_id)
-        if wallet is None:
-            return None
-        return BalanceResponse(balance=wallet.balance)
+    async def stream_bonus_transactions_by_date(
+            self, user_id: int, start_date: datetime | None,
+            end_date: datetime | None) -> AsyncIterator[dict]:
+        """this method streams first and second-line referral transactions filtered
+           by date from a server-side cursor, memory does not grow with the result"""
+        stmt = self._bonus_transactions_stmt(user_id, start_date, end_date, *self.EXPORT_COLUMNS)
+        async for row in self._stream_transactions(stmt):
+            yield row
+
+
+    async def stream_payout_transactions_by_date(
+            self, user_id: int, start_date: datetime | None,
+            end_date: datetime | None) -> AsyncIterator[dict]:
+        """this method streams payout transactions filtered by date from a server-side cursor"""
+        stmt = self._payout_transactions_stmt(user_id, start_date, end_date, *self.EXPORT_COLUMNS)
+        async for row in self._stream_transactions(stmt):
+            yield row
+
+
+    async def _stream_transactions(self, stmt) -> AsyncIterator[dict]:
+        """yields the rows of the statement in chunks of STREAM_CHUNK_SIZE"""
+        stmt = (stmt.order_by(Transaction.transaction_date, Transaction.id)
+                .execution_options(yield_per=self.STREAM_CHUNK_SIZE))
+        result = await self.session.stream(stmt)
+        async for transaction in result:
+            yield {
+                "id": transaction.id,
+                "user_id": transaction.user_id,
+                "transaction_type": transaction.transaction_type,
+                "amount": str(transaction.amount),
+                "transaction_date": format_transaction_date(transaction.transaction_date)
+            }
 
 
-    async def filter_payout_transaction_by_date(
-            self, user_id: int, start_date: str | None, end_date: str | None) -> List[dict]:
-        """This method returns payout transactions filtered by date range for a specific user"""
+    @staticmethod
+    def parse_date(value: str | None) -> datetime | None:
+        """returns the datetime of a dd-mm-YYYY date from the url or None"""
+        return datetime.strptime(value, "%d-%m-%Y") if value else None
 
-        start_date= datetime.strptime(start_date, "%d-%m-%Y") if start_date else None
-        end_date = datetime.strptime(end_date, "%d-%m-%Y") if end_date else None
-        stmt = select(Transaction).where(
+
+    @classmethod
+    def parse_day(cls, value: str | None) -> date | None:
+        """returns the date of a dd-mm-YYYY date from the url or None"""
+        parsed = cls.parse_date(value)
+        return parsed.date() if parsed else None
+
+
+    @staticmethod
+    def _bonus_transactions_stmt(user_id: int, start_date: datetime | None,
+                                 end_date: datetime | None, *entities):
+        """returns a select of the first and second-line referral transactions,
+           the downline is one lookup in the referral closure table"""
+        downline = ReferralTree.downline_stmt(user_id, max_depth=2)
+        stmt = select(*entities).where(Transaction.user_id.in_(downline))
+        if start_date:
+            stmt = stmt.where(Transaction.transaction_date >= start_date)
+        if end_date:
+            stmt = stmt.where(Transaction.transaction_date <= end_date)
+        return stmt
+
+
+    @staticmethod
+    def _payout_transactions_stmt(user_id: int, start_date: datetime | None,
+                                  end_date: datetime | None, *entities):
+        """returns a select of the user's payout transactions filtered by date"""
+        stmt = select(*entities).where(
             Transaction.user_id == user_id,
             Transaction.transaction_type == 'request_payout'
         )
-
         if start_date:
             stmt = stmt.where(Transaction.transaction_date >= start_date)
         if end_date:
             stmt = stmt.where(Transaction.transaction_date <= end_date)
+        return stmt
+
+
+    async def get_bonus_summary(self, user_id: int, start_date: str | None,
+                                end_date: str | None, group_by: str) -> BonusSummaryResponse:
+        """returns the first and second-line bonuses of a referrer per day, week, month
+           or year, read from the daily rollup only"""
+        totals = await RollupService(self.session).bonus_totals(
+            user_id, self.parse_day(start_date), self.parse_day(end_date), group_by)
+        items = {}
+        for period, line, amount, purchases in totals:
+            item = items.setdefault(period, BonusSummaryItem(
+                period=period, first_line=0, second_line=0, total=0, purchases=0))
+            if line in self.BONUS_LINES:
+                setattr(item, self.BONUS_LINES[line],
+                        getattr(item, self.BONUS_LINES[line]) + amount)
+            item.total += amount
+            item.purchases += purchases
+        items = list(items.values())
+        return BonusSummaryResponse(
+            user_id=user_id,
+            group_by=group_by,
+            first_line=sum((item.first_line for item in items), decimal.Decimal(0)),
+            second_line=sum((item.second_line for item in items), decimal.Decimal(0)),
+            total=sum((item.total for item in items), decimal.Decimal(0)),
+            items=items
+        )
+
+
+    async def get_payout_summary(self, user_id: int, start_date: str | None,
+                                 end_date: str | None, group_by: str) -> PayoutSummaryResponse:
+        """returns the payouts of a user per day, week, month or year,
+           read from the daily rollup only"""
+        totals = await RollupService(self.session).payout_totals(
+            user_id, self.parse_day(start_date), self.parse_day(end_date), group_by)
+        items = [PayoutSummaryItem(period=period, amount=amount, payouts=payouts)
+                 for period, amount, payouts in totals]
+        return PayoutSummaryResponse(
+            user_id=user_id,
+            group_by=group_by,
+            total=sum((item.amount for item in items), decimal.Decimal(0)),
+            items=items
+        )
+
+
+    async def rebuild_rollups(self) -> None:
+        """recomputes the bonus and payout rollups from the transactions"""
+        await RollupService(self.session).rebuild(self.BONUS_RATES, self.MINIMUM_TRANSACTION_AMOUNT)
+
 
+    async def get_user_balance(self, user_id: int) -> BalanceResponse | None:
+        """this method returns user balance"""
+        wallet = await self.get_wallet(user_id)
+        if wallet is None:
+            return None
+        return BalanceResponse(balance=wallet.balance)
+
+
+    async def get_wallet(self, user_id: int) -> WalletResponse | None:
+        """this method returns the user's wallet from the balance cache
+           and reads it from the database on a miss"""
+        wallet = balance_cache.get(user_id)
+        if wallet is not None:
+            return wallet
+        read_version = balance_cache.begin_read()
+        wallet_crud_repository = CrudRepository(self.session, Wallet)
+        wallet = await wallet_crud_repository.get_one_by(user_id=user_id)
+        if wallet is None:
+            return None
+        wallet = WalletResponse.model_validate(wallet)
+        balance_cache.fill(wallet, read_version)
+        return wallet
+
+
+    async def filter_payout_transaction_by_date(
+            self, user_id: int, start_date: str | None, end_date: str | None) -> List[dict]:
+        """This method returns payout transactions filtered by date range for a specific user"""
+        stmt = self._payout_transactions_stmt(
+            user_id, self.parse_date(start_date), self.parse_date(end_date), Transaction)
         result = await self.session.execute(stmt)
         transactions = result.scalars().all()
         transactions = await replace_date_format(transactions)
@@ -1,7 +1,8 @@
-import uuid
-from typing import Type
+import logging
+from typing import Type, Optional, List
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
 
 from pydantic import BaseModel
 from app.models.model import User, Transaction, Referral
@@ -11,17 +12,32 @@ from app.schemas.schema import (
     GetAllReferralsResponse, UserProfileResponse, RegisterUserSchema,
     GetAllNonReferralsResponse
 )
-from app.utils.crud_repository import CrudRepository
-from app.utils.exceptions import GenerateReferralCodeException
+from app.services.referral_tree import ReferralTree
+from app.utils.crud_repository import CrudRepository, unit_of_work, after_commit
+from app.utils.exceptions import GenerateReferralCodeException, UserAlreadyExistsException
 from app.utils.pagination import Pagination
-from app.utils.utils import replace_date_format, get_hash_password
+from app.utils.referral_codes import referral_code_pool
+from app.utils.utils import (
+    replace_date_format, get_hash_password, format_transaction_date, get_constraint_name
+)
 
 
 class UserService:
     """service class responsible for managing user-related operations"""
+    STREAM_CHUNK_SIZE = 1000
+    REFERRAL_CODE_ATTEMPTS = 3
+    REFERRAL_CODE_CONSTRAINT = "users_referral_code_key"
+    # the unique constraints of users that the client can violate and their messages
+    USER_CONFLICT_MESSAGES = {
+        "users_email_key": "User with this email already exists",
+        "users_username_key": "User with this username already registered",
+    }
+
+
     def __init__(self, session: AsyncSession, schema: Type[BaseModel] = None):
         self.session = session
         self.schema = schema
+        self.logger = logging.getLogger(__name__)
 
 
     async def is_user_exists(self, field: str, value: str) -> bool:
@@ -32,28 +48,37 @@ class UserService:
         return user is not None
 
 
-    async def generate_unique_referral_code(self, max_attempts: int = 2):
-        """this method returns a unique sequence of type string"""
-        attempts = 0
-        while attempts < max_attempts:
-            crud_repository = CrudRepository(self.session, User)
-            code = str(uuid.uuid4())[:10]
-            existing_code = await crud_repository.get_one_by(referral_code=code)
-            if not existing_code:
-                return code
-            attempts += 1
-        raise GenerateReferralCodeException()
+    async def generate_unique_referral_code(self) -> str:
+        """this method returns a unique sequence of type string, the codes are made
+           from a database sequence, so no lookup of the existing codes is needed"""
+        return await referral_code_pool.next_code(self.session)
 
 
     async def add_user(self, user: RegisterUserSchema) -> UserResponse:
-        """ this method returns a new user  """
-        hashed_password = get_hash_password(user.password)
+        """ this method returns a new user, the unique constraints decide about
+            conflicts: a taken email or username raises UserAlreadyExistsException
+            and a taken referral code is retried with a new code """
+        hashed_password = await get_hash_password(user.password)
         user_dict = user.model_dump(exclude={"password_check", "password"})
         user_dict["hashed_password"] = hashed_password
-        user_dict["referral_code"] = await self.generate_unique_referral_code()
         crud_repository = CrudRepository(self.session, User)
-        new_user = await crud_repository.create_one(user_dict)
-        return UserResponse.model_validate(new_user)
+        for _ in range(self.REFERRAL_CODE_ATTEMPTS):
+            user_dict["referral_code"] = await self.generate_unique_referral_code()
+            try:
+                new_user = await crud_repository.create_one(user_dict)
+            except IntegrityError as e:
+                await self.session.rollback()
+                constraint = get_constraint_name(e)
+                if constraint in self.USER_CONFLICT_MESSAGES:
+                    raise UserAlreadyExistsException(
+                        self.USER_CONFLICT_MESSAGES[constraint]) from e
+                if constraint != self.REFERRAL_CODE_CONSTRAINT:
+                    raise
+                self.logger.warning("Referral code %s is taken, retrying",
+                                    user_dict["referral_code"])
+                continue
+            return UserResponse.model_validate(new_user)
+        raise GenerateReferralCodeException()
 
 
     async def get_user(self, user_id: int,
@@ -63,44 +88,67 @@ class UserService:
         current_user = await user_crud_repository.get_one_by(id=user_id)
         if current_user is None:
             return None
-        transaction_crud_repository = CrudRepository(self.session, Transaction)
-        transactions = await transaction_crud_repository.get_all_by(user_id=user_id)
-        transactions = await replace_date_format(transactions)
-
-        pagination = Pagination(page_params, items=transactions, schema=PaginationResponse)
+        pagination = Pagination(
+            page_params,
+            schema=PaginationResponse,
+            query=select(Transaction).where(Transaction.user_id == user_id),
+            session=self.session,
+            keyset=(Transaction.transaction_date, Transaction.id),
+            transform=replace_date_format
+        )
         transactions = await pagination.get_pagination()
         transactions.user_id = current_user.id
         transactions.username = current_user.username
         return PaginationResponse.model_validate(transactions)
 
 
-    async def get_all_users(self, page_params: PageParams) -> PaginationListResponse:
-        """this method returns all users and their transactions"""
-        data = []
-        result = await self.session.execute(
-            select(User, Transaction)
-            .join(Transaction, Transaction.user_id == User.id)
+    async def get_all_users(self, page_params: PageParams,
+                            transactions_limit: Optional[int] = None) -> PaginationListResponse:
+        """this method returns a page of users who have transactions and their transactions,
+           at most transactions_limit most recent ones per user when it is given"""
+        has_transactions = select(Transaction.id).where(Transaction.user_id == User.id).exists()
+        pagination = Pagination(
+            page_params,
+            schema=PaginationListResponse,
+            query=select(User.id, User.username).where(has_transactions),
+            session=self.session,
+            keyset=(User.id,),
+            transform=lambda users: self._attach_transactions(users, transactions_limit)
         )
-        rows = result.fetchall()
-        for user, transaction in rows:
-            existing_user = next((item for item in data if item["user_id"] == user.id), None)
-            if not existing_user:
-                existing_user = {
-                    "user_id": user.id,
-                    "username": user.username,
-                    "transactions": []
-                }
-                data.append(existing_user)
-            transaction = await replace_date_format(transaction)
-            existing_user["transactions"].append({
+        users = await pagination.get_pagination()
+        return PaginationListResponse.model_validate(users)
+
+
+    async def _attach_transactions(self, users: list,
+                                   transactions_limit: Optional[int] = None) -> List[dict]:
+        """loads the transactions of a page of users with one streamed query
+           and groups them by user"""
+        data = {
+            user.id: {"user_id": user.id, "username": user.username, "transactions": []}
+            for user in users
+        }
+        columns = (Transaction.id, Transaction.user_id, Transaction.transaction_type,
+                   Transaction.amount, Transaction.transaction_date)
+        stmt = select(*columns).where(Transaction.user_id.in_(data.keys()))
+        if transactions_limit is not None:
+            rank = func.row_number().over(
+                partition_by=Transaction.user_id,
+                order_by=(Transaction.transaction_date.desc(), Transaction.id.desc())
+            ).label("rank")
+            ranked = select(*columns, rank).where(Transaction.user_id.in_(data.keys())).subquery()
+            stmt = (select(*(ranked.c[column.key] for column in columns))
+                    .where(ranked.c.rank <= transactions_limit))
+        stmt = stmt.order_by("user_id", "transaction_date", "id")
+
+        result = await self.session.stream(stmt.execution_options(yield_per=self.STREAM_CHUNK_SIZE))
+        async for transaction in result:
+            data[transaction.user_id]["transactions"].append({
                 "id": transaction.id,
                 "transaction_type": transaction.transaction_type,
                 "amount": transaction.amount,
-                "transaction_date": transaction.transaction_date
+                "transaction_date": format_transaction_date(transaction.transaction_date)
             })
-        pagination = Pagination(page_params, items=data, schema=PaginationListResponse)
-        users = await pagination.get_pagination()
-        return PaginationListResponse.model_validate(users)
+        return list(data.values())
 
 
     async def create_referral_by_code(self,
@@ -114,12 +162,28 @@ class UserService:
         existing_user = await user_crud_repository.get_one_by(id=referral_id)
         print(' existing_user: ', existing_user)
         if existing_user:
-            has_referer = await referral_crud_repository.get_one_by(referred_id=existing_user.id)
-            print('has_referer: ',has_referer )
-            if has_referer:
+            referral_tree = ReferralTree(self.session)
+            try:
+                async with unit_of_work(self.session):
+                    # two referrals of the same users can not pass the checks at once
+                    await referral_tree.lock()
+                    has_referer = await referral_crud_repository.get_one_by(
+                        referred_id=existing_user.id)
+                    print('has_referer: ',has_referer )
+                    if has_referer:
+                        return "has_referer"
+                    # a user can not be referred by itself or by its own downline,
+                    # the tree stays acyclic
+                    if user_referer.id == existing_user.id or await referral_tree.is_descendant(
+                            existing_user.id, user_referer.id):
+                        return "referral_cycle"
+                    await referral_tree.link(user_referer.id, existing_user.id)
+                    new_referral = await referral_crud_repository.create_one(
+                        {"referrer_id": user_referer.id, "referred_id": existing_user.id})
+                    after_commit(self.session, referral_tree.cache.invalidate)
+            except IntegrityError:
+                # referrals_referred_id_key, the referral was written without the tree lock
                 return "has_referer"
-            new_referral = await referral_crud_repository.create_one(
-                {"referrer_id": user_referer.id, "referred_id": existing_user.id})
             print('new_referral: ', new_referral)
             return new_referral
 
@@ -160,9 +224,7 @@ class UserService:
         referrals = await self.session.execute(
             select(User.id, User.username)
             .filter(User.id != user_id)
-            .filter(~User.id.in_(
-                select(Referral.referred_id)
-            ))
+            .filter(~select(Referral.id).where(Referral.referred_id == User.id).exists())
         )
 
         data = {
@@ -197,5 +259,10 @@ class UserService:
         )
         if not my_referral:
             return False
-        result = await refferal_crud_repository.delete_one(my_referral)
+        referral_tree = ReferralTree(self.session)
+        async with unit_of_work(self.session):
+            await referral_tree.lock()
+            await referral_tree.unlink(referrer_id, referred_id)
+            result = await refferal_crud_repository.delete_one(my_referral)
+            after_commit(self.session, referral_tree.cache.invalidate)
         return result
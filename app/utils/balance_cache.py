@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from typing import Iterable, Optional
+from app.core.config import settings
+from app.schemas.schema import WalletResponse
+from app.utils.cache import TTLCache
+
+
+class BalanceCache:
+    """caches wallet snapshots per user_id. Every credit or debit bumps a version
+    counter, and a snapshot read from the database before that write is never stored.
+    The cache is per process, other workers' writes become visible after the TTL"""
+    def __init__(self, max_size: int, ttl: float):
+        self.cache = TTLCache(max_size, ttl)
+        self.version = 0
+        # user_id -> version of its last write, bounded like the cache itself
+        self._written = OrderedDict()
+        # the newest version that was dropped from the write log
+        self._forgotten_version = 0
+
+
+    def get(self, user_id: int) -> Optional[WalletResponse]:
+        """returns the cached wallet snapshot or None"""
+        return self.cache.get(user_id)
+
+
+    def begin_read(self) -> int:
+        """returns the version a database read has to be filled with"""
+        return self.version
+
+
+    def fill(self, snapshot: WalletResponse, read_version: int) -> None:
+        """stores a snapshot read from the database unless the wallet
+        was written after the read started"""
+        if read_version != self.version:
+            if self._forgotten_version > read_version:
+                return
+            if self._written.get(snapshot.user_id, 0) > read_version:
+                return
+        self.cache.set(snapshot.user_id, snapshot)
+
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        """drops the snapshots of wallets that are about to be written"""
+        for user_id in user_ids:
+            self._record_write(user_id)
+            self.cache.pop(user_id)
+
+
+    def put(self, snapshots: Iterable[WalletResponse]) -> None:
+        """writes the committed snapshots through to the cache"""
+        for snapshot in snapshots:
+            self._record_write(snapshot.user_id)
+            self.cache.set(snapshot.user_id, snapshot)
+
+
+    def _record_write(self, user_id: int) -> None:
+        self.version += 1
+        self._written[user_id] = self.version
+        self._written.move_to_end(user_id)
+        while len(self._written) > self.cache.max_size:
+            _, version = self._written.popitem(last=False)
+            self._forgotten_version = max(self._forgotten_version, version)
+
+
+    def stats(self) -> dict:
+        """returns the hit and miss counters used to size the cache"""
+        return {**self.cache.stats(), "version": self.version}
+
+
+balance_cache = BalanceCache(
+    max_size=settings.BALANCE_CACHE_MAX_SIZE,
+    ttl=settings.BALANCE_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """a size-bounded LRU cache whose entries expire after a time to live.
+    It is meant for a single event loop and does no locking"""
+    def __init__(self, max_size: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # the latest expiry among the entries that were evicted before they expired
+        self.evicted_until = 0.0
+        self._data = OrderedDict()
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """returns the cached value and marks it as recently used
+        or the default when the key is missing or expired"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= self.timer():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """stores the value, evicting the least recently used entries when the cache is full"""
+        now = self.timer()
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            _, (expires_at, _) = self._data.popitem(last=False)
+            if expires_at > now:
+                self.evictions += 1
+                self.evicted_until = max(self.evicted_until, expires_at)
+
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """removes the key and returns its value or the default"""
+        item = self._data.pop(key, None)
+        if item is None or item[0] <= self.timer():
+            return default
+        return item[1]
+
+
+    def clear(self) -> None:
+        """removes all entries"""
+        self._data.clear()
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > self.timer()
+
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+    def stats(self) -> dict:
+        """returns the counters used to size the cache"""
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
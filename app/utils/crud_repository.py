@@ -1,11 +1,106 @@
 import logging
-from typing import Union
-from sqlalchemy import select, delete
+from contextlib import asynccontextmanager
+from typing import Callable, Iterable, List, Optional, Sequence, Union
+from sqlalchemy import select, delete, insert, update, event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 
 
 logger = logging.getLogger(__name__)
 
+# session.info key of the open unit of work, it holds the callbacks to run after the commit
+UNIT_OF_WORK = "unit_of_work"
+# session.info key of the callbacks to run when the open unit of work rolls back
+UNIT_OF_WORK_ROLLBACK = "unit_of_work_rollback"
+# session.info key of the request-scoped get_one_by cache
+READ_CACHE = "read_cache"
+
+
+@asynccontextmanager
+async def unit_of_work(session):
+    """groups all repository writes of the block into one transaction, the writes only
+       flush and the block commits once at the end or rolls back on an error.
+       A nested unit of work joins the outer one"""
+    if UNIT_OF_WORK in session.info:
+        yield session
+        return
+    session.info[UNIT_OF_WORK] = []
+    session.info[UNIT_OF_WORK_ROLLBACK] = []
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        for callback in session.info[UNIT_OF_WORK_ROLLBACK]:
+            callback()
+        raise
+    finally:
+        callbacks = session.info.pop(UNIT_OF_WORK)
+        session.info.pop(UNIT_OF_WORK_ROLLBACK)
+    for callback in callbacks:
+        callback()
+
+
+def in_unit_of_work(session) -> bool:
+    """returns True when the session is inside a unit of work"""
+    return UNIT_OF_WORK in session.info
+
+
+def after_commit(session, callback: Callable[[], object]) -> None:
+    """runs the callback once the unit of work has committed,
+       outside of a unit of work the last write is already committed"""
+    if in_unit_of_work(session):
+        session.info[UNIT_OF_WORK].append(callback)
+    else:
+        callback()
+
+
+def after_rollback(session, callback: Callable[[], object]) -> None:
+    """runs the callback if the unit of work rolls back, outside of a unit of work
+       there is nothing left to roll back"""
+    if in_unit_of_work(session):
+        session.info[UNIT_OF_WORK_ROLLBACK].append(callback)
+
+
+async def save_changes(session, on_commit: Optional[Callable[[], object]] = None) -> None:
+    """commits the session, or only flushes it inside a unit of work"""
+    if in_unit_of_work(session):
+        await session.flush()
+    else:
+        await session.commit()
+    if on_commit is not None:
+        after_commit(session, on_commit)
+
+
+def _read_cache(session) -> dict:
+    return session.info.setdefault(READ_CACHE, {"entries": {}, "saved": 0})
+
+
+def invalidate_read_cache(session, model=None) -> None:
+    """forgets the cached lookups of the model or of all models, call it after
+       writing the model with a statement that does not go through the repository"""
+    cache = session.info.get(READ_CACHE)
+    if cache is None:
+        return
+    if model is None:
+        cache["entries"].clear()
+    else:
+        cache["entries"] = {key: value for key, value in cache["entries"].items()
+                            if key[0] is not model}
+
+
+def queries_saved(session) -> int:
+    """returns how many get_one_by queries the session answered from its cache"""
+    cache = session.info.get(READ_CACHE)
+    return cache["saved"] if cache else 0
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_read_cache_on_rollback(session):
+    # the rollback expires the cached objects, reloading them lazily is not possible in async
+    invalidate_read_cache(session)
+
 
 class CrudRepository:
     """A class for performing asynchronous CRUD operations"""
@@ -26,26 +121,92 @@ class CrudRepository:
 
     async def get_one_by(self, **filter_by):
         """this method returns all records matching the given filter conditions
-        or None"""
+        or None. The answer is kept for the rest of the session, so a request
+        runs the same lookup only once until the model is written"""
+        cache = _read_cache(self.session)
+        key = (self.model, tuple(sorted(filter_by.items())))
+        if key in cache["entries"]:
+            cache["saved"] += 1
+            return cache["entries"][key]
         try:
             stmt = select(self.model).filter_by(**dict(filter_by))
             result = await self.session.execute(stmt)
             result = result.scalars().first()
-            return result
         except SQLAlchemyError as e:
             self.logger.error(" %s", str(e))
             return None
+        cache["entries"][key] = result
+        if result is not None and getattr(result, "id", None) is not None:
+            # a lookup by any column also answers the lookup by primary key
+            cache["entries"].setdefault((self.model, (("id", result.id),)), result)
+        return result
+
+
+    async def get_many_by_ids(self, ids: Iterable[int]) -> dict:
+        """this method returns the records with the given ids in one IN query,
+        keyed by id, missing ids are left out"""
+        ids = set(ids)
+        if not ids:
+            return {}
+        stmt = select(self.model).where(self.model.id.in_(ids))
+        result = await self.session.execute(stmt)
+        return {record.id: record for record in result.scalars().all()}
 
 
     async def create_one(self, data: dict):
         """this method creates a new record in the database with the given data"""
         new_data = self.model(**data)
         self.session.add(new_data)
-        await self.session.commit()
+        invalidate_read_cache(self.session, self.model)
+        await save_changes(self.session)
         await self.session.refresh(new_data)
         return new_data
 
 
+    async def create_many(self, rows: Sequence[dict]) -> List:
+        """this method creates the records with one multi-row insert
+        and returns them in the order of the rows"""
+        if not rows:
+            return []
+        invalidate_read_cache(self.session, self.model)
+        stmt = insert(self.model).returning(self.model, sort_by_parameter_order=True)
+        result = await self.session.scalars(stmt, list(rows))
+        records = result.all()
+        await save_changes(self.session)
+        return records
+
+
+    async def upsert_many(self, rows: Sequence[dict], index_elements: Sequence[str],
+                          update_columns: Optional[Sequence[str]] = None) -> List:
+        """this method inserts the rows or overwrites the given columns of the existing
+        records with one INSERT ... ON CONFLICT DO UPDATE and returns the records"""
+        if not rows:
+            return []
+        stmt = pg_insert(self.model).values(list(rows))
+        if update_columns is None:
+            update_columns = [key for key in rows[0] if key not in index_elements]
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(index_elements),
+            set_={column: stmt.excluded[column] for column in update_columns}
+        ).returning(self.model)
+        invalidate_read_cache(self.session, self.model)
+        result = await self.session.scalars(
+            stmt, execution_options={"populate_existing": True})
+        records = result.all()
+        await save_changes(self.session)
+        return records
+
+
+    async def update_where(self, values: dict, *criteria, **filter_by) -> int:
+        """this method updates all records matching the criteria with one statement
+        and returns the number of updated rows"""
+        stmt = update(self.model).where(*criteria).filter_by(**filter_by).values(**values)
+        invalidate_read_cache(self.session, self.model)
+        result = await self.session.execute(stmt)
+        await save_changes(self.session)
+        return result.rowcount
+
+
     async def get_all(self):
         """this method returns all records from the database"""
         stmt = select(self.model)
@@ -56,10 +217,11 @@ class CrudRepository:
 
     async def delete_one(self, delete_param: Union[int, object]):
         """his method deletes a record from the database, either by ID or object """
+        invalidate_read_cache(self.session, self.model)
         if isinstance(delete_param, int):
             stmt = delete(self.model).where(self.model.id == delete_param)
             await self.session.execute(stmt)
         elif isinstance(delete_param, self.model):
             await self.session.delete(delete_param)
-        await self.session.commit()
+        await save_changes(self.session)
         return True
@@ -0,0 +1,88 @@
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.utils.cache import TTLCache
+
+
+class DuplicateGuard(ABC):
+    """base class for the backends that suppress identical transactions
+    keyed on (user_id, transaction_type, amount) within the expiry window"""
+
+    @abstractmethod
+    async def check(self, session: AsyncSession, key: tuple) -> Optional[bool]:
+        """returns True for a duplicate, False for a new transaction or None
+        when the caller has to look for a recent duplicate in the database"""
+
+
+    def mark(self, key: tuple) -> None:
+        """remembers that a transaction with this key was just created"""
+
+
+    def forget(self, key: tuple) -> None:
+        """drops the key again when the transaction could not be created"""
+
+
+class InMemoryDuplicateGuard(DuplicateGuard):
+    """keeps the recent keys in a bounded LRU/TTL cache, for single-process deployments.
+    A miss is only trusted after the process has run for a whole window and no
+    live key has been evicted, before that the database is asked"""
+    def __init__(self, max_size: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.cache = TTLCache(max_size, ttl, timer)
+        self.timer = timer
+        self.started_at = timer()
+
+
+    def is_authoritative(self) -> bool:
+        """returns True when every transaction of the last window is in the cache"""
+        now = self.timer()
+        return now - self.started_at >= self.cache.ttl and now >= self.cache.evicted_until
+
+
+    async def check(self, session: AsyncSession, key: tuple) -> Optional[bool]:
+        if key in self.cache:
+            return True
+        authoritative = self.is_authoritative()
+        # the key is marked before any await, so a concurrent identical request sees it
+        self.mark(key)
+        return False if authoritative else None
+
+
+    def mark(self, key: tuple) -> None:
+        self.cache.set(key, True)
+
+
+    def forget(self, key: tuple) -> None:
+        self.cache.pop(key)
+
+
+class DatabaseDuplicateGuard(DuplicateGuard):
+    """serializes identical transactions of all workers with a transaction-level
+    advisory lock, the caller then runs the duplicate query under the lock"""
+
+    @staticmethod
+    def lock_id(key: tuple) -> int:
+        """returns a stable signed 64-bit advisory lock id for the key"""
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+
+    async def check(self, session: AsyncSession, key: tuple) -> Optional[bool]:
+        await session.execute(select(func.pg_advisory_xact_lock(self.lock_id(key))))
+        return None
+
+
+def create_duplicate_guard() -> DuplicateGuard:
+    """returns the duplicate guard backend configured in the settings"""
+    if settings.DUPLICATE_GUARD_BACKEND == "database":
+        return DatabaseDuplicateGuard()
+    return InMemoryDuplicateGuard(
+        max_size=settings.DUPLICATE_GUARD_MAX_SIZE,
+        ttl=settings.DUPLICATE_GUARD_TTL_SECONDS
+    )
+
+
+duplicate_guard = create_duplicate_guard()
@@ -30,6 +30,20 @@ class GenerateReferralCodeException(Exception):
         super().__init__(self.message)
 
 
+class UserAlreadyExistsException(Exception):
+    """raised when a unique column of a new user is already taken"""
+    def __init__(self, message="User already exists."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidCursorException(Exception):
+    """raised when a pagination cursor can't be decoded"""
+    def __init__(self, message="Invalid pagination cursor."):
+        self.message = message
+        super().__init__(self.message)
+
+
 class TokenError(CustomTokenExceptionBase):
     """raised for general token errors"""
     def __init__(self, detail: str):
@@ -43,4 +57,22 @@ class TokenNotFoundException(HTTPException):
         super().__init__(401, detail)
 
 
+class IdempotencyKeyInProgressException(Exception):
+    """raised when a request with the same idempotency key is still being processed"""
+    def __init__(self, message="A request with this Idempotency-Key is still in progress."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class IdempotencyKeyMismatchException(Exception):
+    """raised when an idempotency key is reused with a different request"""
+    def __init__(self, message="This Idempotency-Key was used with a different request."):
+        self.message = message
+        super().__init__(self.message)
+
 
+class PasswordHasherBusyException(Exception):
+    """raised when the password hashing queue is full"""
+    def __init__(self, message="Too many password checks in progress, try again later."):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+
+EXPORT_FIELDS = ("id", "user_id", "transaction_type", "amount", "transaction_date")
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def to_ndjson(rows: AsyncIterator[dict], chunk_rows: int = 500) -> AsyncIterator[str]:
+    """yields the rows as newline-delimited JSON, several rows per chunk"""
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(row, default=str) + "\n")
+        if len(lines) >= chunk_rows:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+async def to_csv(rows: AsyncIterator[dict], chunk_rows: int = 500) -> AsyncIterator[str]:
+    """yields a header line and then the rows as CSV, several rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    # the header goes out right away, so the client sees the first byte early
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if count:
+        yield buffer.getvalue()
+
+
+EXPORT_FORMATTERS = {
+    "ndjson": to_ndjson,
+    "csv": to_csv,
+}
@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+
+class Histogram:
+    """latency histogram with the cumulative buckets of the Prometheus text format"""
+    # upper bounds of the buckets in seconds, the last bucket is unbounded
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, seconds: float) -> None:
+        """adds one observation"""
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+    def cumulative(self):
+        """yields the (upper bound, observations up to it) pairs, ending with +Inf"""
+        running = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            running += count
+            yield str(bound), running
+        yield "+Inf", self.count
+
+
+@dataclass
+class QueryStats:
+    """the queries a single request sent to the database"""
+    count: int = 0
+    seconds: float = 0.0
+
+
+# set by the middleware for the lifetime of a request, the engine hooks add to it
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_query_stats", default=None)
+
+
+def escape(value: str) -> str:
+    """escapes a label value of the Prometheus text format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """collects the request and database metrics of the process and renders them
+       in the Prometheus text format, so no agent or client library is needed"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self) -> None:
+        """forgets everything that was recorded"""
+        with self._lock:
+            self.requests: Dict[Tuple[str, str, int], int] = {}
+            self.request_latency: Dict[Tuple[str, str], Histogram] = {}
+            self.request_queries: Dict[Tuple[str, str], int] = {}
+            self.request_db_seconds: Dict[Tuple[str, str], float] = {}
+            self.query_latency = Histogram()
+
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float,
+                        stats: QueryStats) -> None:
+        """records a finished request and the queries it sent"""
+        key = (method, route)
+        with self._lock:
+            self.requests[method, route, status] = self.requests.get((method, route, status), 0) + 1
+            self.request_latency.setdefault(key, Histogram()).observe(seconds)
+            self.request_queries[key] = self.request_queries.get(key, 0) + stats.count
+            self.request_db_seconds[key] = self.request_db_seconds.get(key, 0.0) + stats.seconds
+
+
+    def observe_query(self, seconds: float) -> None:
+        """records the latency of one database query"""
+        with self._lock:
+            self.query_latency.observe(seconds)
+
+
+    def render(self) -> str:
+        """returns every metric in the Prometheus text exposition format"""
+        lines = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(method: str, route: str, **extra) -> str:
+            pairs = {"method": method, "route": route, **extra}
+            return ",".join(f'{key}="{escape(str(value))}"' for key, value in pairs.items())
+
+        def histogram_lines(name: str, values: Histogram, base_labels: str) -> None:
+            separator = "," if base_labels else ""
+            for bound, count in values.cumulative():
+                lines.append(f'{name}_bucket{{{base_labels}{separator}le="{bound}"}} {count}')
+            suffix = f"{{{base_labels}}}" if base_labels else ""
+            lines.append(f"{name}_sum{suffix} {values.sum}")
+            lines.append(f"{name}_count{suffix} {values.count}")
+
+        with self._lock:
+            header("http_requests_total", "counter", "HTTP requests by route and status.")
+            for (method, route, status), count in sorted(self.requests.items()):
+                request_labels = labels(method, route, status=status)
+                lines.append(f"http_requests_total{{{request_labels}}} {count}")
+
+            header("http_request_duration_seconds", "histogram", "HTTP request latency by route.")
+            for (method, route), latency in sorted(self.request_latency.items()):
+                histogram_lines("http_request_duration_seconds", latency, labels(method, route))
+
+            header("http_request_db_queries_total", "counter",
+                   "Database queries sent while handling the route.")
+            for (method, route), count in sorted(self.request_queries.items()):
+                lines.append(f"http_request_db_queries_total{{{labels(method, route)}}} {count}")
+
+            header("http_request_db_seconds_total", "counter",
+                   "Database time spent while handling the route.")
+            for (method, route), seconds in sorted(self.request_db_seconds.items()):
+                lines.append(f"http_request_db_seconds_total{{{labels(method, route)}}} {seconds}")
+
+            header("db_query_duration_seconds", "histogram",
+                   "Latency of every database query of the process.")
+            histogram_lines("db_query_duration_seconds", self.query_latency, "")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def instrument_engine(engine, registry: MetricsRegistry = metrics) -> None:
+    """times every statement of the engine and adds it to the request that sent it"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "metrics_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        registry.observe_query(seconds)
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records the count, latency and database time of every
+       request per route template, with debug_headers the response tells how many
+       queries it took up to the moment its headers were sent"""
+    def __init__(self, app, registry: MetricsRegistry = metrics, debug_headers: bool = False):
+        self.app = app
+        self.registry = registry
+        self.debug_headers = debug_headers
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.debug_headers:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("X-DB-Query-Count", str(stats.count))
+                    headers.append("X-DB-Time-Ms", f"{stats.seconds * 1000:.2f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_query_stats.reset(token)
+            # the route template keeps the label values bounded, unknown paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.registry.observe_request(scope["method"], route, status,
+                                          time.perf_counter() - started, stats)
@@ -1,14 +1,26 @@
+import base64
+import json
+from datetime import datetime
 from math import ceil
-from typing import Optional, List, TypeVar, Type
+from typing import Optional, List, TypeVar, Type, Sequence, Callable, Awaitable
 from pydantic import BaseModel
+from sqlalchemy import Select, func, select, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.pagination import PageParams
+from app.utils.exceptions import InvalidCursorException
 
 T = TypeVar('T')
 
 
 class Pagination:
-    """a class for paginating data based on page parameters"""
-    def __init__(self, page_params: PageParams, items: Optional[List[T]], schema: Type[BaseModel]):
+    """a class for paginating data based on page parameters. It slices an in-memory
+    list of items or, when a query is given, pushes LIMIT/OFFSET or a keyset
+    cursor down to SQL so a deep page costs the same as the first one"""
+    def __init__(self, page_params: PageParams, items: Optional[List[T]] = None,
+                 schema: Type[BaseModel] = None, query: Optional[Select] = None,
+                 session: Optional[AsyncSession] = None, keyset: Sequence = (),
+                 transform: Optional[Callable[[list], Awaitable[list]]] = None):
 
         self.page_params = page_params
         self.items = items
@@ -16,16 +28,95 @@ class Pagination:
         self.offset = self.page * page_params.size
         self.limit = page_params.size
         self.schema = schema
+        self.query = query
+        self.session = session
+        self.keyset = tuple(keyset)
+        self.transform = transform
 
 
     async def get_pagination(self):
         """get the paginated response based on the provided
         items and page parameters"""
+        if self.query is not None:
+            return await self.get_query_pagination()
         items = self.items[self.offset:self.offset + self.limit]
         if not items:
             return self.empty_response()
 
         total_items = len(self.items)
+        return self.build_response(items, total_items)
+
+
+    async def get_query_pagination(self):
+        """get the paginated response of the query, only the rows of the page are loaded"""
+        stmt = self.query
+        if self.keyset:
+            stmt = stmt.order_by(*self.keyset)
+        if self.page_params.cursor and self.keyset:
+            stmt = stmt.where(tuple_(*self.keyset) > tuple_(*self.decode_cursor()))
+        else:
+            stmt = stmt.offset(self.offset)
+        # one extra row tells whether there is a next page
+        result = await self.session.execute(stmt.limit(self.limit + 1))
+        rows = result.scalars().all() if len(stmt.column_descriptions) == 1 else result.all()
+        if not rows:
+            return self.empty_response()
+
+        next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            if self.keyset:
+                next_cursor = self.encode_cursor(rows[-1])
+        total_items = await self.count()
+        if self.transform is not None:
+            rows = await self.transform(list(rows))
+        return self.build_response(rows, total_items, next_cursor)
+
+
+    async def count(self) -> int:
+        """returns the exact number of rows of the query or the planner's estimate"""
+        query = self.query.order_by(None)
+        if self.page_params.count == "estimated":
+            return await self.estimated_count(query)
+        result = await self.session.execute(
+            select(func.count()).select_from(query.subquery()))
+        return result.scalar_one()
+
+
+    async def estimated_count(self, query: Select) -> int:
+        """returns the row estimate of the planner, it costs no table scan"""
+        compiled = query.compile(dialect=postgresql.dialect(),
+                                 compile_kwargs={"literal_binds": True})
+        result = await self.session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+    def encode_cursor(self, row) -> str:
+        """returns an opaque cursor that points after the given row"""
+        values = [getattr(row, column.key) for column in self.keyset]
+        values = [value.isoformat() if isinstance(value, datetime) else value
+                  for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+    def decode_cursor(self) -> list:
+        """returns the keyset values stored in the cursor of the page parameters"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(self.page_params.cursor.encode()))
+            if not isinstance(values, list) or len(values) != len(self.keyset):
+                raise ValueError("wrong number of keyset values")
+            return [datetime.fromisoformat(value)
+                    if column.type.python_type is datetime else value
+                    for column, value in zip(self.keyset, values)]
+        except (ValueError, TypeError) as e:
+            raise InvalidCursorException() from e
+
+
+    def build_response(self, items: list, total_items: int, next_cursor: Optional[str] = None):
+        """returns the page validated by the response schema"""
         total_pages = ceil(total_items / self.page_params.size)
         data = {
             "current_page": self.page_params.page,
@@ -33,6 +124,7 @@ class Pagination:
             "result": items,
             "total_items": total_items,
             "total_pages": total_pages,
+            "next_cursor": next_cursor
 
         }
         return self.schema.model_validate(data)
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+from passlib.context import CryptContext
+from app.core.config import settings
+from app.utils.exceptions import PasswordHasherBusyException
+
+
+class PasswordHasher:
+    """runs bcrypt on a bounded thread pool, bcrypt releases the GIL so the event loop
+    keeps serving other requests while a password is hashed. At most max_workers
+    hashes run at once and at most max_queue wait, further calls are rejected"""
+    def __init__(self, context: CryptContext, max_workers: int, max_queue: int):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_hash_seconds = 0.0
+
+
+    async def hash(self, password: str) -> str:
+        """returns the bcrypt hash of the password"""
+        return await self._run(self.context.hash, password)
+
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """returns True when the password matches the hash"""
+        return await self._run(self.context.verify, password, hashed_password)
+
+
+    async def verify_and_update(self, password: str,
+                                hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """verifies the password and returns a new hash when the stored one
+           was made with a different work factor than the configured one"""
+        valid, new_hash = await self._run(self.context.verify_and_update,
+                                          password, hashed_password)
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+
+    async def _run(self, func: Callable, *args):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherBusyException()
+            self.in_flight += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="password-hasher")
+        submitted = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed, func, submitted, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+    def _timed(self, func: Callable, submitted: float, *args):
+        started = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                wait = started - submitted
+                self.completed += 1
+                self.total_wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+                self.total_hash_seconds += finished - started
+
+
+    def shutdown(self) -> None:
+        """stops the worker threads, the pool is recreated on the next call"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def stats(self) -> dict:
+        """returns the queueing metrics used to size the pool"""
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.max_workers,
+                "in_flight": self.in_flight,
+                "queued": max(self.in_flight - self.max_workers, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_wait_seconds": round(self.total_wait_seconds / completed, 4),
+                "max_wait_seconds": round(self.max_wait_seconds, 4),
+                "avg_hash_seconds": round(self.total_hash_seconds / completed, 4)
+            }
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS)
+
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
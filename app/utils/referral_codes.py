@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from typing import Optional
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.database import async_session_maker
+from app.models.model import referral_code_seq
+
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+CODE_LENGTH = 8
+# 8 base32 characters hold 40 bits, split into two 20 bit halves for the Feistel network
+HALF_BITS = 20
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+def _round(value: int, round_number: int, key: bytes) -> int:
+    digest = hashlib.blake2b(value.to_bytes(3, "big") + bytes([round_number]),
+                             key=key, digest_size=3).digest()
+    return int.from_bytes(digest, "big") & HALF_MASK
+
+
+def permute(value: int, key: bytes) -> int:
+    """maps a sequence value to a 40 bit number, the mapping is a bijection,
+       so distinct values never give the same number, and consecutive values look random"""
+    if not 0 <= value < 1 << (2 * HALF_BITS):
+        raise ValueError("the referral code space is exhausted")
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_number in range(ROUNDS):
+        left, right = right, left ^ _round(right, round_number, key)
+    return (left << HALF_BITS) | right
+
+
+def encode(value: int) -> str:
+    """returns the 40 bit number as 8 Crockford base32 characters"""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, index = divmod(value, 32)
+        chars.append(CROCKFORD_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def referral_code(value: int, key: bytes) -> str:
+    """returns the referral code of a sequence value"""
+    return encode(permute(value, key))
+
+
+class ReferralCodePool:
+    """hands out referral codes made from referral_code_seq values. Values are reserved
+    in batches and refilled in the background, so registration normally needs no query
+    for its code. A reserved value that is never used only leaves a gap"""
+    def __init__(self, session_maker, key: bytes, size: int, refill_at: int):
+        self.session_maker = session_maker
+        self.key = key
+        self.size = size
+        self.refill_at = refill_at
+        self.logger = logging.getLogger(__name__)
+        self._values = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+
+
+    async def next_code(self, session: AsyncSession) -> str:
+        """returns an unused referral code, it falls back to one nextval on the
+           given session when the pool is empty"""
+        if self._values:
+            value = self._values.popleft()
+        else:
+            value = await session.scalar(select(referral_code_seq.next_value()))
+        if self.size and len(self._values) <= self.refill_at:
+            self._schedule_refill()
+        return referral_code(value, self.key)
+
+
+    def _schedule_refill(self) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self.refill(), name="referral-code-refill")
+
+
+    async def refill(self) -> int:
+        """reserves sequence values until the pool is full and returns how many were added"""
+        missing = self.size - len(self._values)
+        if missing <= 0:
+            return 0
+        try:
+            async with self.session_maker() as session:
+                result = await session.execute(
+                    select(referral_code_seq.next_value())
+                    .select_from(func.generate_series(1, missing)))
+                values = result.scalars().all()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # registration keeps working with one nextval per code
+            self.logger.warning("Referral code pool refill failed: %s", str(e))
+            return 0
+        self._values.extend(values)
+        return len(values)
+
+
+def create_referral_code_pool() -> ReferralCodePool:
+    """creates the pool configured in the settings"""
+    return ReferralCodePool(
+        async_session_maker,
+        key=hashlib.blake2b(settings.REFERRAL_CODE_KEY.encode(), digest_size=16).digest(),
+        size=settings.REFERRAL_CODE_POOL_SIZE,
+        refill_at=settings.REFERRAL_CODE_POOL_REFILL_AT
+    )
+
+
+referral_code_pool = create_referral_code_pool()
@@ -0,0 +1,210 @@
+import asyncio
+import decimal
+import logging
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, time as time_of_day, timedelta
+from typing import Callable, Optional
+from greenlet import getcurrent
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+# the execution option that keeps the statements of a connection out of the log
+SKIP_OPTION = "slow_query_log"
+# the statements EXPLAIN accepts, a plain EXPLAIN only plans them and runs nothing
+EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|MERGE|VALUES)\b", re.IGNORECASE)
+# EXPLAIN ANALYZE runs the statement again, so it is kept from writes, row locks and
+# functions whose call changes something even when the transaction is rolled back
+WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b|\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE)\b",
+                    re.IGNORECASE)
+VOLATILE = re.compile(r"\b(nextval|setval|pg_(try_)?advisory\w*|pg_notify|pg_sleep\w*|"
+                      r"pg_cancel_backend|pg_terminate_backend|dblink\w*)\s*\(", re.IGNORECASE)
+# values that tell about the plan but not about the people in the database
+SAFE_TYPES = (bool, int, float, decimal.Decimal, date, datetime, time_of_day, timedelta,
+              type(None))
+# the frames of these packages are passed over when looking for the caller
+SKIPPED_MODULES = ("app.db", "app.utils")
+
+
+def redact(value):
+    """returns the value with every string and unknown object replaced, lists keep their
+       shape so the length of an IN list stays visible"""
+    if isinstance(value, SAFE_TYPES):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    return "<redacted>"
+
+
+def redact_parameters(parameters, executemany: bool = False):
+    """returns the bound parameters of a statement safe for the log"""
+    if executemany:
+        return f"<{len(parameters)} parameter sets>"
+    return redact(parameters)
+
+
+def explainable(statement: str) -> bool:
+    """tells whether EXPLAIN can plan the statement"""
+    return bool(EXPLAINABLE.match(statement))
+
+
+def analyzable(statement: str) -> bool:
+    """tells whether running the statement once more to get its plan changes nothing"""
+    return (explainable(statement) and not WRITES.search(statement)
+            and not VOLATILE.search(statement))
+
+
+def explain_prefix(statement: str) -> str:
+    """returns EXPLAIN with the actual timings for the reads that are safe to run again
+       and the plain plan for everything else"""
+    return "EXPLAIN (ANALYZE, BUFFERS) " if analyzable(statement) else "EXPLAIN "
+
+
+def find_caller() -> str:
+    """returns the innermost function of the application that sent the statement,
+       the statements of the async engine run in a greenlet, the awaiting service
+       method is on the stack of its parent"""
+    frame, current = sys._getframe(), getcurrent()
+    while True:
+        while frame is not None:
+            module = frame.f_globals.get("__name__", "")
+            if module.startswith("app.") and not module.startswith(SKIPPED_MODULES):
+                return f"{module}.{frame.f_code.co_qualname}:{frame.f_lineno}"
+            frame = frame.f_back
+        current = current.parent
+        if current is None:
+            return "unknown"
+        frame = current.gr_frame
+
+
+class RateLimiter:
+    """allows at most limit events per period and counts the ones it refused"""
+    def __init__(self, limit: int, period: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit = limit
+        self.period = period
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._window_start = clock()
+        self._allowed = 0
+        self._suppressed = 0
+
+
+    def allow(self) -> bool:
+        """takes one event of the current window, False once the window is used up"""
+        with self._lock:
+            now = self.clock()
+            if now - self._window_start >= self.period:
+                self._window_start = now
+                self._allowed = 0
+            if self._allowed >= self.limit:
+                self._suppressed += 1
+                return False
+            self._allowed += 1
+            return True
+
+
+    def take_suppressed(self) -> int:
+        """returns how many events were refused since the last call"""
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, 0
+            return suppressed
+
+
+class SlowQueryLog:
+    """logs the statements slower than the threshold with their redacted parameters and
+       caller, a few per minute at most, and their plan, captured in the background on a
+       connection of its own. Plain reads get EXPLAIN (ANALYZE, BUFFERS), writes, locking
+       reads and calls of volatile functions only a plain EXPLAIN"""
+    def __init__(self, threshold_ms: float, per_minute: int = 10, explain: bool = True,
+                 explain_timeout_ms: int = 5000, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold_ms / 1000
+        self.limiter = RateLimiter(per_minute, clock=clock)
+        self.explain = explain
+        self.explain_timeout_ms = explain_timeout_ms
+        self.engine: Optional[AsyncEngine] = None
+        self.reported = 0
+        # one plan at a time, a slow database must not get a pile of EXPLAIN ANALYZE runs
+        self._explaining = False
+        self._tasks = set()
+
+
+    def install(self, engine) -> "SlowQueryLog":
+        """times every statement of the engine, the plans need an async engine"""
+        if isinstance(engine, AsyncEngine):
+            self.engine = engine
+        sync_engine = getattr(engine, "sync_engine", engine)
+        event.listen(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+        return self
+
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None and context.execution_options.get(SKIP_OPTION, True):
+            context.slow_query_started = time.perf_counter()
+
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "slow_query_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        if seconds >= self.threshold:
+            self.report(statement, parameters, executemany, seconds)
+
+
+    def report(self, statement: str, parameters, executemany: bool, seconds: float) -> None:
+        """logs a slow statement unless the rate limit is used up"""
+        if not self.limiter.allow():
+            return
+        self.reported += 1
+        number = self.reported
+        suppressed = self.limiter.take_suppressed()
+        logger.warning(
+            "Slow query #%d took %.1f ms in %s%s: %s parameters=%r", number, seconds * 1000,
+            find_caller(), f" ({suppressed} more were not logged)" if suppressed else "",
+            " ".join(statement.split()), redact_parameters(parameters, executemany))
+        if self.explain and not executemany and explainable(statement):
+            self.schedule_explain(number, statement, parameters)
+
+
+    def schedule_explain(self, number: int, statement: str, parameters) -> None:
+        """starts capturing the plan unless another one is being captured"""
+        if self.engine is None or self._explaining:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._explaining = True
+        task = loop.create_task(self.log_plan(number, statement, parameters))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+    async def log_plan(self, number: int, statement: str, parameters) -> None:
+        """runs the EXPLAIN of the statement in a transaction that is rolled back and logs it"""
+        try:
+            async with self.engine.connect() as conn:
+                conn = await conn.execution_options(**{SKIP_OPTION: False})
+                transaction = await conn.begin()
+                try:
+                    await conn.exec_driver_sql(
+                        f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                    result = await conn.exec_driver_sql(
+                        explain_prefix(statement) + statement, parameters or ())
+                    plan = "\n".join(row[0] for row in result)
+                finally:
+                    await transaction.rollback()
+            logger.warning("Plan of slow query #%d:\n%s", number, plan)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning("Could not explain slow query #%d: %s", number, str(e))
+        finally:
+            self._explaining = False
@@ -1,16 +1,36 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.exc import IntegrityError
+from pytz import timezone
 from app.models.model import Transaction
-from passlib.context import CryptContext
+from app.utils.password_hasher import password_hasher
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+async def get_hash_password(password: str):
+    return await password_hasher.hash(password)
 
 
-def get_hash_password(password: str):
-    return pwd_context.hash(password)
+async def verify_password(plain_password: str, hashed_password: str):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
+
+
+def format_transaction_date(transaction_date: datetime, local_tz: str = 'Europe/Kyiv') -> str:
+    """returns the transaction date in the local timezone without touching the ORM object"""
+    return transaction_date.astimezone(timezone(local_tz)).strftime('%d.%m.%Y, %H:%M')
+
+
+def get_constraint_name(error: IntegrityError) -> Optional[str]:
+    """returns the name of the constraint an IntegrityError was raised by, if the driver tells"""
+    orig = error.orig
+    for candidate in (orig, getattr(orig, "__cause__", None), getattr(orig, "diag", None)):
+        name = getattr(candidate, "constraint_name", None)
+        if name:
+            return name
+    return None
 
 
 async def replace_date_format(transactions):
@@ -0,0 +1,131 @@
+"""runs the benchmark suite against the database of the POSTGRES_* settings:
+
+    python -m benchmarks run --scale 10k --seed --output base.json
+    python -m benchmarks run --scale 10k --output head.json
+    python -m benchmarks compare base.json head.json
+
+--seed drops every table of that database, point the settings at a scratch database
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import re
+import subprocess
+import sys
+from datetime import datetime, timezone
+from httpx import ASGITransport, AsyncClient
+from app.core.config import settings
+from app.db.database import async_session_maker, engine
+from app.main import app
+from benchmarks.cases import service_cases, route_cases
+from benchmarks.runner import measure, compare
+from benchmarks.seed import SCALES, Dataset, seed, describe
+
+
+logger = logging.getLogger("benchmarks")
+
+
+def git_commit() -> str | None:
+    """returns the commit of the working tree or None outside of a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """seeds the database when asked, measures every selected case and returns the report"""
+    if args.seed:
+        users = SCALES[args.scale]
+        dataset = Dataset(users=users, transactions=users * args.transactions_per_user,
+                          chain_length=args.chain_length)
+        await seed(engine, dataset, async_session_maker)
+    else:
+        dataset = await describe(engine, args.chain_length)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client:
+        cases = []
+        if args.kind in ("all", "service"):
+            cases += service_cases(dataset, async_session_maker)
+        if args.kind in ("all", "route"):
+            cases += route_cases(dataset, client)
+        if args.only:
+            cases = [case for case in cases if re.search(args.only, case.name)]
+        if args.read_only:
+            cases = [case for case in cases if not case.writes]
+        # the reads are measured before the writes change the data
+        cases.sort(key=lambda case: case.writes)
+
+        results = []
+        for case in cases:
+            logger.info("Measuring %s", case.name)
+            iterations = min(case.iterations or args.iterations, args.iterations)
+            results.append(await measure(case, iterations, args.concurrency, args.random_seed))
+    await engine.dispose()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "scale": args.scale if args.seed else None,
+            "dataset": dataset.as_dict(),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "random_seed": args.random_seed,
+            "db_pool_size": settings.DB_POOL_SIZE,
+            "db_max_overflow": settings.DB_MAX_OVERFLOW,
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    """runs the benchmarks or compares two reports"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="measure the service methods and routes")
+    run_parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    run_parser.add_argument("--seed", action="store_true",
+                            help="drop the tables and seed the database at --scale first")
+    run_parser.add_argument("--transactions-per-user", type=int, default=10)
+    run_parser.add_argument("--chain-length", type=int, default=20,
+                            help="users per referral chain, the depth of the referral tree")
+    run_parser.add_argument("--iterations", type=int, default=200)
+    run_parser.add_argument("--concurrency", type=int, default=4)
+    run_parser.add_argument("--random-seed", type=int, default=1)
+    run_parser.add_argument("--kind", choices=("all", "service", "route"), default="all")
+    run_parser.add_argument("--only", help="regular expression the case names have to match")
+    run_parser.add_argument("--read-only", action="store_true", help="skip the cases that write")
+    run_parser.add_argument("--output", help="JSON file of the report, stdout by default")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--metric", choices=("p50", "p95", "p99", "mean"), default="p95")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == "compare":
+        with open(args.base, encoding="utf-8") as base, open(args.head, encoding="utf-8") as head:
+            rows = compare(json.load(base), json.load(head), args.metric)
+        for row in rows:
+            change = "n/a" if row["change"] is None else f"{row['change']:+.1f}%"
+            print(f"{row['name']:<70} {row['base']:>10.3f} {row['head']:>10.3f} {change:>9}")
+        return
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
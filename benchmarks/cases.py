@@ -0,0 +1,175 @@
+import itertools
+import random
+from datetime import datetime
+from typing import List
+from httpx import AsyncClient
+from app.schemas.pagination import PageParams
+from app.schemas.schema import TransactionCreate, RegisterUserSchema
+from app.services.transaction_service import TransactionService
+from app.services.user_service import UserService
+from benchmarks.runner import Case
+from benchmarks.seed import Dataset, PASSWORD
+
+
+START_DATE = "01-01-2000"
+BULK_SIZE = 100
+# bcrypt costs a few hundred milliseconds per call
+PASSWORD_ITERATIONS = 20
+
+
+def service_cases(dataset: Dataset, session_maker) -> List[Case]:
+    """returns a case per TransactionService and UserService method,
+       every call gets a session of its own like a request does"""
+    end_date = datetime.now().strftime("%d-%m-%Y")
+    registrations = itertools.count()
+
+    def user_id(rng: random.Random) -> int:
+        return rng.randint(1, dataset.users)
+
+    def transaction_case(name: str, call, writes: bool = False, iterations: int = None) -> Case:
+        async def run(rng):
+            async with session_maker() as session:
+                return await call(TransactionService(session), rng)
+        return Case(f"TransactionService.{name}", "service", run, writes, iterations)
+
+    def user_case(name: str, call, writes: bool = False, iterations: int = None) -> Case:
+        async def run(rng):
+            async with session_maker() as session:
+                return await call(UserService(session), rng)
+        return Case(f"UserService.{name}", "service", run, writes, iterations)
+
+    async def consume(rows) -> int:
+        return len([row async for row in rows])
+
+    def transaction(rng: random.Random) -> TransactionCreate:
+        return TransactionCreate(user_id=user_id(rng), transaction_type="purchase",
+                                 amount=rng.randint(10, 10_000))
+
+    async def delete_referral(service: UserService, rng: random.Random):
+        # the link of a user to the previous user of its chain
+        referred_id = max(user_id(rng), 2)
+        return await service.delete_referral(referrer_id=referred_id - 1, referred_id=referred_id)
+
+    def registration(rng: random.Random) -> RegisterUserSchema:
+        number = f"{rng.randrange(10 ** 9)}-{next(registrations)}"
+        return RegisterUserSchema(username=f"bench-{number}", email=f"bench-{number}@bench.local",
+                                  password=PASSWORD, password_check=PASSWORD)
+
+    return [
+        transaction_case("filter_bonus_transactions_by_date", lambda service, rng:
+            service.filter_bonus_transactions_by_date(user_id(rng), START_DATE, end_date)),
+        transaction_case("filter_payout_transaction_by_date", lambda service, rng:
+            service.filter_payout_transaction_by_date(user_id(rng), START_DATE, end_date)),
+        transaction_case("stream_bonus_transactions_by_date", lambda service, rng: consume(
+            service.stream_bonus_transactions_by_date(user_id(rng), None, None))),
+        transaction_case("stream_payout_transactions_by_date", lambda service, rng: consume(
+            service.stream_payout_transactions_by_date(user_id(rng), None, None))),
+        transaction_case("get_user_balance", lambda service, rng:
+            service.get_user_balance(user_id(rng))),
+        transaction_case("get_wallet", lambda service, rng: service.get_wallet(user_id(rng))),
+        transaction_case("get_bonus_summary", lambda service, rng:
+            service.get_bonus_summary(user_id(rng), None, None, "month")),
+        transaction_case("get_payout_summary", lambda service, rng:
+            service.get_payout_summary(user_id(rng), None, None, "month")),
+        user_case("get_user", lambda service, rng: service.get_user(user_id(rng), PageParams())),
+        user_case("get_all_users", lambda service, rng: service.get_all_users(
+            PageParams(page=rng.randint(1, 20), size=20), transactions_limit=5)),
+        user_case("get_my_referrals", lambda service, rng: service.get_my_referrals(user_id(rng))),
+        user_case("get_non_referrals", lambda service, rng:
+            service.get_non_referrals(user_id(rng))),
+        user_case("get_user_profile", lambda service, rng: service.get_user_profile(user_id(rng))),
+        user_case("is_user_exists", lambda service, rng:
+            service.is_user_exists("email", dataset.email(user_id(rng)))),
+        transaction_case("create_transaction", lambda service, rng:
+            service.create_transaction(transaction(rng)), writes=True),
+        transaction_case("create_transactions_bulk", lambda service, rng:
+            service.create_transactions_bulk([transaction(rng) for _ in range(BULK_SIZE)]),
+            writes=True),
+        transaction_case("request_payout", lambda service, rng:
+            service.request_payout(user_id(rng), 1.0), writes=True),
+        transaction_case("process_pending_bonuses", lambda service, rng:
+            service.process_pending_bonuses([rng.randint(1, dataset.transactions)]),
+            writes=True),
+        user_case("generate_unique_referral_code", lambda service, rng:
+            service.generate_unique_referral_code(), writes=True),
+        user_case("add_user", lambda service, rng: service.add_user(registration(rng)),
+                  writes=True, iterations=PASSWORD_ITERATIONS),
+        user_case("create_referral_by_code", lambda service, rng: service.create_referral_by_code(
+            dataset.referral_code(user_id(rng)), dataset.chain_head(user_id(rng))), writes=True),
+        user_case("delete_referral", delete_referral, writes=True),
+    ]
+
+
+def route_cases(dataset: Dataset, client: AsyncClient) -> List[Case]:
+    """returns a case per route, called through the ASGI transport of httpx"""
+    end_date = datetime.now().strftime("%d-%m-%Y")
+    registrations = itertools.count()
+
+    def user_id(rng: random.Random) -> int:
+        return rng.randint(1, dataset.users)
+
+    def route(name: str, method: str, url, writes: bool = False, iterations: int = None,
+              json=None) -> Case:
+        async def run(rng):
+            response = await client.request(method, url(rng),
+                                            json=json(rng) if json else None)
+            return response.status_code
+        return Case(f"{method} {name}", "route", run, writes, iterations)
+
+    def transaction(rng: random.Random) -> dict:
+        return {"user_id": user_id(rng), "transaction_type": "purchase",
+                "amount": rng.randint(10, 10_000)}
+
+    def registration(rng: random.Random) -> dict:
+        number = f"{rng.randrange(10 ** 9)}-{next(registrations)}"
+        return {"username": f"route-{number}", "email": f"route-{number}@bench.local",
+                "password": PASSWORD, "password_check": PASSWORD}
+
+    return [
+        route("/filter/bonus/{user_id}/{start_date}/{end_date}/", "GET",
+              lambda rng: f"/filter/bonus/{user_id(rng)}/{START_DATE}/{end_date}/"),
+        route("/filter/payout/{user_id}/{start_date}/{end_date}/", "GET",
+              lambda rng: f"/filter/payout/{user_id(rng)}/{START_DATE}/{end_date}/"),
+        route("/filter/bonus/{user_id}/{start_date}/{end_date}/export/", "GET",
+              lambda rng: f"/filter/bonus/{user_id(rng)}/{START_DATE}/{end_date}/export/"),
+        route("/filter/payout/{user_id}/{start_date}/{end_date}/export/", "GET",
+              lambda rng: f"/filter/payout/{user_id(rng)}/{START_DATE}/{end_date}/export/"),
+        route("/summary/bonus/{user_id}/", "GET",
+              lambda rng: f"/summary/bonus/{user_id(rng)}/?group_by=month"),
+        route("/summary/payout/{user_id}/", "GET",
+              lambda rng: f"/summary/payout/{user_id(rng)}/?group_by=month"),
+        route("/get/balance/{user_id}/", "POST", lambda rng: f"/get/balance/{user_id(rng)}/"),
+        route("/get/user/{user_id}/", "GET", lambda rng: f"/get/user/{user_id(rng)}/"),
+        route("/get/all/users/", "GET",
+              lambda rng: f"/get/all/users/?page={rng.randint(1, 20)}&size=20"
+                          "&transactions_limit=5"),
+        route("/get/all/referrals/{user_id}/", "GET",
+              lambda rng: f"/get/all/referrals/{user_id(rng)}/"),
+        route("/get/all/not/refferals/{user_id}/", "GET",
+              lambda rng: f"/get/all/not/refferals/{user_id(rng)}/"),
+        route("/get/user/profile/{user_id}/", "GET",
+              lambda rng: f"/get/user/profile/{user_id(rng)}/"),
+        route("/create/transaction/", "POST", lambda rng: "/create/transaction/",
+              writes=True, json=transaction),
+        route("/create/transactions/bulk/", "POST", lambda rng: "/create/transactions/bulk/",
+              writes=True,
+              json=lambda rng: {"transactions": [transaction(rng) for _ in range(BULK_SIZE)]}),
+        route("/request/{user_id}/{payout}/", "POST",
+              lambda rng: f"/request/{user_id(rng)}/1.0/", writes=True),
+        route("/login/", "POST", lambda rng: "/login/", writes=True,
+              iterations=PASSWORD_ITERATIONS,
+              json=lambda rng: {"email": dataset.email(user_id(rng)), "password": PASSWORD}),
+        route("/register/user/", "POST", lambda rng: "/register/user/", writes=True,
+              iterations=PASSWORD_ITERATIONS, json=registration),
+        route("/create/referral/by/{code}/{refferal_id}/", "POST",
+              lambda rng: f"/create/referral/by/{dataset.referral_code(user_id(rng))}/0/"
+                          f"?referral_id={dataset.chain_head(user_id(rng))}", writes=True),
+        route("/referrals/{referred_id}/current_user_id/", "DELETE",
+              lambda rng: referral_url(dataset, user_id(rng)), writes=True),
+    ]
+
+
+def referral_url(dataset: Dataset, referred_id: int) -> str:
+    """returns the url that deletes the link of a user to the previous user of its chain"""
+    referred_id = max(referred_id, 2)
+    return f"/referrals/{referred_id}/current_user_id/?current_user_id={referred_id - 1}"
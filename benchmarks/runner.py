@@ -0,0 +1,106 @@
+import asyncio
+import math
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+
+@dataclass
+class Case:
+    """one measured operation, call gets a random generator and returns
+       an HTTP status code for routes or anything for service methods"""
+    name: str
+    kind: str
+    call: Callable[[random.Random], Awaitable]
+    # cases that write run after the read-only ones, so they do not skew them
+    writes: bool = False
+    # bcrypt bound cases run fewer iterations
+    iterations: Optional[int] = None
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """returns the nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(case: Case, latencies: List[float], elapsed: float,
+              errors: Counter, statuses: Counter) -> dict:
+    """returns the JSON result of a case, latencies are in seconds"""
+    latencies = sorted(latencies)
+    milliseconds = [latency * 1000 for latency in latencies]
+    result = {
+        "name": case.name,
+        "kind": case.kind,
+        "iterations": len(latencies) + sum(errors.values()),
+        "errors": dict(errors),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(milliseconds, 50), 3),
+            "p95": round(percentile(milliseconds, 95), 3),
+            "p99": round(percentile(milliseconds, 99), 3),
+            "mean": round(sum(milliseconds) / len(milliseconds), 3) if milliseconds else 0.0,
+            "min": round(milliseconds[0], 3) if milliseconds else 0.0,
+            "max": round(milliseconds[-1], 3) if milliseconds else 0.0,
+        },
+    }
+    if statuses:
+        result["statuses"] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+
+async def measure(case: Case, iterations: int, concurrency: int, seed: int,
+                  warmup: int = 5) -> dict:
+    """runs the case iterations times from concurrency workers and returns its result,
+       every worker has its own random generator, so a run picks the same ids again"""
+    for index in range(warmup):
+        try:
+            await case.call(random.Random(f"{seed}:warmup:{index}"))
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    latencies, errors, statuses = [], Counter(), Counter()
+    remaining = iter(range(iterations))
+
+    async def worker(number: int) -> None:
+        rng = random.Random(f"{seed}:{case.name}:{number}")
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                outcome = await case.call(rng)
+            except Exception as e:  # pylint: disable=broad-except
+                errors[type(e).__name__] += 1
+                continue
+            latency = time.perf_counter() - started
+            if case.kind == "route":
+                statuses[outcome] += 1
+                if outcome >= 500:
+                    errors[f"HTTP {outcome}"] += 1
+                    continue
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    return summarize(case, latencies, time.perf_counter() - started, errors, statuses)
+
+
+def compare(base: dict, head: dict, metric: str = "p95") -> List[dict]:
+    """returns the change of a latency metric per case between two result files"""
+    base_results = {result["name"]: result for result in base["results"]}
+    rows = []
+    for result in head["results"]:
+        previous = base_results.get(result["name"])
+        if previous is None:
+            continue
+        before, after = previous["latency_ms"][metric], result["latency_ms"][metric]
+        rows.append({
+            "name": result["name"],
+            "base": before,
+            "head": after,
+            "change": round((after - before) / before * 100, 1) if before else None,
+        })
+    return rows
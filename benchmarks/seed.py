@@ -0,0 +1,101 @@
+import logging
+from dataclasses import dataclass, asdict
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.db.partitions import ensure_partitions, add_months, current_month
+from app.models.model import Base
+from app.services.referral_tree import ReferralTree
+from app.services.transaction_service import TransactionService
+from app.utils.utils import get_hash_password
+
+
+logger = logging.getLogger(__name__)
+
+# number of users of a scale, the transactions are a multiple of it
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+PASSWORD = "benchmark"
+HISTORY_DAYS = 365
+
+
+@dataclass
+class Dataset:
+    """describes the seeded data, the benchmark cases pick their ids from it"""
+    users: int
+    transactions: int
+    chain_length: int
+
+
+    def email(self, user_id: int) -> str:
+        """returns the email of a seeded user"""
+        return f"user{user_id}@bench.local"
+
+
+    def referral_code(self, user_id: int) -> str:
+        """returns the referral code of a seeded user"""
+        return f"BENCH{user_id}"
+
+
+    def chain_head(self, user_id: int) -> int:
+        """returns the first user of the referral chain of the user, it has no referrer"""
+        return user_id - (user_id - 1) % self.chain_length
+
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+async def seed(engine: AsyncEngine, dataset: Dataset, session_maker) -> None:
+    """drops every table of the database and fills it with the dataset.
+    Users form referral chains of chain_length users, each one referred by
+    the previous user, and the transactions spread over the last year"""
+    hashed_password = await get_hash_password(PASSWORD)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        history_months = HISTORY_DAYS // 30 + 1
+        await ensure_partitions(conn, history_months + 3,
+                                today=add_months(current_month(), -history_months))
+        logger.info("Seeding %d users", dataset.users)
+        await conn.execute(text(
+            "INSERT INTO users (id, username, email, hashed_password, referral_code, "
+            "is_active, is_superuser, created_at) "
+            "SELECT i, 'user' || i, 'user' || i || '@bench.local', :password, 'BENCH' || i, "
+            "true, false, now() FROM generate_series(1, :users) AS i"
+        ), {"password": hashed_password, "users": dataset.users})
+        await conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('users', 'id'), :users)"
+        ), {"users": dataset.users})
+        await conn.execute(text(
+            "INSERT INTO wallet (user_id, balance, first_line, second_line, purchases) "
+            "SELECT i, 1000, 0, 0, 0 FROM generate_series(1, :users) AS i"
+        ), {"users": dataset.users})
+        await conn.execute(text(
+            "INSERT INTO referrals (referrer_id, referred_id) "
+            "SELECT i - 1, i FROM generate_series(2, :users) AS i WHERE (i - 1) % :chain != 0"
+        ), {"users": dataset.users, "chain": dataset.chain_length})
+        logger.info("Seeding %d transactions", dataset.transactions)
+        await conn.execute(text(
+            "INSERT INTO transactions (user_id, transaction_type, amount, "
+            "transaction_date, bonus_pending) "
+            "SELECT 1 + n % :users, "
+            "CASE WHEN n % 10 = 0 THEN 'request_payout' ELSE 'purchase' END, "
+            "10 + n % 90, "
+            "now() - (n % :days) * interval '1 day' - (n % 86400) * interval '1 second', "
+            "false FROM generate_series(1, :transactions) AS n"
+        ), {"users": dataset.users, "days": HISTORY_DAYS, "transactions": dataset.transactions})
+
+    logger.info("Building the referral closure table and the rollups")
+    async with session_maker() as session:
+        await ReferralTree(session).rebuild()
+    async with session_maker() as session:
+        await TransactionService(session).rebuild_rollups()
+    async with engine.connect() as conn:
+        await conn.execute(text("ANALYZE"))
+
+
+async def describe(engine: AsyncEngine, chain_length: int) -> Dataset:
+    """returns the dataset of an already seeded database"""
+    async with engine.connect() as conn:
+        users = (await conn.execute(text("SELECT count(*) FROM users"))).scalar()
+        transactions = (await conn.execute(text("SELECT count(*) FROM transactions"))).scalar()
+    return Dataset(users=users, transactions=transactions, chain_length=chain_length)
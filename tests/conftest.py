@@ -1,6 +1,23 @@
+import os
+
+# the settings require these variables, the tests never connect to the database
+for name, value in {
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_DB": "easylife_test",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "ALGORITHM": "HS256",
+    "JWT_SECRET_KEY": "test-secret-key-for-the-test-suite-only",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "TOKEN_KEY": "access_token",
+}.items():
+    os.environ.setdefault(name, value)
+
 import pytest
 from unittest.mock import AsyncMock
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.referral_tree import ancestor_cache
 from app.services.transaction_service import TransactionService
 from app.services.user_service import UserService
 
@@ -10,7 +27,9 @@ https://pytest-with-eric.com/pytest-advanced/pytest-asyncio/
 """
 @pytest.fixture(scope="function")
 def mock_session():
-    return AsyncMock(spec=AsyncSession)
+    session = AsyncMock(spec=AsyncSession)
+    session.info = {}
+    return session
 
 
 @pytest.fixture(scope="function")
@@ -20,4 +39,8 @@ def user_service(mock_session):
 
 @pytest.fixture(scope="function")
 def transaction_service(mock_session):
-    return TransactionService(mock_session)
\ No newline at end of file
+    return TransactionService(mock_session)
+
+@pytest.fixture(autouse=True)
+def clear_ancestor_cache():
+    ancestor_cache.invalidate()
@@ -0,0 +1,103 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+from sqlalchemy import event
+
+"""
+records the statements a service call sends to the database and fails the test
+when it sends more than its budget or the same statement shape again and again,
+the usual sign of a query inside a loop:
+
+    with query_budget(engine, max_queries=3, max_repeats=1):
+        await TransactionService(session).process_pending_bonuses(ids)
+"""
+
+# savepoints are transaction control, not queries of the service
+IGNORED = re.compile(r"^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b", re.IGNORECASE)
+PLACEHOLDER = re.compile(r"\$\d+(::\w+(\[\])?)?|%\(\w+\)s|%s|(?<![:\w]):\w+|\?")
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"(?<![\w.])-?\d+(\.\d+)?\b")
+GROUP = re.compile(r"\(\s*\?(\s*,\s*\?)*\s*\)")
+GROUPS = re.compile(r"\(\.\.\.\)(\s*,\s*\(\.\.\.\))+")
+
+
+def statement_shape(statement: str) -> str:
+    """returns the statement without its values, the same query with other parameters,
+       other literals or a longer IN or VALUES list has the same shape"""
+    shape = STRING.sub("?", statement)
+    shape = PLACEHOLDER.sub("?", shape)
+    shape = NUMBER.sub("?", shape)
+    shape = GROUP.sub("(...)", shape)
+    shape = GROUPS.sub("(...)", shape)
+    return " ".join(shape.split())
+
+
+class QueryRecorder:
+    """collects every statement the engine sends while the recorder is active,
+       an executemany counts as one statement"""
+    def __init__(self, engine):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.statements: List[str] = []
+
+
+    def __enter__(self) -> "QueryRecorder":
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not IGNORED.match(statement):
+            self.statements.append(statement)
+
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+    def shapes(self) -> Counter:
+        """returns how many times each statement shape was sent"""
+        return Counter(statement_shape(statement) for statement in self.statements)
+
+
+    def violations(self, max_queries: Optional[int] = None,
+                   max_repeats: Optional[int] = None) -> List[str]:
+        """returns a description of every exceeded limit, None turns a limit off"""
+        problems = []
+        if max_queries is not None and self.count > max_queries:
+            problems.append(f"{self.count} queries, the budget is {max_queries}")
+        if max_repeats is not None:
+            for shape, count in self.shapes().most_common():
+                if count <= max_repeats:
+                    break
+                problems.append(f"{count} times, at most {max_repeats} allowed: {shape}")
+        return problems
+
+
+    def report(self) -> str:
+        """returns the numbered statements that were sent"""
+        return "\n".join(f"{number:>3}. {' '.join(statement.split())}"
+                         for number, statement in enumerate(self.statements, 1))
+
+
+    def assert_budget(self, max_queries: Optional[int] = None,
+                      max_repeats: Optional[int] = None) -> None:
+        """fails with the exceeded limits and the statements that were sent"""
+        problems = self.violations(max_queries, max_repeats)
+        if problems:
+            raise AssertionError("query budget exceeded:\n" + "\n".join(problems)
+                                 + "\nstatements:\n" + self.report())
+
+
+@contextmanager
+def query_budget(engine, max_queries: Optional[int] = None, max_repeats: Optional[int] = 1):
+    """records the statements sent inside the block and checks them against the budget
+       when it ends, by default every statement shape may be sent once"""
+    with QueryRecorder(engine) as recorder:
+        yield recorder
+    recorder.assert_budget(max_queries, max_repeats)
@@ -0,0 +1,39 @@
+from decimal import Decimal
+from app.schemas.schema import WalletResponse
+from app.utils.balance_cache import BalanceCache
+
+
+def wallet(user_id, balance):
+    return WalletResponse(user_id=user_id, balance=Decimal(balance),
+                          first_line=Decimal(0), second_line=Decimal(0), purchases=0)
+
+
+def test_fill_is_skipped_after_a_concurrent_write():
+    cache = BalanceCache(max_size=10, ttl=60)
+    read_version = cache.begin_read()
+    cache.put([wallet(1, "15.00")])
+
+    cache.fill(wallet(1, "5.00"), read_version)
+
+    assert cache.get(1).balance == Decimal("15.00")
+
+
+def test_fill_of_other_wallet_survives_unrelated_writes():
+    cache = BalanceCache(max_size=10, ttl=60)
+    read_version = cache.begin_read()
+    cache.invalidate([2])
+
+    cache.fill(wallet(1, "5.00"), read_version)
+
+    assert cache.get(1).balance == Decimal("5.00")
+    assert cache.stats()["hits"] == 1
+
+
+def test_fill_is_skipped_when_the_write_log_overflowed():
+    cache = BalanceCache(max_size=1, ttl=60)
+    read_version = cache.begin_read()
+    cache.invalidate([1, 2])
+
+    cache.fill(wallet(1, "5.00"), read_version)
+
+    assert cache.get(1) is None
@@ -0,0 +1,72 @@
+import pytest
+from collections import Counter
+from benchmarks.runner import Case, percentile, summarize, measure, compare
+from benchmarks.seed import Dataset
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summarize_reports_milliseconds_and_errors():
+    case = Case("UserService.get_user", "service", None)
+
+    result = summarize(case, [0.002, 0.001, 0.003], 0.5, Counter({"TimeoutError": 1}), Counter())
+
+    assert result["iterations"] == 4
+    assert result["throughput"] == 6.0
+    assert result["latency_ms"]["p50"] == 2.0
+    assert result["latency_ms"]["max"] == 3.0
+    assert result["errors"] == {"TimeoutError": 1}
+
+
+@pytest.mark.asyncio
+async def test_measure_counts_server_errors_of_routes():
+    statuses = iter([200, 500, 404] * 10)
+
+    async def call(rng):
+        return next(statuses)
+
+    result = await measure(Case("GET /", "route", call), iterations=6, concurrency=2,
+                           seed=1, warmup=0)
+
+    assert result["iterations"] == 6
+    assert result["errors"] == {"HTTP 500": 2}
+    assert result["statuses"] == {"200": 2, "404": 2, "500": 2}
+
+
+@pytest.mark.asyncio
+async def test_measure_picks_the_same_ids_in_every_run():
+    async def run_once():
+        picked = []
+
+        async def call(rng):
+            picked.append(rng.randint(1, 10 ** 6))
+
+        await measure(Case("case", "service", call), iterations=5, concurrency=1,
+                      seed=7, warmup=0)
+        return picked
+
+    assert await run_once() == await run_once()
+
+
+def test_compare_reports_the_change_per_case():
+    base = {"results": [{"name": "a", "latency_ms": {"p95": 10.0}},
+                        {"name": "b", "latency_ms": {"p95": 5.0}}]}
+    head = {"results": [{"name": "a", "latency_ms": {"p95": 12.5}},
+                        {"name": "c", "latency_ms": {"p95": 1.0}}]}
+
+    assert compare(base, head) == [{"name": "a", "base": 10.0, "head": 12.5, "change": 25.0}]
+
+
+def test_dataset_chain_head_is_the_first_user_of_the_chain():
+    dataset = Dataset(users=100, transactions=1000, chain_length=20)
+
+    assert dataset.chain_head(1) == 1
+    assert dataset.chain_head(20) == 1
+    assert dataset.chain_head(21) == 21
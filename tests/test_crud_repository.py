@@ -0,0 +1,108 @@
+import pytest
+from unittest.mock import MagicMock
+from sqlalchemy.dialects import postgresql
+from app.models.model import Transaction, User, Wallet
+from app.utils.crud_repository import CrudRepository, unit_of_work, after_commit, queries_saved
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_flushes_writes_and_commits_once(mock_session):
+    repository = CrudRepository(mock_session, User)
+    committed = []
+
+    async with unit_of_work(mock_session):
+        await repository.create_one({"username": "first", "referral_code": "A"})
+        async with unit_of_work(mock_session):
+            await repository.delete_one(1)
+        after_commit(mock_session, lambda: committed.append(True))
+        assert committed == []
+
+    assert mock_session.flush.await_count == 2
+    mock_session.commit.assert_awaited_once()
+    assert committed == [True]
+    assert mock_session.info == {}
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_rolls_back_on_error(mock_session):
+    committed = []
+
+    with pytest.raises(ValueError):
+        async with unit_of_work(mock_session):
+            after_commit(mock_session, lambda: committed.append(True))
+            raise ValueError("failed")
+
+    mock_session.commit.assert_not_called()
+    mock_session.rollback.assert_awaited_once()
+    assert committed == []
+
+
+@pytest.mark.asyncio
+async def test_create_many_is_one_insert(mock_session):
+    records = MagicMock()
+    records.all.return_value = ["first", "second"]
+    mock_session.scalars.return_value = records
+    rows = [{"user_id": 1, "transaction_type": "credit", "amount": 10},
+            {"user_id": 2, "transaction_type": "credit", "amount": 20}]
+
+    created = await CrudRepository(mock_session, Transaction).create_many(rows)
+
+    assert created == ["first", "second"]
+    mock_session.scalars.assert_awaited_once()
+    assert mock_session.scalars.await_args.args[1] == rows
+    mock_session.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_upsert_many_updates_the_conflicting_rows(mock_session):
+    mock_session.scalars.return_value = MagicMock()
+    rows = [{"user_id": 1, "balance": 10}]
+
+    await CrudRepository(mock_session, Wallet).upsert_many(rows, ["user_id"])
+
+    statement = mock_session.scalars.await_args.args[0]
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (user_id) DO UPDATE SET balance = excluded.balance" in sql
+
+
+@pytest.mark.asyncio
+async def test_get_many_by_ids_is_one_in_query(mock_session):
+    users = [User(id=1), User(id=2)]
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = users
+    mock_session.execute.return_value = result
+
+    found = await CrudRepository(mock_session, User).get_many_by_ids([1, 2, 2, 3])
+
+    mock_session.execute.assert_awaited_once()
+    assert found == {1: users[0], 2: users[1]}
+
+
+@pytest.mark.asyncio
+async def test_get_one_by_runs_a_repeated_lookup_once(mock_session):
+    user = User(id=7, email="user@example.com")
+    result = MagicMock()
+    result.scalars.return_value.first.return_value = user
+    mock_session.execute.return_value = result
+    repository = CrudRepository(mock_session, User)
+
+    assert await repository.get_one_by(email="user@example.com") is user
+    assert await repository.get_one_by(email="user@example.com") is user
+    assert await repository.get_one_by(id=7) is user
+
+    mock_session.execute.assert_awaited_once()
+    assert queries_saved(mock_session) == 2
+
+
+@pytest.mark.asyncio
+async def test_repository_writes_invalidate_the_lookups_of_the_model(mock_session):
+    result = MagicMock()
+    result.scalars.return_value.first.return_value = None
+    mock_session.execute.return_value = result
+    users = CrudRepository(mock_session, User)
+
+    assert await users.get_one_by(username="new") is None
+    await users.create_one({"username": "new", "referral_code": "A"})
+    await users.get_one_by(username="new")
+
+    assert mock_session.execute.await_count == 2
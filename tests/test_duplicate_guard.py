@@ -0,0 +1,70 @@
+import pytest
+from app.utils.cache import TTLCache
+from app.utils.duplicate_guard import DuplicateGuard, InMemoryDuplicateGuard, DatabaseDuplicateGuard
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    timer = FakeTimer()
+    cache = TTLCache(max_size=2, ttl=60, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.evictions == 1
+    assert cache.evicted_until == 60
+    timer.now = 61
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_in_memory_guard_asks_database_until_warm():
+    timer = FakeTimer()
+    guard = InMemoryDuplicateGuard(max_size=10, ttl=60, timer=timer)
+    key = (1, "credit", 100.0)
+
+    assert await guard.check(None, key) is None
+    assert await guard.check(None, key) is True
+
+    timer.now = 120
+    assert await guard.check(None, (2, "credit", 100.0)) is False
+    assert await guard.check(None, (2, "credit", 100.0)) is True
+
+
+@pytest.mark.asyncio
+async def test_in_memory_guard_forgets_failed_transactions():
+    timer = FakeTimer()
+    timer.now = 120
+    guard = InMemoryDuplicateGuard(max_size=10, ttl=60, timer=timer)
+    guard.started_at = 0
+    key = (1, "credit", 100.0)
+
+    assert await guard.check(None, key) is False
+    guard.forget(key)
+    assert await guard.check(None, key) is False
+
+
+@pytest.mark.asyncio
+async def test_database_guard_takes_advisory_lock(mock_session):
+    guard = DatabaseDuplicateGuard()
+    key = (1, "credit", 100.0)
+
+    assert await guard.check(mock_session, key) is None
+    mock_session.execute.assert_awaited_once()
+    assert "pg_advisory_xact_lock" in str(mock_session.execute.await_args.args[0])
+    assert guard.lock_id(key) == DatabaseDuplicateGuard.lock_id((1, "credit", 100.0))
+
+
+def test_duplicate_guard_needs_a_check():
+    with pytest.raises(TypeError):
+        DuplicateGuard()  # pylint: disable=abstract-class-instantiated
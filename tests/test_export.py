@@ -0,0 +1,31 @@
+import json
+import pytest
+from app.utils.export import to_ndjson, to_csv
+
+
+async def rows(count):
+    for i in range(count):
+        yield {"id": i, "user_id": 1, "transaction_type": "request_payout",
+               "amount": "10.0", "transaction_date": "25.09.2024, 09:39"}
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_batches_rows_into_chunks():
+    chunks = await collect(to_ndjson(rows(5), chunk_rows=2))
+
+    assert len(chunks) == 3
+    lines = "".join(chunks).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_csv_sends_header_first():
+    chunks = await collect(to_csv(rows(3), chunk_rows=2))
+
+    assert chunks[0] == "id,user_id,transaction_type,amount,transaction_date\r\n"
+    assert len(chunks) == 3
+    assert "".join(chunks).count("request_payout") == 3
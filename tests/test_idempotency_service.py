@@ -0,0 +1,161 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.dialects import postgresql
+from app.models.model import IdempotencyKey
+from app.schemas.schema import TransactionResponse
+from app.services.idempotency_service import IdempotencyService
+from app.utils.cache import TTLCache
+from app.utils.exceptions import IdempotencyKeyInProgressException, IdempotencyKeyMismatchException
+
+
+@pytest.fixture(scope="function")
+def idempotency_service(mock_session):
+    return IdempotencyService(mock_session, cache=TTLCache(max_size=10, ttl=60))
+
+
+@pytest.mark.asyncio
+async def test_run_without_key_calls_operation(idempotency_service, mock_session):
+    operation = AsyncMock(return_value=False)
+
+    result = await idempotency_service.run("create_transaction", None, operation)
+
+    assert result is False
+    operation.assert_awaited_once()
+    mock_session.execute.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_replays_cached_response(idempotency_service, mock_session):
+    response = transaction_response()
+    cached = {"request_hash": None, "response": response.model_dump(mode="json")}
+    idempotency_service.cache.set(("create_transaction", "key-1"), cached)
+    operation = AsyncMock()
+
+    result = await idempotency_service.run("create_transaction", "key-1", operation)
+
+    assert result == response
+    operation.assert_not_called()
+    mock_session.execute.assert_not_called()
+
+
+def compiled(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.asyncio
+async def test_begin_reuses_only_expired_keys(idempotency_service, mock_session):
+    reserved = MagicMock()
+    reserved.scalar.return_value = 1
+    mock_session.execute.return_value = reserved
+
+    assert await idempotency_service.begin("create_transaction:1", "key-1", "hash") is None
+
+    statement = compiled(mock_session.execute.await_args.args[0])
+    assert "ON CONFLICT (scope, key) DO UPDATE" in statement
+    assert "WHERE idempotency_keys.created_at < now() - " in statement
+    assert "response IS NULL" not in statement
+    mock_session.commit.assert_not_called()
+
+
+def transaction_response() -> TransactionResponse:
+    return TransactionResponse(id=1, user_id=1, transaction_type="credit",
+                               amount=100, transaction_date="2024-09-25, 09:39")
+
+
+@pytest.mark.asyncio
+async def test_run_stores_the_response_in_the_commit_of_the_operation(idempotency_service,
+                                                                     mock_session):
+    reserved = MagicMock()
+    reserved.scalar.return_value = 1
+    mock_session.execute.return_value = reserved
+    response = transaction_response()
+    statements = []
+
+    async def operation():
+        statements.append("operation")
+        mock_session.commit.assert_not_called()
+        return response
+
+    result = await idempotency_service.run("create_transaction:1", "key-1", operation, "hash")
+
+    assert result == response
+    executed = [compiled(call.args[0]) for call in mock_session.execute.await_args_list]
+    assert executed[0].startswith("INSERT INTO idempotency_keys")
+    assert executed[1].startswith("UPDATE idempotency_keys SET response=")
+    assert statements == ["operation"]
+    mock_session.commit.assert_awaited_once()
+    assert idempotency_service.cache.get(("create_transaction:1", "key-1"))["request_hash"] \
+        == "hash"
+
+
+@pytest.mark.asyncio
+async def test_run_rolls_the_reservation_back_with_a_failed_operation(idempotency_service,
+                                                                      mock_session):
+    reserved = MagicMock()
+    reserved.scalar.return_value = 1
+    mock_session.execute.return_value = reserved
+
+    with pytest.raises(RuntimeError):
+        await idempotency_service.run("create_transaction:1", "key-1",
+                                      AsyncMock(side_effect=RuntimeError("down")), "hash")
+
+    mock_session.commit.assert_not_called()
+    mock_session.rollback.assert_awaited_once()
+    assert idempotency_service.cache.get(("create_transaction:1", "key-1")) is None
+
+
+@pytest.mark.asyncio
+async def test_run_releases_the_key_of_an_error_response(idempotency_service, mock_session):
+    reserved = MagicMock()
+    reserved.scalar.return_value = 1
+    mock_session.execute.return_value = reserved
+    error = {"status": "error", "message": "Insufficient balance for withdrawal"}
+
+    result = await idempotency_service.run("request_payout:1", "key-1",
+                                           AsyncMock(return_value=error), "hash")
+
+    assert result == error
+    executed = compiled(mock_session.execute.await_args.args[0])
+    assert executed.startswith("DELETE FROM idempotency_keys")
+    mock_session.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_begin_rejects_a_key_reused_with_another_request(idempotency_service,
+                                                             mock_session):
+    conflict, stored = MagicMock(), MagicMock()
+    conflict.scalar.return_value = None
+    stored.scalars.return_value.first.return_value = IdempotencyKey(
+        scope="create_transaction:1", key="key-1", request_hash="first", response=None)
+    mock_session.execute.side_effect = [conflict, stored]
+
+    with pytest.raises(IdempotencyKeyMismatchException):
+        await idempotency_service.begin("create_transaction:1", "key-1", "second")
+
+
+@pytest.mark.asyncio
+async def test_begin_reports_a_reservation_without_response(idempotency_service, mock_session):
+    conflict, stored = MagicMock(), MagicMock()
+    conflict.scalar.return_value = None
+    stored.scalars.return_value.first.return_value = IdempotencyKey(
+        scope="create_transaction:1", key="key-1", request_hash="same", response=None)
+    mock_session.execute.side_effect = [conflict, stored]
+
+    with pytest.raises(IdempotencyKeyInProgressException):
+        await idempotency_service.begin("create_transaction:1", "key-1", "same")
+
+
+def test_fingerprint_ignores_key_order():
+    assert IdempotencyService.fingerprint({"a": 1, "b": "x"}) \
+        == IdempotencyService.fingerprint({"b": "x", "a": 1})
+    assert IdempotencyService.fingerprint({"a": 1}) != IdempotencyService.fingerprint({"a": 2})
+
+
+@pytest.mark.asyncio
+async def test_purge_expired_deletes_old_keys(idempotency_service, mock_session):
+    mock_session.execute.return_value = MagicMock(rowcount=3)
+
+    assert await idempotency_service.purge_expired() == 3
+    statement = compiled(mock_session.execute.await_args.args[0])
+    assert statement.startswith("DELETE FROM idempotency_keys WHERE idempotency_keys.created_at <")
+    mock_session.commit.assert_awaited_once()
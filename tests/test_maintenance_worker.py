@@ -0,0 +1,90 @@
+import pytest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from app.core.config import settings
+from app.services.maintenance_worker import (MaintenanceWorker, maintenance_worker,
+                                             create_transaction_partitions)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_on_their_interval():
+    clock = FakeClock()
+    worker = MaintenanceWorker(tick=1, clock=clock)
+    hourly, daily = AsyncMock(), AsyncMock()
+    worker.add("hourly", 3600, hourly)
+    worker.add("daily", 86400, daily)
+
+    assert await worker.run_due() == ["hourly", "daily"]
+    clock.now = 3599
+    assert await worker.run_due() == []
+    clock.now = 3600
+    assert await worker.run_due() == ["hourly"]
+    assert hourly.await_count == 2
+    assert daily.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_job_does_not_stop_the_others():
+    worker = MaintenanceWorker(tick=1, clock=FakeClock())
+    healthy = AsyncMock()
+    worker.add("broken", 60, AsyncMock(side_effect=RuntimeError("down")))
+    worker.add("healthy", 60, healthy)
+
+    assert await worker.run_due() == ["broken", "healthy"]
+    healthy.assert_awaited_once()
+    assert [job["failures"] for job in worker.stats()["jobs"]] == [1, 0]
+
+
+def test_partitions_are_created_on_a_timer():
+    [job] = [job for job in maintenance_worker.jobs
+             if job.name == "create-transaction-partitions"]
+    assert job.interval == settings.TRANSACTION_PARTITION_INTERVAL_SECONDS
+    assert job.run is create_transaction_partitions
+
+
+@pytest.mark.asyncio
+async def test_create_transaction_partitions_locks_before_creating(monkeypatch):
+    calls = []
+    conn = AsyncMock()
+
+    @asynccontextmanager
+    async def begin():
+        yield conn
+
+    async def lock_partitions(connection):
+        calls.append("lock")
+
+    async def ensure_partitions(connection, months_ahead):
+        calls.append(("ensure", months_ahead))
+        return ["transactions_y2025m01"]
+
+    monkeypatch.setattr("app.services.maintenance_worker.engine", SimpleNamespace(begin=begin))
+    monkeypatch.setattr("app.services.maintenance_worker.lock_partitions", lock_partitions)
+    monkeypatch.setattr("app.services.maintenance_worker.ensure_partitions", ensure_partitions)
+
+    assert await create_transaction_partitions() == ["transactions_y2025m01"]
+    assert calls == ["lock", ("ensure", settings.TRANSACTION_PARTITION_MONTHS_AHEAD)]
+
+
+@pytest.mark.asyncio
+async def test_postponed_job_waits_one_interval():
+    clock = FakeClock()
+    worker = MaintenanceWorker(tick=1, clock=clock)
+    daily = AsyncMock()
+    worker.add("daily", 86400, daily)
+    clock.now = 100
+
+    worker.postpone("daily")
+
+    assert await worker.run_due() == []
+    clock.now = 86500
+    assert await worker.run_due() == ["daily"]
@@ -0,0 +1,67 @@
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine, text
+from app.utils.metrics import MetricsRegistry, MetricsMiddleware, QueryStats, instrument_engine
+
+
+def metrics_app(registry: MetricsRegistry, debug_headers: bool = True) -> FastAPI:
+    engine = create_engine("sqlite://")
+    instrument_engine(engine, registry)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, registry=registry, debug_headers=debug_headers)
+
+    @app.get("/users/{user_id}/")
+    async def get_user(user_id: int):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        return {"id": user_id}
+
+    return app
+
+
+@pytest.mark.asyncio
+async def test_middleware_records_requests_per_route_template():
+    registry = MetricsRegistry()
+    app = metrics_app(registry)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/users/1/")
+        await client.get("/users/2/")
+        await client.get("/missing/")
+
+    assert response.headers["X-DB-Query-Count"] == "2"
+    assert float(response.headers["X-DB-Time-Ms"]) >= 0
+    assert registry.requests[("GET", "/users/{user_id}/", 200)] == 2
+    assert registry.requests[("GET", "unmatched", 404)] == 1
+    assert registry.request_queries[("GET", "/users/{user_id}/")] == 4
+    assert registry.query_latency.count == 4
+
+
+@pytest.mark.asyncio
+async def test_debug_headers_are_off_by_default():
+    app = metrics_app(MetricsRegistry(), debug_headers=False)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/users/1/")
+
+    assert "X-DB-Query-Count" not in response.headers
+
+
+def test_render_uses_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.observe_request("GET", "/users/{user_id}/", 200, 0.02, QueryStats(3, 0.004))
+    registry.observe_query(0.004)
+
+    body = registry.render()
+
+    assert "# TYPE http_requests_total counter" in body
+    assert 'http_requests_total{method="GET",route="/users/{user_id}/",status="200"} 1' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/users/{user_id}/",' \
+           'le="0.01"} 0' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/users/{user_id}/",' \
+           'le="0.025"} 1' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/users/{user_id}/"} 1' in body
+    assert 'http_request_db_queries_total{method="GET",route="/users/{user_id}/"} 3' in body
+    assert 'db_query_duration_seconds_bucket{le="+Inf"} 1' in body
@@ -0,0 +1,53 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+from sqlalchemy import select
+from app.models.model import Transaction
+from app.schemas.pagination import PageParams, PaginationResponse
+from app.utils.exceptions import InvalidCursorException
+from app.utils.pagination import Pagination
+
+
+def transactions(count):
+    return [Transaction(id=i, user_id=1, transaction_type="credit", amount=10.0,
+                        transaction_date=datetime(2024, 9, i, tzinfo=timezone.utc))
+            for i in range(1, count + 1)]
+
+
+@pytest.mark.asyncio
+async def test_query_pagination_loads_only_the_page(mock_session):
+    page, count = MagicMock(), MagicMock()
+    page.scalars.return_value.all.return_value = transactions(3)
+    count.scalar_one.return_value = 40
+    mock_session.execute.side_effect = [page, count]
+    pagination = Pagination(
+        PageParams(page=1, size=2), schema=PaginationResponse,
+        query=select(Transaction).where(Transaction.user_id == 1), session=mock_session,
+        keyset=(Transaction.transaction_date, Transaction.id))
+
+    result = await pagination.get_pagination()
+
+    page_stmt = mock_session.execute.await_args_list[0].args[0]
+    assert page_stmt._limit == 3
+    assert [item.id for item in result.result] == [1, 2]
+    assert result.total_items == 40
+    assert result.total_pages == 20
+    assert result.next_cursor is not None
+
+
+def test_cursor_round_trip():
+    first = Pagination(PageParams(), schema=PaginationResponse,
+                       keyset=(Transaction.transaction_date, Transaction.id))
+    cursor = first.encode_cursor(transactions(2)[-1])
+    second = Pagination(PageParams(cursor=cursor), schema=PaginationResponse,
+                        keyset=(Transaction.transaction_date, Transaction.id))
+
+    assert second.decode_cursor() == [datetime(2024, 9, 2, tzinfo=timezone.utc), 2]
+
+
+def test_invalid_cursor_is_rejected():
+    pagination = Pagination(PageParams(cursor="not-a-cursor"), schema=PaginationResponse,
+                            keyset=(Transaction.transaction_date, Transaction.id))
+
+    with pytest.raises(InvalidCursorException):
+        pagination.decode_cursor()
@@ -0,0 +1,78 @@
+import pytest
+from datetime import date
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.dialects import postgresql
+from app.db.partitions import (
+    add_months, partition_name, partition_month, create_partition_ddl,
+    ensure_partitions, detach_partitions, lock_partitions
+)
+
+
+def connection(partitions: list) -> AsyncMock:
+    conn = AsyncMock()
+    listing = MagicMock()
+    listing.scalars.return_value.all.return_value = partitions
+    conn.execute.side_effect = [listing] + [MagicMock()] * 20
+    return conn
+
+
+def executed(conn: AsyncMock) -> list:
+    return [str(call.args[0]) for call in conn.execute.call_args_list[1:]]
+
+
+def test_add_months_crosses_years():
+    assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+
+def test_partition_name_round_trip():
+    assert partition_name(date(2024, 3, 1)) == "transactions_y2024m03"
+    assert partition_month("transactions_y2024m03") == date(2024, 3, 1)
+    assert partition_month("transactions_default") is None
+
+
+def test_create_partition_ddl_uses_utc_month_bounds():
+    ddl = create_partition_ddl(date(2024, 12, 1))
+
+    assert "transactions_y2024m12 PARTITION OF transactions" in ddl
+    assert "FROM ('2024-12-01 00:00:00+00') TO ('2025-01-01 00:00:00+00')" in ddl
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_creates_only_missing_months():
+    conn = connection(["transactions_default", "transactions_y2024m11"])
+
+    created = await ensure_partitions(conn, months_ahead=2, today=date(2024, 11, 20))
+
+    assert created == ["transactions_y2024m12", "transactions_y2025m01"]
+    assert len(executed(conn)) == 2
+
+
+@pytest.mark.asyncio
+async def test_detach_partitions_keeps_recent_months_and_default():
+    conn = connection(["transactions_default", "transactions_y2024m08",
+                       "transactions_y2024m09", "transactions_y2024m10"])
+
+    detached = await detach_partitions(conn, keep_months=2, today=date(2024, 11, 5))
+
+    assert detached == ["transactions_y2024m08"]
+    assert executed(conn) == ["ALTER TABLE transactions DETACH PARTITION transactions_y2024m08"]
+
+
+@pytest.mark.asyncio
+async def test_detach_partitions_can_drop_them():
+    conn = connection(["transactions_y2024m01"])
+
+    await detach_partitions(conn, keep_months=1, drop=True, today=date(2024, 11, 5))
+
+    assert executed(conn)[-1] == "DROP TABLE transactions_y2024m01"
+
+
+@pytest.mark.asyncio
+async def test_lock_partitions_takes_a_transaction_lock():
+    conn = AsyncMock()
+
+    await lock_partitions(conn)
+
+    statement = conn.execute.await_args.args[0].compile(dialect=postgresql.dialect())
+    assert str(statement).startswith("SELECT pg_advisory_xact_lock(")
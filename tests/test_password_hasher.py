@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import MagicMock
+from passlib.context import CryptContext
+from app.services.authentication import AuthService
+from app.utils.exceptions import PasswordHasherBusyException
+from app.utils.password_hasher import PasswordHasher
+
+
+def make_hasher(rounds=4, max_workers=2, max_queue=2):
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return PasswordHasher(context, max_workers=max_workers, max_queue=max_queue)
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_run_on_the_pool():
+    hasher = make_hasher()
+
+    hashed_password = await hasher.hash("secret")
+
+    assert await hasher.verify("secret", hashed_password)
+    assert not await hasher.verify("wrong", hashed_password)
+    assert hasher.stats()["completed"] == 3
+    hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_verify_and_update_rehashes_a_changed_work_factor():
+    old_hash = await make_hasher(rounds=4).hash("secret")
+    hasher = make_hasher(rounds=5)
+
+    valid, new_hash = await hasher.verify_and_update("secret", old_hash)
+
+    assert valid
+    assert new_hash.startswith("$2b$05$")
+    assert hasher.stats()["rehashed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_calls_beyond_the_queue_are_rejected():
+    hasher = make_hasher(max_workers=1, max_queue=0)
+    # one hash is already running on the only worker
+    hasher.in_flight = 1
+
+    with pytest.raises(PasswordHasherBusyException):
+        await hasher.hash("secret")
+    assert hasher.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_authenticate_user_stores_the_rehashed_password(mock_session, monkeypatch):
+    async def verify_and_update_password(password, hashed_password):
+        return True, "new-hash"
+
+    monkeypatch.setattr("app.services.authentication.verify_and_update_password",
+                        verify_and_update_password)
+    current_user = MagicMock(email="user@example.com", hashed_password="old-hash")
+
+    token = await AuthService(mock_session).authenticate_user(
+        MagicMock(password="secret"), current_user)
+
+    assert token
+    assert current_user.hashed_password == "new-hash"
+    mock_session.commit.assert_awaited_once()
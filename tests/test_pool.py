@@ -0,0 +1,45 @@
+import pytest
+from unittest.mock import MagicMock
+from sqlalchemy import exc
+from app.db.pool import InstrumentedQueuePool
+
+
+def make_pool(pool_size=1, max_overflow=0):
+    return InstrumentedQueuePool(MagicMock, pool_size=pool_size,
+                                 max_overflow=max_overflow, timeout=0.01)
+
+
+def test_checkouts_are_counted_in_the_histogram():
+    pool = make_pool(pool_size=2)
+
+    first = pool.connect()
+    second = pool.connect()
+    stats = pool.stats()
+
+    assert stats["checked_out"] == 2
+    assert stats["checkouts"] == 2
+    assert stats["checkout_seconds_histogram"]["+Inf"] == 2
+    first.close()
+    second.close()
+    assert pool.stats()["checked_in"] == 2
+
+
+def test_exhausted_pool_records_the_wait_and_timeout():
+    pool = make_pool(pool_size=1)
+    connection = pool.connect()
+
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+
+    stats = pool.stats()
+    assert stats["waits"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["max_wait_seconds"] >= 0.01
+    connection.close()
+
+
+def test_metrics_survive_a_recreate():
+    pool = make_pool()
+    pool.connect().close()
+
+    assert pool.recreate().stats()["checkouts"] == 1
@@ -0,0 +1,42 @@
+import pytest
+from unittest.mock import MagicMock
+from sqlalchemy.dialects import postgresql
+from app.utils.referral_codes import ReferralCodePool, permute, referral_code
+
+KEY = b"test-key"
+
+
+def test_codes_of_distinct_values_never_collide():
+    codes = {referral_code(value, KEY) for value in range(1, 20001)}
+
+    assert len(codes) == 20000
+    assert all(len(code) == 8 for code in codes)
+
+
+def test_permutation_covers_the_whole_code_space():
+    with pytest.raises(ValueError):
+        permute(1 << 40, KEY)
+    assert permute((1 << 40) - 1, KEY) < 1 << 40
+
+
+@pytest.mark.asyncio
+async def test_pool_serves_reserved_values_without_a_query(mock_session):
+    pool = ReferralCodePool(MagicMock(), KEY, size=0, refill_at=0)
+    pool._values.extend([5, 6])
+
+    code = await pool.next_code(mock_session)
+
+    assert code == referral_code(5, KEY)
+    mock_session.scalar.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_empty_pool_falls_back_to_nextval(mock_session):
+    pool = ReferralCodePool(MagicMock(), KEY, size=0, refill_at=0)
+    mock_session.scalar.return_value = 42
+
+    code = await pool.next_code(mock_session)
+
+    assert code == referral_code(42, KEY)
+    statement = mock_session.scalar.await_args.args[0]
+    assert "nextval('referral_code_seq')" in str(statement.compile(dialect=postgresql.dialect()))
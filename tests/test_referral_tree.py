@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import MagicMock
+from sqlalchemy.dialects import postgresql
+from app.services.referral_tree import ReferralTree, AncestorCache
+
+
+@pytest.fixture(scope="function")
+def referral_tree(mock_session):
+    return ReferralTree(mock_session, cache=AncestorCache(max_size=100, ttl=60))
+
+
+@pytest.mark.asyncio
+async def test_link_inserts_all_paths_in_one_statement(referral_tree, mock_session):
+    await referral_tree.link(1, 2)
+
+    mock_session.execute.assert_awaited_once()
+    statement = str(mock_session.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert statement.startswith("INSERT INTO referral_paths")
+    mock_session.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_uplines_caches_the_lookup(referral_tree, mock_session):
+    rows = MagicMock()
+    rows.all.return_value = [(3, 2, 1), (3, 1, 2)]
+    mock_session.execute.return_value = rows
+
+    first = await referral_tree.get_uplines([3, 4], max_depth=2)
+    second = await referral_tree.get_uplines([3, 4], max_depth=2)
+
+    mock_session.execute.assert_awaited_once()
+    assert first == second == {3: [(2, 1), (1, 2)], 4: []}
+
+
+@pytest.mark.asyncio
+async def test_get_uplines_is_not_cached_across_a_tree_change(referral_tree, mock_session):
+    rows = MagicMock()
+    rows.all.return_value = [(3, 2, 1)]
+
+    async def execute(statement):
+        # the tree changes while the upline is being read
+        referral_tree.cache.invalidate()
+        return rows
+
+    mock_session.execute.side_effect = execute
+    await referral_tree.get_uplines([3], max_depth=2)
+
+    assert referral_tree.cache.get(3, 2) is None
+
+
+@pytest.mark.asyncio
+async def test_rebuild_stops_at_a_referral_cycle(referral_tree, mock_session):
+    await referral_tree.rebuild()
+
+    statement = str(mock_session.execute.await_args_list[1].args[0].compile(
+        dialect=postgresql.dialect()))
+    assert "WHERE referrals.referrer_id != referrals.referred_id" in statement
+    assert "WHERE referrals.referred_id != ALL (paths.path)" in statement
+    assert "GROUP BY paths.ancestor_id, paths.descendant_id" in statement
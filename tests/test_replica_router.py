@@ -0,0 +1,69 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import database
+from app.db.database import ReplicaRouter, open_read_session
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_router(replicas=2, clock=None):
+    engines = [MagicMock() for _ in range(replicas)]
+    return ReplicaRouter(engines, cooldown=30, clock=clock or FakeClock())
+
+
+def test_candidates_rotate_round_robin():
+    router = make_router()
+
+    assert router.candidates() == [0, 1]
+    assert router.candidates() == [1, 0]
+
+
+def test_failed_replica_is_skipped_for_the_cooldown():
+    clock = FakeClock()
+    router = make_router(clock=clock)
+
+    router.mark_failed(0)
+
+    assert router.candidates() == [1]
+    clock.now = 31
+    assert sorted(router.candidates()) == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_open_read_session_fails_over_to_the_primary(monkeypatch):
+    router = make_router(replicas=1)
+    replica_session = AsyncMock(spec=AsyncSession)
+    replica_session.connection.side_effect = OSError("connection refused")
+    router.session_makers = [lambda: replica_session]
+    primary_session = AsyncMock(spec=AsyncSession)
+    primary_session.__aenter__.return_value = primary_session
+    monkeypatch.setattr(database, "replica_router", router)
+    monkeypatch.setattr(database, "async_session_maker", lambda: primary_session)
+
+    async with open_read_session() as session:
+        assert session is primary_session
+
+    replica_session.close.assert_awaited_once()
+    assert router.failures == [1]
+
+
+@pytest.mark.asyncio
+async def test_open_read_session_prefers_the_primary_after_a_write(monkeypatch):
+    router = make_router(replicas=1)
+    router.session_makers = [MagicMock()]
+    primary_session = AsyncMock(spec=AsyncSession)
+    primary_session.__aenter__.return_value = primary_session
+    monkeypatch.setattr(database, "replica_router", router)
+    monkeypatch.setattr(database, "async_session_maker", lambda: primary_session)
+
+    async with open_read_session(prefer_primary=True) as session:
+        assert session is primary_session
+
+    router.session_makers[0].assert_not_called()
@@ -0,0 +1,93 @@
+import pytest
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from unittest.mock import MagicMock
+from sqlalchemy.dialects import postgresql
+from app.models.model import Transaction
+from app.services.rollup_service import RollupService
+
+
+def compiled(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect(),
+                                 compile_kwargs={"render_postcompile": True}))
+
+
+def test_rollup_day_uses_the_rollup_timezone():
+    # 23:30 UTC is already the next day in Kyiv
+    assert RollupService.rollup_day(datetime(2024, 6, 30, 23, 30, tzinfo=timezone.utc)) \
+        == date(2024, 7, 1)
+
+
+@pytest.mark.asyncio
+async def test_credit_bonuses_adds_rollups_per_line_and_day(transaction_service, mock_session):
+    uplines, wallets = MagicMock(), MagicMock()
+    uplines.all.return_value = [(3, 2, 1), (3, 1, 2)]
+    wallets.all.return_value = []
+    mock_session.execute.side_effect = [uplines, wallets, MagicMock(), MagicMock()]
+    purchase_date = datetime(2024, 7, 1, 10, 0, tzinfo=timezone.utc)
+    transactions = [
+        Transaction(id=1, user_id=3, transaction_type="credit", amount=100.0,
+                    transaction_date=purchase_date, bonus_pending=True),
+        Transaction(id=2, user_id=3, transaction_type="credit", amount=50.0,
+                    transaction_date=purchase_date, bonus_pending=True),
+    ]
+
+    await transaction_service._credit_bonuses(transactions)
+
+    rollup_stmt = mock_session.execute.await_args_list[2].args[0]
+    assert "INSERT INTO bonus_daily_rollups" in compiled(rollup_stmt)
+    assert "ON CONFLICT (user_id, line, day) DO UPDATE" in compiled(rollup_stmt)
+    params = rollup_stmt.compile(dialect=postgresql.dialect()).params
+    # the rows are sorted by referrer, line and day
+    assert (params["user_id_m0"], params["line_m0"], params["amount_m0"]) == (1, 2, Decimal("7.50"))
+    assert (params["user_id_m1"], params["line_m1"], params["amount_m1"]) == (2, 1, Decimal("15.00"))
+    assert params["purchases_m1"] == 2
+    assert params["day_m1"] == date(2024, 7, 1)
+
+
+@pytest.mark.asyncio
+async def test_bonus_summary_pivots_lines_per_period(transaction_service, mock_session):
+    totals = MagicMock()
+    totals.all.return_value = [
+        (date(2024, 7, 1), 1, Decimal("10.00"), 2),
+        (date(2024, 7, 1), 2, Decimal("2.50"), 1),
+        (date(2024, 8, 1), 1, Decimal("5.00"), 1),
+    ]
+    mock_session.execute.return_value = totals
+
+    summary = await transaction_service.get_bonus_summary(3, "01-07-2024", None, "month")
+
+    statement = compiled(mock_session.execute.await_args.args[0])
+    assert "FROM bonus_daily_rollups" in statement
+    assert "date_trunc('month'" in statement
+    assert [item.period for item in summary.items] == [date(2024, 7, 1), date(2024, 8, 1)]
+    assert summary.items[0].first_line == Decimal("10.00")
+    assert summary.items[0].second_line == Decimal("2.50")
+    assert summary.items[0].purchases == 3
+    assert summary.first_line == Decimal("15.00")
+    assert summary.total == Decimal("17.50")
+
+
+@pytest.mark.asyncio
+async def test_payout_summary_reads_the_rollup(transaction_service, mock_session):
+    totals = MagicMock()
+    totals.all.return_value = [(date(2024, 7, 1), Decimal("40.00"), 2)]
+    mock_session.execute.return_value = totals
+
+    summary = await transaction_service.get_payout_summary(3, None, "31-07-2024", "week")
+
+    assert "FROM payout_daily_rollups" in compiled(mock_session.execute.await_args.args[0])
+    assert summary.total == Decimal("40.00")
+    assert summary.items[0].payouts == 2
+
+
+@pytest.mark.asyncio
+async def test_rebuild_replaces_both_rollups_in_one_commit(mock_session):
+    await RollupService(mock_session).rebuild({1: 0.10, 2: 0.05}, 10.0)
+
+    statements = [compiled(call.args[0]) for call in mock_session.execute.await_args_list]
+    assert statements[0].startswith("DELETE FROM bonus_daily_rollups")
+    assert statements[1].startswith("DELETE FROM payout_daily_rollups")
+    assert "JOIN referral_paths" in statements[2]
+    assert "GROUP BY transactions.user_id" in statements[3]
+    mock_session.commit.assert_awaited_once()
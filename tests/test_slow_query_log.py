@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.util import greenlet_spawn
+from app.utils.slow_query_log import (SlowQueryLog, RateLimiter, explainable, analyzable,
+                                      explain_prefix, find_caller, redact_parameters)
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+SERVICE = '''
+def lookup(engine):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def find():
+    return await greenlet_spawn(find_caller)
+'''
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def service():
+    """a module of the application as far as the caller lookup can tell"""
+    namespace = {"__name__": "app.services.example_service", "text": text,
+                 "greenlet_spawn": greenlet_spawn, "find_caller": find_caller}
+    exec(compile(SERVICE, "example_service.py", "exec"), namespace)
+    return namespace
+
+
+def slow_query_records(caplog):
+    return [record.getMessage() for record in caplog.records
+            if record.getMessage().startswith("Slow query")]
+
+
+def test_redact_parameters_hides_strings():
+    parameters = (7, "user@example.com", [1, 2], date(2024, 1, 1), None, b"hash")
+    assert redact_parameters(parameters) == (
+        7, "<redacted>", [1, 2], date(2024, 1, 1), None, "<redacted>")
+    assert redact_parameters({"email": "a@b.c", "id": 3}) == {"email": "<redacted>", "id": 3}
+    assert redact_parameters([(1, "a"), (2, "b")], executemany=True) == "<2 parameter sets>"
+
+
+def test_explainable_statements():
+    assert explainable("SELECT id FROM users WHERE id = $1")
+    assert explainable("INSERT INTO wallet (user_id) VALUES ($1)")
+    assert not explainable("SET LOCAL statement_timeout = 5000")
+    assert not explainable("COMMIT")
+
+
+def test_analyzable_only_reads():
+    assert analyzable("SELECT id FROM users WHERE id = $1")
+    assert analyzable("WITH uplines AS (SELECT 1) SELECT * FROM uplines")
+    assert not analyzable("INSERT INTO wallet (user_id) VALUES ($1)")
+    assert not analyzable("WITH moved AS (DELETE FROM t RETURNING id) SELECT * FROM moved")
+    assert not analyzable("SELECT id FROM transactions FOR UPDATE SKIP LOCKED")
+
+
+def test_volatile_functions_are_not_analyzed():
+    assert not analyzable("SELECT nextval('referral_code_seq') FROM generate_series(1, $1)")
+    assert not analyzable("SELECT setval('referral_code_seq', $1)")
+    assert not analyzable("SELECT pg_advisory_xact_lock($1)")
+    assert not analyzable("SELECT pg_try_advisory_lock($1)")
+    assert explain_prefix("SELECT pg_advisory_xact_lock($1)") == "EXPLAIN "
+    assert explain_prefix("SELECT id FROM users") == "EXPLAIN (ANALYZE, BUFFERS) "
+
+
+def test_rate_limiter_counts_suppressed():
+    clock = Clock()
+    limiter = RateLimiter(2, period=60, clock=clock)
+    assert [limiter.allow() for _ in range(4)] == [True, True, False, False]
+    assert limiter.take_suppressed() == 2
+    assert limiter.take_suppressed() == 0
+    clock.now = 60
+    assert limiter.allow()
+
+
+def test_slow_statement_is_logged_with_caller(caplog, service):
+    engine = create_engine("sqlite://")
+    SlowQueryLog(0).install(engine)
+    with caplog.at_level(logging.WARNING, logger="app.utils.slow_query_log"):
+        service["lookup"](engine)
+    [message] = slow_query_records(caplog)
+    assert "in app.services.example_service.lookup:4" in message
+    assert message.endswith(": SELECT 1 parameters=()")
+
+
+def test_fast_statement_is_not_logged(caplog):
+    engine = create_engine("sqlite://")
+    SlowQueryLog(10_000).install(engine)
+    with caplog.at_level(logging.WARNING, logger="app.utils.slow_query_log"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    assert slow_query_records(caplog) == []
+
+
+def test_skip_option_keeps_statements_out(caplog):
+    engine = create_engine("sqlite://")
+    SlowQueryLog(0).install(engine)
+    with caplog.at_level(logging.WARNING, logger="app.utils.slow_query_log"):
+        with engine.connect() as conn:
+            conn.execution_options(slow_query_log=False).execute(text("SELECT 1"))
+    assert slow_query_records(caplog) == []
+
+
+def test_log_is_rate_limited(caplog):
+    clock = Clock()
+    engine = create_engine("sqlite://")
+    SlowQueryLog(0, per_minute=1, clock=clock).install(engine)
+    with caplog.at_level(logging.WARNING, logger="app.utils.slow_query_log"):
+        with engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text("SELECT 1"))
+            clock.now = 60
+            conn.execute(text("SELECT 2"))
+    first, second = slow_query_records(caplog)
+    assert first.startswith("Slow query #1")
+    assert second.startswith("Slow query #2")
+    assert "(2 more were not logged)" in second
+
+
+@pytest.mark.asyncio
+async def test_caller_is_found_across_the_greenlet(service):
+    assert (await service["find"]()).startswith("app.services.example_service.find:")
+
+
+def test_sync_engine_gets_no_plan(monkeypatch):
+    engine = create_engine("sqlite://")
+    slow_query_log = SlowQueryLog(0).install(engine)
+    scheduled = []
+    monkeypatch.setattr(slow_query_log, "log_plan", lambda *args: scheduled.append(args))
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert scheduled == []
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+@pytest.mark.asyncio
+async def test_plan_is_logged(caplog):
+    engine = create_async_engine(TEST_DATABASE_URL, poolclass=NullPool)
+    slow_query_log = SlowQueryLog(0).install(engine)
+    with caplog.at_level(logging.WARNING, logger="app.utils.slow_query_log"):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT count(*) FROM generate_series(1, :n)"), {"n": 10})
+        await asyncio.gather(*slow_query_log._tasks)
+    await engine.dispose()
+    plans = [record.getMessage() for record in caplog.records
+             if record.getMessage().startswith("Plan of slow query #1")]
+    assert len(plans) == 1
+    assert "actual time" in plans[0]
+
+
+@pytest.mark.asyncio
+async def test_locking_statement_gets_a_plain_plan(caplog):
+    statements = []
+
+    class Connection:
+        async def execution_options(self, **options):
+            return self
+
+        async def begin(self):
+            return SimpleNamespace(rollback=AsyncMock())
+
+        async def exec_driver_sql(self, statement, parameters=()):
+            statements.append(statement)
+            return [("Result",)]
+
+    @asynccontextmanager
+    async def connect():
+        yield Connection()
+
+    slow_query_log = SlowQueryLog(0)
+    slow_query_log.engine = SimpleNamespace(connect=connect)
+    with caplog.at_level(logging.WARNING, logger="app.utils.slow_query_log"):
+        await slow_query_log.log_plan(1, "SELECT pg_advisory_xact_lock($1)", (7,))
+
+    assert statements[-1] == "EXPLAIN SELECT pg_advisory_xact_lock($1)"
+    assert "Plan of slow query #1:\nResult" in caplog.text
@@ -0,0 +1,53 @@
+import pytest
+from unittest.mock import MagicMock
+from app.auth.token import create_access_token
+from app.auth.token_cache import TokenCache
+from app.models.model import User
+from app.schemas.schema import AuthenticatedUser
+from app.services.authentication import AuthService
+
+
+@pytest.fixture(scope="function")
+def auth_service(mock_session):
+    return AuthService(mock_session, cache=TokenCache(max_size=100, ttl=60))
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_caches_claims_and_user(auth_service, mock_session):
+    token = create_access_token({"sub": "user@example.com"})
+    found = MagicMock()
+    found.scalars.return_value.first.return_value = User(
+        id=1, email="user@example.com", username="user", referral_code="CODE", is_active=True)
+    mock_session.execute.return_value = found
+
+    first = await auth_service.get_user_by_token(token)
+    second = await auth_service.get_user_by_token(token)
+
+    mock_session.execute.assert_awaited_once()
+    assert first == second
+    assert first.id == 1 and first.is_active
+
+
+def test_entries_do_not_outlive_the_token():
+    cache = TokenCache(max_size=100, ttl=60, clock=lambda: 1000.0)
+    user = AuthenticatedUser(id=1, referral_code="CODE")
+
+    cache.put("expired", {"sub": "a", "exp": 999}, user)
+    cache.put("valid", {"sub": "a", "exp": 1010}, user)
+
+    assert cache.get("expired") is None
+    assert cache.cache._data[cache.key("valid")][0] <= cache.cache.timer() + 10
+
+
+def test_invalidate_user_drops_all_of_its_tokens():
+    cache = TokenCache(max_size=100, ttl=60)
+    user = AuthenticatedUser(id=1, referral_code="CODE")
+    other = AuthenticatedUser(id=2, referral_code="OTHER")
+    cache.put("first", {"sub": "a"}, user)
+    cache.put("second", {"sub": "a"}, user)
+    cache.put("third", {"sub": "b"}, other)
+
+    cache.invalidate_user(1)
+
+    assert cache.get("first") is None and cache.get("second") is None
+    assert cache.get("third") is not None
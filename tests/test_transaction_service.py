@@ -1,8 +1,15 @@
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 from datetime import datetime
+from decimal import Decimal
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
 from app.schemas.schema import TransactionCreate, TransactionResponse
-from app.models.model import Transaction
+from app.models.model import Transaction, Wallet
+from app.services.transaction_service import TransactionService
+from app.utils.duplicate_guard import InMemoryDuplicateGuard
+from app.utils.balance_cache import balance_cache
+from app.utils.crud_repository import unit_of_work
 
 
 @pytest.mark.asyncio
@@ -34,3 +41,184 @@ async def test_create_transaction(transaction_service):
     assert isinstance(result, TransactionResponse)
     assert result.amount == mock_transaction.amount
     assert result.transaction_type == mock_transaction.transaction_type
+
+
+@pytest.mark.asyncio
+async def test_create_transactions_bulk_rejects_invalid_amounts(transaction_service, mock_session):
+    transactions = [
+        TransactionCreate(user_id=1, transaction_type="credit", amount=0),
+        TransactionCreate(user_id=1, transaction_type="credit", amount=-5),
+    ]
+
+    result = await transaction_service.create_transactions_bulk(transactions)
+
+    assert result.created == 0
+    assert result.rejected == 2
+    assert [item.status for item in result.results] == ["rejected", "rejected"]
+    mock_session.execute.assert_not_called()
+    mock_session.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_transactions_bulk_checks_the_duplicate_guard(mock_session):
+    guard = InMemoryDuplicateGuard(max_size=10, ttl=60, timer=lambda: 120.0)
+    guard.started_at = 0
+    guard.mark((1, "credit", 100.0))
+    users = MagicMock()
+    users.scalars.return_value.all.return_value = [1]
+    mock_session.execute.return_value = users
+    transactions = [
+        TransactionCreate(user_id=1, transaction_type="credit", amount=100.0),
+        TransactionCreate(user_id=3, transaction_type="credit", amount=50.0),
+    ]
+
+    result = await TransactionService(mock_session, guard=guard).create_transactions_bulk(
+        transactions)
+
+    assert [item.status for item in result.results] == ["duplicate", "rejected"]
+    # the warm guard answers for both keys, only the users are looked up
+    mock_session.execute.assert_awaited_once()
+    assert (3, "credit", 50.0) not in guard.cache
+
+
+@pytest.mark.asyncio
+async def test_collect_bonus_credits_groups_by_referrer(transaction_service, mock_session):
+    uplines = MagicMock()
+    uplines.all.return_value = [(3, 2, 1), (3, 1, 2)]
+    mock_session.execute.return_value = uplines
+    transactions = [
+        Transaction(id=1, user_id=3, transaction_type="credit", amount=100.0),
+        Transaction(id=2, user_id=3, transaction_type="credit", amount=50.0),
+    ]
+
+    wallet_credits = await transaction_service.collect_bonus_credits(transactions)
+
+    mock_session.execute.assert_awaited_once()
+    assert "referral_paths" in str(mock_session.execute.await_args.args[0])
+    assert wallet_credits[2]["first_line"] == Decimal("15.00")
+    assert wallet_credits[2]["purchases"] == 2
+    assert wallet_credits[1]["second_line"] == Decimal("7.50")
+    assert wallet_credits[1]["balance"] == Decimal("7.50")
+
+
+@pytest.mark.asyncio
+async def test_update_wallet_balance_is_one_upsert(transaction_service, mock_session):
+    upserted = MagicMock()
+    upserted.all.return_value = [{"user_id": 1, "balance": Decimal("10.00"),
+                                  "first_line": Decimal("10.00"),
+                                  "second_line": Decimal("0.00"), "purchases": 1}]
+    mock_session.execute.return_value = upserted
+
+    await transaction_service.update_wallet_balance(1, 10.0, line="first")
+
+    mock_session.execute.assert_awaited_once()
+    statement = str(mock_session.execute.await_args.args[0])
+    assert "ON CONFLICT (user_id) DO UPDATE" in statement
+    mock_session.commit.assert_awaited_once()
+    assert balance_cache.get(1).balance == Decimal("10.00")
+
+
+@pytest.mark.asyncio
+async def test_process_pending_bonuses_commits_once(transaction_service, mock_session):
+    pending, referrals = MagicMock(), MagicMock()
+    pending.scalars.return_value.all.return_value = [
+        Transaction(id=1, user_id=3, transaction_type="credit", amount=100.0, bonus_pending=True)
+    ]
+    referrals.all.return_value = []
+    mock_session.execute.side_effect = [pending, referrals, MagicMock()]
+
+    processed = await transaction_service.process_pending_bonuses([1])
+
+    assert processed == 1
+    select_pending = mock_session.execute.await_args_list[0].args[0]
+    assert "FOR UPDATE SKIP LOCKED" in str(select_pending.compile(dialect=postgresql.dialect()))
+    assert "UPDATE transactions" in str(mock_session.execute.await_args_list[-1].args[0])
+    mock_session.commit.assert_awaited_once()
+
+
+def wallet_lookup(balance: str) -> MagicMock:
+    lookup = MagicMock()
+    lookup.scalars.return_value.first.return_value = Wallet(user_id=3, balance=Decimal(balance))
+    return lookup
+
+
+@pytest.mark.asyncio
+async def test_request_payout_debits_with_one_conditional_update(transaction_service,
+                                                                  mock_session):
+    debited = MagicMock()
+    debited.first.return_value = {"user_id": 3, "balance": Decimal("20.00"),
+                                  "first_line": Decimal("5.00"),
+                                  "second_line": Decimal("0.00"), "purchases": 2}
+    mock_session.execute.side_effect = [wallet_lookup("50.00"), debited, MagicMock()]
+
+    async def refresh(transaction):
+        transaction.id = 7
+        transaction.transaction_date = datetime(2024, 7, 1, 12, 0)
+    mock_session.refresh.side_effect = refresh
+
+    response = await transaction_service.request_payout(3, 30.0)
+
+    assert response.id == 7
+    assert response.amount == Decimal("30.00")
+    debit = str(mock_session.execute.await_args_list[1].args[0].compile(
+        dialect=postgresql.dialect()))
+    assert "SET balance=(wallet.balance - %(balance_1)s)" in debit
+    assert "WHERE wallet.user_id = %(user_id_1)s AND wallet.balance >= " in debit
+    assert "RETURNING" in debit
+    mock_session.commit.assert_awaited_once()
+    assert balance_cache.get(3).balance == Decimal("20.00")
+
+
+@pytest.mark.asyncio
+async def test_request_payout_rejects_when_the_debit_matches_no_row(transaction_service,
+                                                                     mock_session):
+    debited = MagicMock()
+    debited.first.return_value = None
+    mock_session.execute.side_effect = [wallet_lookup("50.00"), debited]
+
+    response = await transaction_service.request_payout(3, 30.0)
+
+    assert response == {"status": "error", "message": "Insufficient balance for withdrawal"}
+    mock_session.add.assert_not_called()
+    assert balance_cache.get(3) is None
+
+
+@pytest.mark.asyncio
+async def test_request_payout_rejects_a_sub_cent_amount(transaction_service, mock_session):
+    mock_session.execute.side_effect = [wallet_lookup("50.00")]
+
+    response = await transaction_service.request_payout(3, 0.004)
+
+    assert response == {"status": "error",
+                        "message": "Withdrawal amount must be greater than zero"}
+    mock_session.execute.assert_awaited_once()
+    mock_session.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_transaction_forgets_the_key_when_the_duplicate_check_fails(mock_session):
+    guard = InMemoryDuplicateGuard(max_size=10, ttl=60)
+    mock_session.execute.side_effect = OperationalError("SELECT", {}, Exception("gone"))
+    transaction = TransactionCreate(user_id=1, transaction_type="credit", amount=100.0)
+
+    with pytest.raises(OperationalError):
+        await TransactionService(mock_session, guard=guard).create_transaction(transaction)
+
+    assert (1, "credit", 100.0) not in guard.cache
+
+
+@pytest.mark.asyncio
+async def test_create_transaction_forgets_the_key_when_the_outer_commit_fails(mock_session):
+    guard = InMemoryDuplicateGuard(max_size=10, ttl=60)
+    service = TransactionService(mock_session, guard=guard)
+    service._has_recent_duplicate = AsyncMock(return_value=False)
+    service.transaction_response = AsyncMock(return_value=True)
+    mock_session.commit.side_effect = OperationalError("COMMIT", {}, Exception("gone"))
+    transaction = TransactionCreate(user_id=1, transaction_type="credit", amount=100.0)
+
+    with pytest.raises(OperationalError):
+        async with unit_of_work(mock_session):
+            assert await service.create_transaction(transaction) is True
+            assert (1, "credit", 100.0) in guard.cache
+
+    assert (1, "credit", 100.0) not in guard.cache
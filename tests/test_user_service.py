@@ -1,8 +1,15 @@
 import pytest
-from unittest.mock import AsyncMock
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
 from app.models.model import User, Transaction
 from app.schemas.pagination import PaginationListResponse, PageParams
-from app.schemas.schema import UserCreate, UserResponse, UserTransactionsResponse
+from app.schemas.schema import (
+    UserCreate, UserResponse, UserTransactionsResponse, RegisterUserSchema
+)
+from app.utils.exceptions import GenerateReferralCodeException, UserAlreadyExistsException
 
 
 @pytest.mark.asyncio
@@ -83,3 +90,177 @@ async def test_get_all_users(user_service):
     assert result.result[0].transactions[0].transaction_type == "credit"
     assert result.result[0].transactions[0].amount == 100.0
     assert result.result[0].transactions[0].user_id == mock_transactions_user.user_id
+
+
+class FakeStreamResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+
+@pytest.mark.asyncio
+async def test_attach_transactions_groups_rows_by_user(user_service, mock_session):
+    users = [SimpleNamespace(id=1, username="user1"), SimpleNamespace(id=2, username="user2")]
+    date = datetime(2024, 9, 25, 6, 39, tzinfo=timezone.utc)
+    mock_session.stream.return_value = FakeStreamResult([
+        SimpleNamespace(id=1, user_id=1, transaction_type="credit", amount=100.0, transaction_date=date),
+        SimpleNamespace(id=2, user_id=2, transaction_type="credit", amount=50.0, transaction_date=date),
+        SimpleNamespace(id=3, user_id=1, transaction_type="debit", amount=20.0, transaction_date=date),
+    ])
+
+    result = await user_service._attach_transactions(users, transactions_limit=2)
+
+    statement = str(mock_session.stream.await_args.args[0])
+    assert "row_number() OVER (PARTITION BY transactions.user_id" in statement
+    assert [len(user["transactions"]) for user in result] == [2, 1]
+    assert result[0]["transactions"][1]["transaction_type"] == "debit"
+    assert result[0]["transactions"][0]["transaction_date"] == "25.09.2024, 09:39"
+
+
+def integrity_error(constraint_name):
+    orig = Exception("duplicate key value violates unique constraint")
+    orig.constraint_name = constraint_name
+    return IntegrityError("INSERT INTO users", {}, orig)
+
+
+def registration():
+    return RegisterUserSchema(username="user", email="user@example.com",
+                              password="secret", password_check="secret")
+
+
+@pytest.mark.asyncio
+async def test_add_user_retries_a_taken_referral_code(user_service, mock_session, monkeypatch):
+    codes = iter(["FIRST", "SECOND"])
+
+    async def next_code(session):
+        return next(codes)
+
+    monkeypatch.setattr("app.services.user_service.referral_code_pool.next_code", next_code)
+    monkeypatch.setattr("app.services.user_service.get_hash_password",
+                        lambda password: _resolved("hashed"))
+    mock_session.commit.side_effect = [integrity_error("users_referral_code_key"), None]
+
+    async def refresh(user):
+        user.id = 1
+
+    mock_session.refresh.side_effect = refresh
+
+    new_user = await user_service.add_user(registration())
+
+    assert new_user.id == 1
+    mock_session.rollback.assert_awaited_once()
+    assert mock_session.add.call_args.args[0].referral_code == "SECOND"
+
+
+@pytest.mark.asyncio
+async def test_add_user_gives_up_after_the_attempts(user_service, mock_session, monkeypatch):
+    async def next_code(session):
+        return "TAKEN"
+
+    monkeypatch.setattr("app.services.user_service.referral_code_pool.next_code", next_code)
+    monkeypatch.setattr("app.services.user_service.get_hash_password",
+                        lambda password: _resolved("hashed"))
+    mock_session.commit.side_effect = integrity_error("users_referral_code_key")
+
+    with pytest.raises(GenerateReferralCodeException):
+        await user_service.add_user(registration())
+
+
+async def _resolved(value):
+    return value
+
+
+@pytest.mark.asyncio
+async def test_add_user_maps_a_taken_email_to_its_message(user_service, mock_session, monkeypatch):
+    async def next_code(session):
+        return "CODE"
+
+    monkeypatch.setattr("app.services.user_service.referral_code_pool.next_code", next_code)
+    monkeypatch.setattr("app.services.user_service.get_hash_password",
+                        lambda password: _resolved("hashed"))
+    mock_session.commit.side_effect = integrity_error("users_email_key")
+
+    with pytest.raises(UserAlreadyExistsException) as error:
+        await user_service.add_user(registration())
+
+    assert error.value.message == "User with this email already exists"
+    mock_session.commit.assert_awaited_once()
+
+
+def get_one_by_lookup(users):
+    async def get_one_by(self, **filters):
+        if "referral_code" in filters:
+            return users.get(filters["referral_code"])
+        if "id" in filters:
+            return users.get(filters["id"])
+        return None
+    return get_one_by
+
+
+def executed(mock_session) -> list:
+    return [str(call.args[0].compile(dialect=postgresql.dialect()))
+            for call in mock_session.execute.await_args_list]
+
+
+@pytest.mark.asyncio
+async def test_create_referral_by_code_rejects_a_self_referral(user_service, mock_session,
+                                                              monkeypatch):
+    user = User(id=1, referral_code="CODE")
+    monkeypatch.setattr("app.services.user_service.CrudRepository.get_one_by",
+                        get_one_by_lookup({"CODE": user, 1: user}))
+
+    assert await user_service.create_referral_by_code("CODE", 1) == "referral_cycle"
+    [lock] = executed(mock_session)
+    assert lock.startswith("SELECT pg_advisory_xact_lock(")
+
+
+@pytest.mark.asyncio
+async def test_create_referral_by_code_rejects_a_referrer_from_the_downline(user_service,
+                                                                           mock_session,
+                                                                           monkeypatch):
+    referrer, referred = User(id=2, referral_code="CODE"), User(id=1)
+    monkeypatch.setattr("app.services.user_service.CrudRepository.get_one_by",
+                        get_one_by_lookup({"CODE": referrer, 1: referred}))
+    mock_session.scalar.return_value = True
+
+    assert await user_service.create_referral_by_code("CODE", 1) == "referral_cycle"
+    assert not any(statement.startswith("INSERT") for statement in executed(mock_session))
+    mock_session.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_referral_by_code_reports_a_concurrent_referral(user_service, mock_session,
+                                                                     monkeypatch):
+    referrer, referred = User(id=2, referral_code="CODE"), User(id=1)
+    monkeypatch.setattr("app.services.user_service.CrudRepository.get_one_by",
+                        get_one_by_lookup({"CODE": referrer, 1: referred}))
+    mock_session.scalar.return_value = False
+    mock_session.flush.side_effect = integrity_error("referrals_referred_id_key")
+
+    assert await user_service.create_referral_by_code("CODE", 1) == "has_referer"
+    mock_session.rollback.assert_awaited_once()
+    mock_session.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_non_referrals_is_an_anti_join(user_service, mock_session, monkeypatch):
+    user = User(id=3, username="user3")
+    monkeypatch.setattr("app.services.user_service.CrudRepository.get_one_by",
+                        get_one_by_lookup({3: user}))
+    rows = MagicMock()
+    rows.fetchall.return_value = [SimpleNamespace(id=1, username="user1")]
+    mock_session.execute.return_value = rows
+
+    result = await user_service.get_non_referrals(3)
+
+    statement = str(mock_session.execute.await_args.args[0].compile(
+        dialect=postgresql.dialect()))
+    assert "NOT (EXISTS (SELECT referrals.id" in statement
+    assert " IN " not in statement
+    assert [user.user_id for user in result.non_referrals] == [1]